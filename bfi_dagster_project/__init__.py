@@ -10,7 +10,7 @@ from .assets.assessment import build_assess_sequence_asset
 from .assets.get_sequences import build_target_sequences_asset
 from .assets.transcode_retry import build_transcode_retry_asset
 from .assets.transcoding import build_transcode_ffv1_asset
-from .sensors import build_failed_encoding_retry_sensor
+from .sensors import build_failed_encoding_retry_sensor, build_sequence_discovery_sensor
 
 # Global environment variables
 DATABASE = dg.EnvVar("DATABASE").get_value()
@@ -30,18 +30,23 @@ def validate_env_vars():
 
 
 # For individual project deployment (used when deploying a single project)
-def build_project_definitions(project_id: str, cron_schedule: str):
+def build_project_definitions(project_id: str):
     """
     Build complete Definitions object for a specific project
     For use when deploying a single project rather than the full repository
+    Each sequence is a seq_id partition, added and run by the discovery sensor
     """
     validate_env_vars()
 
+    sequences = dg.DynamicPartitionsDefinition(name=f"{project_id}_sequences")
+
     # Directly create assets for this project
-    target_seq_asset = build_target_sequences_asset(project_id)
-    assess_seq_asset = build_assess_sequence_asset(project_id)
-    archive_asset = build_archiving_asset(project_id)
-    transcode_asset = build_transcode_ffv1_asset(project_id)
+    target_seq_asset = build_target_sequences_asset(
+        project_id, partitions_def=sequences
+    )
+    assess_seq_asset = build_assess_sequence_asset(project_id, partitions_def=sequences)
+    archive_asset = build_archiving_asset(project_id, partitions_def=sequences)
+    transcode_asset = build_transcode_ffv1_asset(project_id, partitions_def=sequences)
     retry_asset = build_transcode_retry_asset(project_id)
 
     # Collect valid assets
@@ -60,10 +65,13 @@ def build_project_definitions(project_id: str, cron_schedule: str):
     if not project_assets:
         raise ValueError(f"No valid assets found for project {project_id}")
 
-    # Create process job for all assets
+    # Create process job for the partitioned assets, retries run unpartitioned
     process_job = dg.define_asset_job(
         name=f"{project_id}_process_job",
-        selection=dg.AssetSelection.assets(*[asset.key for asset in project_assets]),
+        selection=dg.AssetSelection.assets(
+            *[asset.key for asset in project_assets if asset is not retry_asset]
+        ),
+        partitions_def=sequences,
     )
 
     # Create retry job if retry asset exists
@@ -75,8 +83,8 @@ def build_project_definitions(project_id: str, cron_schedule: str):
         )
         jobs.append(retry_job)
 
-    # Create sensor
-    sensors = []
+    # Create sensors
+    sensors = [build_sequence_discovery_sensor(project_id, process_job, sequences)]
     retry_sensor = build_failed_encoding_retry_sensor(project_id)
     if retry_sensor is not None:
         sensors.append(retry_sensor)
@@ -86,30 +94,25 @@ def build_project_definitions(project_id: str, cron_schedule: str):
         resources={
             "source_path": dg.EnvVar(project_id).get_value(),
             "database": resources.SQLiteResource(filepath=DATABASE),
+            "scheduler": resources.EncodeSchedulerResource(filepath=DATABASE),
+            "work_leases": resources.WorkLeaseResource(filepath=DATABASE),
             "process_pool": resources.process_pool.configured({"num_processes": 3}),
         },
         sensors=sensors,
         jobs=jobs,
-        schedules=[
-            dg.ScheduleDefinition(
-                name=f"{project_id}_schedule",
-                job=process_job,
-                cron_schedule=cron_schedule,
-            )
-        ],
     )
 
 
 # Pre-built project definitions for direct use
-project01_defs = build_project_definitions("DG1_QNAP03", "0 */2 * * *")
-project02_defs = build_project_definitions("DG2_FILM_OPS", "0 1-23/2 * * *")
-project03_defs = build_project_definitions("DG3_FILM_PRES", "10 */2 * * *")
-project04_defs = build_project_definitions("DG4_FILM_SCAN", "10 1-23/2 * * *")
-project05_defs = build_project_definitions("DG5_FILM_QC", "20 1-23/2 * * *")
-project06_defs = build_project_definitions("DG6_FILM_LAB", "20 */2 * * *")
-project07_defs = build_project_definitions("DG7_FILM_MICRL", "30 */2 * * *")
-project08_defs = build_project_definitions("DG8_DIGIOPS", "30 1-23/2 * * *")
-project09_defs = build_project_definitions("DG9_QNAP10", "40 */2 * * *")
-project10_defs = build_project_definitions("DG10_QNAP11", "40 1-23/2 * * *")
-project11_defs = build_project_definitions("DG11_QNAP06", "50 */2 * * *")
-project12_defs = build_project_definitions("DG12_EDIT_DIR", "50 1-23/2 * * *")
+project01_defs = build_project_definitions("DG1_QNAP03")
+project02_defs = build_project_definitions("DG2_FILM_OPS")
+project03_defs = build_project_definitions("DG3_FILM_PRES")
+project04_defs = build_project_definitions("DG4_FILM_SCAN")
+project05_defs = build_project_definitions("DG5_FILM_QC")
+project06_defs = build_project_definitions("DG6_FILM_LAB")
+project07_defs = build_project_definitions("DG7_FILM_MICRL")
+project08_defs = build_project_definitions("DG8_DIGIOPS")
+project09_defs = build_project_definitions("DG9_QNAP10")
+project10_defs = build_project_definitions("DG10_QNAP11")
+project11_defs = build_project_definitions("DG11_QNAP06")
+project12_defs = build_project_definitions("DG12_EDIT_DIR")
@@ -1,5 +1,7 @@
 import datetime
+import json
 import os
+import random
 import shutil
 import tarfile
 import time
@@ -8,10 +10,19 @@ from typing import Any, Dict, List, Optional
 
 import dagster as dg
 
-from . import utils
+from . import hashing, tar_stream, utils
 
+# Read back TAR members after wrap to check the TAR write against in-stream MD5s
+TAR_VERIFY = os.environ.get("TAR_VERIFY", "True").lower() not in ("0", "false", "no")
+# Source files re-read after wrap, and members pread through the
+# offset index when validating each TAR
+TAR_SAMPLE_MEMBERS = int(os.environ.get("TAR_SAMPLE_MEMBERS", "8"))
 
-def build_archiving_asset(key_prefix: Optional[str] = None):
+
+def build_archiving_asset(
+    key_prefix: Optional[str] = None,
+    partitions_def: Optional[dg.PartitionsDefinition] = None,
+):
     """
     New factory function that returns the asset with optional key prefix.
     """
@@ -29,7 +40,10 @@ def build_archiving_asset(key_prefix: Optional[str] = None):
         ins_dict["assess_seqs"] = dg.AssetIn("assess_sequence")
 
     @dg.asset(
-        key=asset_key, ins=ins_dict, required_resource_keys={"database", "process_pool"}
+        key=asset_key,
+        ins=ins_dict,
+        required_resource_keys={"database", "process_pool", "scheduler", "work_leases"},
+        partitions_def=partitions_def,
     )
     def create_tar(
         context: dg.AssetExecutionContext,
@@ -37,8 +51,8 @@ def build_archiving_asset(key_prefix: Optional[str] = None):
     ) -> dg.Output:
         """
         Receive dictionary of folder paths, selects those suitable for TAR wrap.
-        Builds MD5 manifest of sequence contents, TAR wraps file then compares
-        manifest with internal TAR checksums. Updates CID record with Python
+        TAR wraps file building the MD5 manifest in the same pass, optionally
+        reads back TAR checksums for comparison. Updates CID record with Python
         tar file statement, updates database and passes list of TAR filepaths
         to the validation asset.
         """
@@ -49,34 +63,64 @@ def build_archiving_asset(key_prefix: Optional[str] = None):
             context.log.info(f"{log_prefix}No TAR sequences to process at this time.")
             return dg.Output(value={})
 
+        # Each TAR is validated as soon as its own wrap finishes
         tar_tasks = [(folder,) for folder in assess_seqs["TAR"]]
+        success_list = []
+        results = []
+        scheduler = context.resources.scheduler
+        seq_ids = [os.path.basename(folder) for folder in assess_seqs["TAR"]]
+        # Sizes stored at assessment save validation rescanning each folder
+        sizes = context.resources.database.sequence_sizes(context, seq_ids)
+        leases = context.resources.work_leases
+        try:
+            with leases.hold(context, seq_ids, "create_tar"), scheduler.hold(context):
+                for batch in context.resources.process_pool.pipeline(
+                    tar_wrap,
+                    tar_validate,
+                    tar_tasks,
+                    lambda data: (
+                        (data["path"], sizes.get(data["sequence"]))
+                        if data["success"] is True
+                        else None
+                    ),
+                    admit=lambda task: scheduler.acquire(
+                        context, "tar", task[0], str(key_prefix)
+                    ),
+                    release=lambda slot_id: scheduler.release(context, slot_id),
+                    poll=scheduler.poll_seconds,
+                ):
+                    # Write data to log / db for everything finished since last wake
+                    entries = context.resources.database.bulk_append_to_database(
+                        context,
+                        [(data["sequence"], data["db_arguments"]) for _, data in batch],
+                    )
+                    for stage, data in batch:
+                        seq = data["sequence"]
+                        if stage == 1:
+                            context.log.info(data)
+                            if data["success"] is True:
+                                success_list.append(data["path"])
+                        else:
+                            results.append(data)
+                        context.log.info(
+                            f"{log_prefix}Written to Database: {entries.get(seq)}"
+                        )
+                        for log in data["logs"]:
+                            if "WARNING" in log:
+                                context.log.warning(f"{log_prefix} {log}")
+                            else:
+                                context.log.info(f"{log_prefix} {log}")
+        finally:
+            # Outcome of every wrap is recorded, or the run failed,
+            # so other hosts may move on
+            leases.release(context, seq_ids)
 
-        results = context.resources.process_pool.map(tar_wrap, tar_tasks)
-        completed_files = [r["path"] for r in results if r["success"] is not False]
         context.log.info(
-            f"{log_prefix}Successfully completed {len(completed_files)} TAR archives: \n{results}"
+            f"{log_prefix}Successfully completed {len(success_list)} TAR archives"
         )
-
-        success_list = []
-        for data in results:
-            context.log.info(data)
-            seq = data["sequence"]
-            if data["success"] is True:
-                success_list.append(data["path"])
-            args = data["db_arguments"]
-            entry = context.resources.database.append_to_database(context, seq, args)
-            context.log.info(f"{log_prefix}Written to Database: {entry}")
-            for log in data["logs"]:
-                if "WARNING" in log:
-                    context.log.warning(f"{log_prefix} {log}")
-                else:
-                    context.log.info(f"{log_prefix} {log}")
-
-        # Validate in function
-        if success_list is None:
+        if not success_list:
             return dg.Output(value={}, metadata={"successfully_complete": "0"})
-        validation_tasks = [(folder,) for folder in success_list]
-        results = context.resources.process_pool.map(tar_validate, validation_tasks)
+
         validated_files = {
             "valid": [r["sequence"] for r in results if r["success"] is not False],
             "invalid": [r["sequence"] for r in results if r["success"] is False],
@@ -86,18 +130,6 @@ def build_archiving_asset(key_prefix: Optional[str] = None):
             f"Invalid={len(validated_files['invalid'])}"
         )
 
-        # Write data to log / db
-        for data in results:
-            seq = data["sequence"]
-            args = data["db_arguments"]
-            entry = context.resources.database.append_to_database(context, seq, args)
-            context.log.info(f"{log_prefix}Written to Database: {entry}")
-            for log in data["logs"]:
-                if "WARNING" in log:
-                    context.log.warning(f"{log_prefix}{log}")
-                else:
-                    context.log.info(f"{log_prefix}{log}")
-
         return dg.Output(
             value={
                 "validated_files": validated_files["valid"],
@@ -114,7 +146,8 @@ def build_archiving_asset(key_prefix: Optional[str] = None):
 
 def tar_wrap(fullpath: str) -> Dict[str, Any]:
     """
-    TAR wrap under parallelisation
+    TAR wrap under parallelisation, single read of
+    source with MD5 manifest embedded in the TAR
     """
 
     log_data = []
@@ -138,25 +171,41 @@ def tar_wrap(fullpath: str) -> Dict[str, Any]:
 
     log_data.append(f"==== New path for TAR wrap: {fullpath[0]} ====")
 
-    # Calculate checksum manifest for supplied fullpath
-    local_md5 = {}
-    for root, _, files in os.walk(fullpath[0]):
-        for file in files:
-            if file.endswith((".ini", ".md5", ".DS_Store", ".")):
-                continue
-            if "tar_wrap.log" in file:
-                continue
-            rel_path = os.path.relpath(root, os.path.dirname(fullpath[0]))
-            if rel_path == tar_source or rel_path.startswith(tar_source + os.sep):
-                dct = utils.get_checksum(os.path.join(root, file))
-                local_md5.update(dct)
-    log_data.append(f"Local MD5 manifest created: {local_md5}")
-
-    # Tar folder creation
+    # TAR wrap, hashing source files and TAR bytes in the same pass
+    tar_path = os.path.join(
+        str(Path(root).parents[0]), f"tar_wrapping/{tar_source}.tar"
+    )
+    md5_manifest = f"{tar_source}.tar_manifest.md5"
+    member_index = f"{tar_source}.tar{tar_stream.INDEX_SUFFIX}"
     utils.append_to_log(local_log, f"Beginning TAR wrap now... {fullpath[0]}")
     tic = time.perf_counter()
     log_data.append("Beginning TAR wrap now")
-    tar_path = utils.tar_item(fullpath[0])
+    try:
+        with tar_stream.TeeTarWriter(tar_path, cache=hashing.get_cache()) as tar:
+            tar.add(fullpath[0], tar_source)
+            tar_content_md5 = {}
+            for name, md5 in tar.checksums.items():
+                key = utils.tar_manifest_key(name)
+                if key is not None:
+                    tar_content_md5[key] = md5
+            log_data.append(f"TAR MD5 manifest created. Adding to TAR file {tar_path}")
+            tar.add_bytes(md5_manifest, json.dumps(tar_content_md5, indent=4).encode())
+            tar.add_bytes(member_index, tar.index_bytes())
+        whole_md5 = tar.md5
+        try:
+            tar_stream.write_index(f"{tar_path}{tar_stream.INDEX_SUFFIX}", tar.index)
+            log_data.append(f"TAR member offset index written for {tar_path}")
+        except OSError as err:
+            # Index copy inside the TAR is still there
+            log_data.append(f"WARNING: TAR member index sidecar not written: {err}")
+    except FileExistsError:
+        utils.append_to_log(local_log, f"Exiting. File already exists: {tar_path}")
+        tar_path = None
+    except Exception as exc:
+        utils.append_to_log(local_log, f"ERROR TARRING FILE: {exc}")
+        if os.path.isfile(tar_path):
+            os.remove(tar_path)
+        tar_path = None
     log_data.append("TAR wrap completed")
     toc = time.perf_counter()
     mins = (toc - tic) // 60
@@ -177,28 +226,7 @@ def tar_wrap(fullpath: str) -> Dict[str, Any]:
             "logs": log_data,
         }
 
-    # Print checksums for local / create and print for TAR log
-    utils.append_to_log(local_log, "Checksums for local files (excluding images):")
-    for key, val in local_md5.items():
-        if not key.lower().endswith(
-            (
-                ".dpx",
-                ".tif",
-                ".tiff",
-                ".jp2",
-                ".j2k",
-                ".jpf",
-                ".jpm",
-                ".jpg2",
-                ".j2c",
-                ".jpc",
-                ".jpx",
-                ".mj2",
-            )
-        ):
-            data = f"{val} -- {key}"
-            utils.append_to_log(local_log, f"\t{data}")
-    tar_content_md5 = utils.get_checksums(tar_path, tar_source)
+    # Print checksums captured during TAR wrap
     utils.append_to_log(
         local_log, "Checksums for TAR wrapped contents (excluding images):"
     )
@@ -224,44 +252,54 @@ def tar_wrap(fullpath: str) -> Dict[str, Any]:
             utils.append_to_log(local_log, f"\t{data}")
             log_data.append(data)
 
-    # Compare manifests
-    tar_fail = False
-    if local_md5 == tar_content_md5:
-        log_data.append(
-            "MD5 Manifests match, adding manifest to TAR file and moving to autoingest."
-        )
-        md5_manifest = utils.make_manifest(tar_path, tar_content_md5)
-        if not md5_manifest:
-            log_data.append("WARNING: Failed to create checksum manifest.")
-            log_data.append(utils.move_to_failures(fullpath[0]))
-            log_data.append(utils.move_to_failures(tar_path))
-            arguments = (
-                ["status", "TAR failure"],
-                ["error_message", "Failed to create checksum manifest"],
+    # Optional read back of TAR contents against in-stream manifest. This
+    # only checks the TAR write, both sides come from the same source read
+    error = None
+    if TAR_VERIFY:
+        log_data.append("Verifying TAR write against in-stream MD5 manifest")
+        try:
+            readback_md5 = tar_stream.read_member_checksums(
+                tar_path, utils.tar_manifest_key
             )
-            tar_fail = True
+            readback_md5.pop(utils.tar_manifest_key(member_index), None)
+        except (tarfile.TarError, OSError) as err:
+            log_data.append(f"WARNING: TAR could not be read back: {err}")
+            readback_md5 = None
+        if readback_md5 == tar_content_md5:
+            log_data.append("TAR read back matches in-stream MD5 manifest")
         else:
-            log_data.append(
-                f"TAR checksum manifest created. Adding to TAR file {tar_path}"
-            )
-            try:
-                arc_path = os.path.split(md5_manifest)
-                tar = tarfile.open(tar_path, "a:")
-                tar.add(md5_manifest, arcname=f"{arc_path[1]}")
-                tar.close()
-                os.remove(md5_manifest)
-            except Exception as exc:
-                log_data.append(
-                    f"WARNING: Unable to add MD5 manifest to TAR file. Moving TAR file to failures folder.\n{exc}"
-                )
-                log_data.append(utils.move_to_failures(tar_path))
-                arguments = (
-                    ["status", "TAR failure"],
-                    ["error_message", "Failed to embed MD5 manifest into TAR file"],
-                )
-                tar_fail = True
-
+            error = "MD5 checksum mismatch between TAR and in-stream manifest"
     else:
+        log_data.append("TAR read back verification disabled, using in-stream MD5s")
+
+    # Re-read a sample of source files apart from the wrap pass,
+    # checking the manifest MD5s (and any cached ones) against source
+    if error is None and TAR_SAMPLE_MEMBERS > 0:
+        members = [
+            entry
+            for entry in tar.index
+            if entry["name"] not in (md5_manifest, member_index)
+        ]
+        sample = random.sample(members, min(TAR_SAMPLE_MEMBERS, len(members)))
+        paths = {os.path.join(root, entry["name"]): entry for entry in sample}
+        try:
+            source_md5 = hashing.hash_files(paths)
+        except OSError as err:
+            log_data.append(f"WARNING: Source sample could not be read: {err}")
+            source_md5 = {}
+        failed = [
+            entry["name"]
+            for path, entry in paths.items()
+            if source_md5.get(path) != entry["md5"]
+        ]
+        if failed:
+            log_data.append(f"Source files failed MD5 sample check: {failed}")
+            error = "MD5 checksum mismatch between TAR and source"
+        else:
+            log_data.append(f"Source files match TAR MD5s: {len(sample)} sampled")
+
+    tar_fail = False
+    if error is not None:
         log_data.append("MD5 checksum manifests did not match. Moving to failures")
         utils.append_to_log(
             local_log,
@@ -269,11 +307,17 @@ def tar_wrap(fullpath: str) -> Dict[str, Any]:
         )
         log_data.append(utils.move_to_failures(fullpath[0]))
         log_data.append(utils.move_to_failures(tar_path))
+        if os.path.isfile(f"{tar_path}{tar_stream.INDEX_SUFFIX}"):
+            log_data.append(
+                utils.move_to_failures(f"{tar_path}{tar_stream.INDEX_SUFFIX}")
+            )
         arguments = (
             ["status", "TAR failure"],
-            ["error_message", "MD5 checksum mismatch between TAR and source"],
+            ["error_message", error],
         )
         tar_fail = True
+    else:
+        log_data.append("MD5 checks passed, moving to autoingest.")
 
     if tar_fail is True:
         utils.append_to_log(local_log, f"==== Failure exit: {fullpath[0]} ====")
@@ -310,7 +354,7 @@ def tar_wrap(fullpath: str) -> Dict[str, Any]:
         # Get complete size of file following TAR wrap
         file_stats = os.stat(tar_path)
         file_size = file_stats.st_size
-        data = utils.md5_hash(tar_path)
+        data = whole_md5
         arguments = (
             ["status", "TAR wrap completed"],
             ["encoding_complete", str(datetime.datetime.today())[:19]],
@@ -338,7 +382,9 @@ def tar_wrap(fullpath: str) -> Dict[str, Any]:
 
 def tar_validate(fullpath):
     """
-    Run validation checks against TAR
+    Run validation checks against TAR,
+    comparing with the sequence size stored
+    at assessment when passed with the path
     """
     log_data = []
     errors = []
@@ -366,7 +412,9 @@ def tar_validate(fullpath):
     seq = fname.split(".")[0]
     dpath = os.path.join(str(Path(spath).parents[1]), "processing/", seq)
     log_data.append(f"Paths to work with:\n{dpath}\n{spath}")
-    folder_size = utils.get_folder_size(dpath)
+    folder_size = fullpath[1] if len(fullpath) > 1 else None
+    if folder_size is None:
+        folder_size = utils.get_folder_size(dpath)
     file_size = utils.get_folder_size(spath)
     log_data.append(f"Found sizes:\n{folder_size} {dpath}\n{file_size} {spath}")
 
@@ -396,6 +444,21 @@ def tar_validate(fullpath):
         )
         errors.append("TAR file significantly larger than sequence.")
 
+    # Spot check members straight from their offsets
+    if validation and TAR_SAMPLE_MEMBERS > 0:
+        try:
+            sample = tar_stream.verify_sample(spath, TAR_SAMPLE_MEMBERS)
+        except (OSError, KeyError, ValueError, tarfile.TarError) as err:
+            sample = {}
+            log_data.append(f"TAR member index not available, sample skipped: {err}")
+        failed = [name for name, match in sample.items() if not match]
+        if failed:
+            validation = False
+            log_data.append(f"TAR members failed MD5 sample check: {failed}")
+            errors.append("TAR member MD5 mismatch")
+        elif sample:
+            log_data.append(f"TAR members match index MD5: {len(sample)} sampled")
+
     # Check logs contain success statement
     success = utils.check_tar_log(log)
     if success is False:
@@ -407,6 +470,8 @@ def tar_validate(fullpath):
         # Move files to failure path
         log_data.append(utils.move_to_failures(spath))
         log_data.append(utils.move_to_failures(dpath))
+        if os.path.isfile(f"{spath}{tar_stream.INDEX_SUFFIX}"):
+            log_data.append(utils.move_to_failures(f"{spath}{tar_stream.INDEX_SUFFIX}"))
 
         # Move log to failure
         log_data.append("Error: TAR file smaller than original folder size...")
@@ -440,6 +505,14 @@ def tar_validate(fullpath):
         # if success:
         #    seq_del = 'Yes'
 
+        # Sidecar is not ingested, the TAR keeps its own copy of the index
+        try:
+            os.remove(f"{spath}{tar_stream.INDEX_SUFFIX}")
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            log_data.append(f"WARNING: TAR member index sidecar not removed: {err}")
+
         # Move file to ingest
         success = utils.move_to_autoingest(spath)
         if not success:
@@ -4,10 +4,13 @@ from typing import Any, Dict, List, Optional
 
 import dagster as dg
 
-from . import utils
+from . import image_header, utils
 
 
-def build_assess_sequence_asset(key_prefix: Optional[str] = None):
+def build_assess_sequence_asset(
+    key_prefix: Optional[str] = None,
+    partitions_def: Optional[dg.PartitionsDefinition] = None,
+):
     """
     Factory function that returns the asset with optional key prefix.
     """
@@ -24,7 +27,10 @@ def build_assess_sequence_asset(key_prefix: Optional[str] = None):
         ins_dict["folder_list"] = dg.AssetIn("target_sequences")
 
     @dg.asset(
-        key=asset_key, ins=ins_dict, required_resource_keys={"database", "process_pool"}
+        key=asset_key,
+        ins=ins_dict,
+        required_resource_keys={"database", "process_pool", "work_leases"},
+        partitions_def=partitions_def,
     )
     def assess_sequence(
         context: dg.AssetExecutionContext,
@@ -44,52 +50,75 @@ def build_assess_sequence_asset(key_prefix: Optional[str] = None):
 
         # Change assessment status
         arg = (["status", "Assessment started"],)
+        started = []
         for folder in folder_list:
             if folder.startswith("GAPS_"):
                 fd = folder.split("_", 1)[-1]
                 seq = os.path.basename(fd)
             else:
                 seq = os.path.basename(folder)
-            context.log.info(f"{log_prefix}Updating assessment started: {arg}")
-            entry = context.resources.database.append_to_database(context, seq, arg)
+            started.append((seq, arg))
+        context.log.info(f"{log_prefix}Updating assessment started: {arg}")
+        entries = context.resources.database.bulk_append_to_database(context, started)
+        for seq_id, _ in started:
             context.log.info(
-                f"{log_prefix}Updated database status: Assessment started {entry}"
+                f"{log_prefix}Updated database status: Assessment started {entries.get(seq_id)}"
             )
 
         context.log.info(
             f"{log_prefix}Launching run assessment {seq}, mediaconch checks and metadata generation..."
         )
-        results = context.resources.process_pool.map(run_assessment, folder_list)
-        print(f"Pool map returned results: {results}")
-
-        assess_sequences = {"RAWcook": [], "TAR": [], "invalid": []}
-        for image_dict in results:
-            if not image_dict["encoding_choice"]:
-                assess_sequences["invalid"].append(image_dict["sequence"])
-            else:
-                assess_sequences[image_dict["encoding_choice"]].append(
-                    image_dict["sequence"]
+        leases = context.resources.work_leases
+        seq_ids = [seq_id for seq_id, _ in started]
+        carried = []
+        try:
+            with leases.hold(context, seq_ids, "assess_sequence"):
+                results = context.resources.process_pool.map(
+                    run_assessment, folder_list
                 )
+            print(f"Pool map returned results: {results}")
 
-        # Update log data
-        context.log.info(
-            f"Results: RAWcook={len(assess_sequences['RAWcook'])}, "
-            f"TAR={len(assess_sequences['TAR'])}, "
-            f"Invalid={len(assess_sequences['invalid'])}"
-        )
+            assess_sequences = {"RAWcook": [], "TAR": [], "invalid": []}
+            for image_dict in results:
+                if not image_dict["encoding_choice"]:
+                    assess_sequences["invalid"].append(image_dict["sequence"])
+                else:
+                    assess_sequences[image_dict["encoding_choice"]].append(
+                        image_dict["sequence"]
+                    )
 
-        for item in results:
-            seq_id = os.path.basename(item["sequence"])
-            args = item["db_arguments"]
-            entry = context.resources.database.append_to_database(context, seq_id, args)
+            # Update log data
             context.log.info(
-                f"{log_prefix}Updated database status: Assessment started {entry}"
+                f"Results: RAWcook={len(assess_sequences['RAWcook'])}, "
+                f"TAR={len(assess_sequences['TAR'])}, "
+                f"Invalid={len(assess_sequences['invalid'])}"
             )
-            for log in item["logs"]:
-                if "WARNING" in str(log):
-                    context.log.warning(f"{log_prefix}{log}")
-                else:
-                    context.log.info(f"{log_prefix}{log}")
+
+            entries = context.resources.database.bulk_append_to_database(
+                context,
+                [
+                    (os.path.basename(item["sequence"]), item["db_arguments"])
+                    for item in results
+                ],
+            )
+            for item in results:
+                seq_id = os.path.basename(item["sequence"])
+                context.log.info(
+                    f"{log_prefix}Updated database status: Assessment started {entries.get(seq_id)}"
+                )
+                for log in item["logs"]:
+                    if "WARNING" in str(log):
+                        context.log.warning(f"{log_prefix}{log}")
+                    else:
+                        context.log.info(f"{log_prefix}{log}")
+
+            # Only RAWcook / TAR leases carry on, once their results are written
+            carried = [
+                os.path.basename(fpath)
+                for fpath in assess_sequences["RAWcook"] + assess_sequences["TAR"]
+            ]
+        finally:
+            leases.release(context, [seq for seq in seq_ids if seq not in carried])
 
         return assess_sequences
 
@@ -109,10 +138,10 @@ def run_assessment(image_sequence: str) -> Dict[str, Any]:
         image_sequence = image_sequence.split("_", 1)[-1]
 
     seq = os.path.basename(image_sequence)
-    try:
-        utils.recursive_chmod(image_sequence, 0o777)
-    except PermissionError as err:
-        print(err)
+    # One walk of sequence serves permissions and all folder checks
+    index = utils.SequenceIndex(image_sequence)
+    for err in index.errors + index.chmod(0o777):
+        log_data.append(f"WARNING: {err}")
 
     log_data.append(f"Processing image sequence: {seq}")
     success = utils.check_fname(seq)
@@ -194,7 +223,9 @@ def run_assessment(image_sequence: str) -> Dict[str, Any]:
             "logs": log_data,
         }
 
-    first_image, last_image, missing = utils.gaps(image_sequence)
+    first_image, last_image, missing_runs, duplicates = utils.gaps(
+        image_sequence, index
+    )
     if not first_image or not last_image:
         log_data.append(f"WARNING: No DPX or TIFF files found for sequence.")
         arguments = (
@@ -211,19 +242,29 @@ def run_assessment(image_sequence: str) -> Dict[str, Any]:
             "logs": log_data,
         }
 
+    missing_count = utils.count_missing(missing_runs)
+    missing_summary = utils.format_runs(missing_runs)
+    if duplicates:
+        log_data.append(
+            f"WARNING: Duplicate frame numbers found in sequence: {utils.format_runs([(num, num) for num in duplicates])}"
+        )
+
     if accept_gaps is False:
         log_data.append(
-            f"Image data - first {first_image} - last {last_image} - missing: {len(missing)}"
+            f"Image data - first {first_image} - last {last_image} - missing: {missing_count}"
         )
-        if len(missing) > 0:
-            log_data.append(f"Gaps found in sequence: {missing}")
+        if missing_count > 0:
+            log_data.append(f"Gaps found in sequence: {missing_summary}")
             arguments = (
                 ["status", "Assessment failed"],
                 ["folder_path", image_sequence],
-                ["gaps_in_sequence", "Yes"],
-                ["error_message", f"{len(missing)} gaps found in sequence"],
+                ["gaps_in_sequence", f"Yes: {missing_summary}"],
+                [
+                    "error_message",
+                    f"{missing_count} frames missing in {len(missing_runs)} gaps found in sequence",
+                ],
             )
-            log_data.append(f"Folder has gaps in sequence. {missing}")
+            log_data.append(f"Folder has gaps in sequence. {missing_summary}")
             return {
                 "sequence": image_sequence,
                 "success": False,
@@ -232,11 +273,13 @@ def run_assessment(image_sequence: str) -> Dict[str, Any]:
                 "logs": log_data,
             }
     else:
-        log_data.append(f"GAPS ACCEPTED for long-term preservation:\n{missing}")
+        log_data.append(
+            f"GAPS ACCEPTED for long-term preservation: {missing_count} frames missing\n{missing_summary}"
+        )
 
     if first_image.endswith((".dpx", ".DPX")):
         # Only assess DPX folder depths
-        folder_depth = utils.count_folder_depth(image_sequence)
+        folder_depth = utils.count_folder_depth(image_sequence, index)
         log_data.append(f"Folder depth is {folder_depth} folder to images")
         if folder_depth is None:
             arguments = (
@@ -272,7 +315,9 @@ def run_assessment(image_sequence: str) -> Dict[str, Any]:
             "Sequence is not DPX and will not have folder structure assessed."
         )
 
-    framerate = utils.get_fps(first_image)
+    # Single header read serves frame rate and image metadata
+    metadata = utils.get_image_metadata(first_image)
+    framerate = metadata.get("fps")
     if framerate is None:
         pass
     elif framerate < 12:
@@ -291,18 +336,23 @@ def run_assessment(image_sequence: str) -> Dict[str, Any]:
             "logs": log_data,
         }
 
-    folder_size = utils.get_folder_size(image_sequence)
-    cspace = utils.get_metadata("pix_fmt", first_image)
+    folder_size = utils.get_folder_size(image_sequence, index)
+    cspace = metadata.get("pix_fmt")
     log_data.append(f"Image colourspace: {cspace}")
 
-    bdepth = utils.get_metadata("bits_per_raw_sample", first_image)
+    bdepth = metadata.get("bitdepth")
     log_data.append(f"Image bit depth: {bdepth}")
 
-    width = utils.get_metadata("width", first_image)
+    width = metadata.get("width")
     log_data.append(f"Image width: {width}")
 
-    height = utils.get_metadata("height", first_image)
-    log_data.append(f"Image width: {height}")
+    height = metadata.get("height")
+    log_data.append(f"Image height: {height}")
+
+    if metadata.get("format"):
+        log_data.append(
+            f"{metadata['format']} header: {metadata['colourspace']}, {metadata['endian']} endian, packing {metadata['packing']}, compression {metadata['compression']}"
+        )
 
     if first_image.lower().endswith((".tif", ".tiff")):
         arg = "TIF"
@@ -330,33 +380,52 @@ def run_assessment(image_sequence: str) -> Dict[str, Any]:
                 "logs": log_data,
             }
 
-    policy_pass, response = utils.mediaconch(first_image, arg)
-    if policy_pass == "Fail":
+    # Catch mixed frames deep in reel before queuing encode, RAWcooked
+    # needs one header throughout but a TAR preserves them as they are
+    scan = utils.scan_sequence_headers(index)
+    outliers = scan["outliers"]
+    log_data.append(
+        f"Header scan of {scan['frames']} frames: {len(outliers)} differ from {scan['majority']}, size {scan['size']}"
+    )
+    if outliers:
+        for fpath, reason in outliers[:20]:
+            log_data.append(f"Header mismatch: {fpath} - {reason}")
+        if len(outliers) > 20:
+            log_data.append(f"... {len(outliers) - 20} further header mismatches")
         encoding_choice = "TAR"
-        log_data.append(f"DPX sequence {seq} failed DPX policy:\n {response}")
+        log_data.append(
+            f"WARNING: {len(outliers)} frames with inconsistent headers, {seq} cannot be RAWcooked and will be TAR wrapped"
+        )
     else:
-        encoding_choice = "RAWcook"
-        log_data.append(f"DPX sequence passed DPX policy: {seq}")
+        policy_pass, response = utils.mediaconch(first_image, arg)
+        if policy_pass == "Fail":
+            encoding_choice = "TAR"
+            log_data.append(f"DPX sequence {seq} failed DPX policy:\n {response}")
+        else:
+            encoding_choice = "RAWcook"
+            log_data.append(f"DPX sequence passed DPX policy: {seq}")
 
     # Write tree directory to folder
-    pth = utils.write_dir_tree(image_sequence)
+    pth = utils.write_dir_tree(image_sequence, index)
     if not pth:
         log_data.append(f"Write of directory tree to folder failed: {seq}")
     else:
         log_data.append(f"Directory tree written into sequence path: {pth}")
+        folder_size += os.path.getsize(pth)
 
     # Use first_image to create metadata in folder
-    pth = utils.metadata_dump(image_sequence, first_image, "")
+    text_dump = pth = utils.metadata_dump(image_sequence, first_image, "")
     if pth:
         log_data.append(f"Metadata written into sequence path: {pth}")
+        folder_size += os.path.getsize(pth)
     else:
         log_data.append(f"WARNING: Metadata not written into sequence path: {seq}")
 
     # Use first_image to create metadata for CID media record
     if arg == "TAR":
-        pth1, pth2 = utils.metadata_dump(image_sequence, first_image, "tar")
+        pth1, pth2 = utils.metadata_dump(image_sequence, first_image, "tar", text_dump)
     else:
-        pth1, pth2 = utils.metadata_dump(image_sequence, first_image, "mkv")
+        pth1, pth2 = utils.metadata_dump(image_sequence, first_image, "mkv", text_dump)
     if pth1:
         log_data.append(
             f"Metadata written to Admin/Logs/cid_mediainfo path: {pth1} / {pth2}"
@@ -370,7 +439,7 @@ def run_assessment(image_sequence: str) -> Dict[str, Any]:
     arguments = (
         ["status", status],
         ["folder_path", image_sequence],
-        ["gaps_in_sequence", "No"],
+        ["gaps_in_sequence", f"Yes: {missing_summary}" if missing_runs else "No"],
         ["assessment_pass", "Yes"],
         ["assessment_complete", str(datetime.datetime.today())[:19]],
         ["colourspace", cspace],
@@ -381,6 +450,7 @@ def run_assessment(image_sequence: str) -> Dict[str, Any]:
         ["encoding_choice", encoding_choice],
         ["first_image", os.path.basename(first_image)],
         ["last_image", os.path.basename(last_image)],
+        ["header_signature", image_header.feature_key(metadata)],
     )
     log_data.append(f"Database arguments: {arguments}")
     return {
@@ -1,18 +1,94 @@
+import math
 import os
-from typing import List, Optional
+import time
+from typing import Callable, Dict, List, Optional
 
 import dagster as dg
 
+from . import utils
 
-def build_target_sequences_asset(key_prefix: Optional[str] = None):
-    """Factory function that returns the asset with optional key prefix."""
+SEQUENCE_ORDER = os.environ.get("SEQUENCE_ORDER", "name")
+SEQUENCE_BATCH_SIZE = int(os.environ.get("SEQUENCE_BATCH_SIZE", "2"))
+SEQUENCE_QUIET_SECONDS = int(os.environ.get("SEQUENCE_QUIET_SECONDS", "600"))
+
+
+def order_by_name(candidates: List[Dict]) -> List[Dict]:
+    return sorted(candidates, key=lambda item: item["seq_id"])
+
+
+def order_longest_first(candidates: List[Dict]) -> List[Dict]:
+    """
+    Longest processing time first, big reels start
+    early and small ones fill slots around them
+    """
+    return sorted(candidates, key=lambda item: (-item["bytes"], -item["frames"]))
+
+
+def order_shortest_first(candidates: List[Dict]) -> List[Dict]:
+    """
+    Smallest first for lowest latency per sequence
+    """
+    return sorted(candidates, key=lambda item: (item["bytes"], item["frames"]))
+
+
+def order_fair(candidates: List[Dict]) -> List[Dict]:
+    """
+    Smallest first, with each day waiting in processing
+    shrinking effective size so big reels never starve
+    """
+    now = time.time()
+    return sorted(
+        candidates,
+        key=lambda item: item["bytes"] / (1 + max(now - item["age"], 0) / 86400),
+    )
+
+
+ORDER_POLICIES: Dict[str, Callable[[List[Dict]], List[Dict]]] = {
+    "name": order_by_name,
+    "lpt": order_longest_first,
+    "spt": order_shortest_first,
+    "fair": order_fair,
+}
+
+
+def build_target_sequences_asset(
+    key_prefix: Optional[str] = None,
+    order: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    partitions_def: Optional[dg.PartitionsDefinition] = None,
+):
+    """
+    Factory function that returns the asset with optional key prefix,
+    ordering policy name from ORDER_POLICIES and sequences per run.
+    With partitions_def each run handles the one seq_id partition.
+    """
+    order = order or SEQUENCE_ORDER
+    if order not in ORDER_POLICIES:
+        raise ValueError(
+            f"Unknown sequence order {order}, choose from {list(ORDER_POLICIES)}"
+        )
+    batch_size = batch_size or SEQUENCE_BATCH_SIZE
 
     # Build the asset key with optional prefix
     asset_key = (
         [f"{key_prefix}", "target_sequences"] if key_prefix else "target_sequences"
     )
 
-    @dg.asset(key=asset_key, required_resource_keys={"database", "source_path"})
+    # Set by the discovery sensor for sequences it has already seen settle
+    config_schema = {
+        "sequences": dg.Field(
+            [dg.String],
+            is_required=False,
+            description="Sequence folder names in processing/ ready for assessment",
+        )
+    }
+
+    @dg.asset(
+        key=asset_key,
+        required_resource_keys={"database", "source_path", "scheduler", "work_leases"},
+        config_schema=config_schema,
+        partitions_def=partitions_def,
+    )
     def target_sequences(
         context: dg.AssetExecutionContext,
     ) -> List[str]:
@@ -35,15 +111,20 @@ def build_target_sequences_asset(key_prefix: Optional[str] = None):
             if os.path.isdir(os.path.join(seq_supply, x))
         ]
         directories.sort()
+        requested = context.op_config.get("sequences") if context.op_config else None
+        if context.has_partition_key:
+            requested = [context.partition_key]
+        if requested:
+            directories = [dr for dr in directories if dr in requested]
         context.log.info(f"{log_prefix}Directories located:\n%s", directories)
 
-        count = 1
-        current_files = []
+        # Sequences whose run / host died without finishing
+        stale = context.resources.work_leases.expired(context, str(key_prefix))
+
+        candidates = []
         for dr in directories:
             if "for_deletion" in dr:
                 continue
-            if count > 2:
-                break
             dpath = os.path.join(seq_supply, dr)
             context.log.info(f"{log_prefix}Directory path: %s", dpath)
 
@@ -55,41 +136,111 @@ def build_target_sequences_asset(key_prefix: Optional[str] = None):
 
             # Review database entries
             if len(result) == 0:
-                current_files.append(dpath)
-                entry = context.resources.database.start_process(
-                    context, dr, dpath, "Triggered assessment", str(key_prefix)
-                )
-                context.log.info(
-                    f"{log_prefix}New entry made in database: %s - %s", entry, dpath
+                candidates.append({"seq_id": dr, "path": dpath, "new": True})
+            elif dr in stale:
+                context.log.warning(
+                    f"{log_prefix}Lease on {dr} expired mid process, restarting: %s",
+                    result,
                 )
-            elif len(result) > 0 and "Triggered assessment" not in str(result):
+                # Instruction is kept on the row, GAPS_ path carries accept gaps
+                if "Accept gaps" in str(result):
+                    dpath = f"GAPS_{dpath}"
+                candidates.append({"seq_id": dr, "path": dpath, "new": True})
+            elif "Triggered assessment" not in str(result):
                 context.log.info(
                     f"{log_prefix}Skipping: Sequence already listed in process/processed: %s",
                     result,
                 )
                 continue
-            elif len(result) > 0 and "Accept gaps" in str(result):
-                if "Triggered assessment" in str(result):
-                    context.log.info(
-                        f"{log_prefix}Picking up sequence a second time. Passing for processing with accept gaps: %s",
-                        result,
-                    )
-                    current_files.append(f"GAPS_{dpath}")
-            elif len(result) > 0 and "Triggered assessment" in str(result):
+            elif "Accept gaps" in str(result):
                 context.log.info(
-                    f"{log_prefix}Picking up sequence a second time. Passing for processing: %s",
+                    f"{log_prefix}Picking up sequence a second time. Passing for processing with accept gaps: %s",
                     result,
                 )
-                current_files.append(dpath)
+                candidates.append({"seq_id": dr, "path": f"GAPS_{dpath}", "new": False})
             else:
-                current_files.append(dpath)
+                context.log.info(
+                    f"{log_prefix}Picking up sequence a second time. Passing for processing: %s",
+                    result,
+                )
+                candidates.append({"seq_id": dr, "path": dpath, "new": False})
+
+        # Only hand over sequences a scanner / copy has finished writing
+        if SEQUENCE_QUIET_SECONDS > 0 and not requested:
+            ready = []
+            for item in candidates:
+                dpath = os.path.join(seq_supply, item["seq_id"])
+                signature = utils.sequence_signature(dpath)
+                last_changed = context.resources.database.record_stability(
+                    context, item["seq_id"], dpath, str(key_prefix), signature
+                )
+                now = time.time()
+                quiet = min(now - last_changed, now - signature[2])
+                if quiet < SEQUENCE_QUIET_SECONDS:
+                    context.log.info(
+                        f"{log_prefix}Skipping: {item['seq_id']} still copying, {signature[0]} files / {signature[1]} bytes unchanged for {quiet:.0f}s"
+                    )
+                    continue
+                ready.append(item)
+            candidates = ready
+
+        # Cheap pre-scan supplies sizes / frame counts for ordering
+        if order != "name":
+            for item in candidates:
+                dpath = os.path.join(seq_supply, item["seq_id"])
+                item["frames"], item["bytes"] = utils.estimate_sequence(dpath)
+                try:
+                    item["age"] = os.stat(dpath).st_ctime
+                except OSError:
+                    item["age"] = time.time()
+                context.log.info(
+                    f"{log_prefix}Pre-scan {item['seq_id']}: {item['frames']} frames, ~{item['bytes']} bytes"
+                )
+        candidates = ORDER_POLICIES[order](candidates)
+
+        # Sensor runs were asked for these sequences, so hand them all over
+        take = len(candidates) if requested else batch_size
+        if order == "fair" and not requested:
+            # Project share of scheduler slots, less the leases it already holds
+            leases = context.resources.database.retrieve_seq_id_row(
+                context,
+                "SELECT project, COUNT(*) FROM encode_slots GROUP BY project",
+                "fetchall",
+            )
+            held = dict(leases)
+            projects = len(set(held) | {str(key_prefix)})
+            share = math.ceil(context.resources.scheduler.max_slots / projects)
+            take = min(batch_size, max(1, share - held.get(str(key_prefix), 0)))
+            context.log.info(
+                f"{log_prefix}Fair share {share} slots over {projects} projects, taking {take}"
+            )
+
+        # Claim leases so other hosts draining this folder pass over these
+        current_files = []
+        for item in candidates:
+            if len(current_files) >= take:
+                break
+            if not context.resources.work_leases.claim(
+                context, item["seq_id"], str(key_prefix), "target_sequences"
+            ):
+                context.log.info(
+                    f"{log_prefix}Skipping: {item['seq_id']} claimed by another run"
+                )
+                continue
+            if item["new"]:
                 entry = context.resources.database.start_process(
-                    context, dr, dpath, "Triggered assessment"
+                    context,
+                    item["seq_id"],
+                    os.path.join(seq_supply, item["seq_id"]),
+                    "Triggered assessment",
+                    str(key_prefix),
                 )
                 context.log.info(
-                    f"{log_prefix}New entry made in database: %s - %s", entry, dpath
+                    f"{log_prefix}New entry made in database: %s - %s",
+                    entry,
+                    item["path"],
                 )
-            count += 1
+            current_files.append(item["path"])
 
         context.log.info(
             f"{log_prefix}Files being handed to assessment:\n%s", current_files
@@ -0,0 +1,319 @@
+"""
+MD5 engine shared by the manifest builders in assets/ and
+cron_code/. Files are hashed concurrently on a thread pool,
+hashlib releases the GIL while it digests large buffers, so
+several DPX frames stream from the NAS at once. Each thread
+reads with readinto() into its own reused buffer after a
+sequential readahead hint, and a byte budget caps how much
+file data is queued or being read at any time. Pre-wrap
+source manifests and TeeTarWriter use a SQLite checksum
+cache keyed on file identity, so unchanged files are not
+hashed again. Readback and fixity checks always read the
+bytes. Standard library only
+so the cron_code scripts can import it.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Optional, Tuple
+
+MIB = 1024 * 1024
+CHUNK_SIZE = int(os.environ.get("HASH_CHUNK_MB", "8")) * MIB
+WORKERS = int(os.environ.get("HASH_WORKERS", "8"))
+MAX_INFLIGHT = int(os.environ.get("HASH_INFLIGHT_MB", "1024")) * MIB
+
+# Cache defaults to the pipeline DATABASE, cron hosts can point at their own file
+OWN_CACHE = os.environ.get("CHECKSUM_CACHE")
+CACHE_PATH = OWN_CACHE or os.environ.get("DATABASE")
+CACHE_MAX_ENTRIES = int(os.environ.get("CHECKSUM_CACHE_ENTRIES", "5000000"))
+CACHE_MAX_DAYS = float(os.environ.get("CHECKSUM_CACHE_DAYS", "90"))
+CACHE_EVICT_SECONDS = 3600
+# Keys per SELECT, four bound parameters each
+LOOKUP_BATCH = 200
+
+# Same table as the resources/schema.py migration, for standalone cache files
+CACHE_TABLE = """
+CREATE TABLE IF NOT EXISTS checksum_cache (
+    dev INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    md5 TEXT NOT NULL,
+    path TEXT,
+    created REAL,
+    last_used REAL,
+    PRIMARY KEY (dev, inode, size, mtime_ns)
+) WITHOUT ROWID
+"""
+CACHE_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_checksum_cache_last_used "
+    "ON checksum_cache (last_used)"
+)
+
+FileKey = Tuple[int, int, int, int]
+
+_local = threading.local()
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class ChecksumCache:
+    """
+    MD5 per (device, inode, size, mtime_ns) in SQLite. Rows
+    unused for max_days are evicted, then least recently
+    used rows beyond max_entries. Best effort, a database
+    error only ever behaves as a cache miss. The table
+    is created here only when create is set, the pipeline
+    DATABASE gets it from the schema migrations
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_days: float = CACHE_MAX_DAYS,
+        timeout: float = 30.0,
+        create: bool = True,
+    ):
+        self.path = path
+        self.create = create
+        self.max_entries = max_entries
+        self.max_days = max_days
+        self.timeout = timeout
+        self._ready = False
+        self._last_evict = 0.0
+
+    @staticmethod
+    def key(stat: os.stat_result) -> FileKey:
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        if not self._ready and self.create:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(CACHE_TABLE)
+            conn.execute(CACHE_INDEX)
+            conn.commit()
+            self._ready = True
+        return conn
+
+    def lookup(self, keys: Dict[str, FileKey]) -> Dict[str, str]:
+        """
+        Return {path: MD5 hex} for paths whose
+        key is cached, marking them as used
+        """
+        found = {}
+        unique = list(set(keys.values()))
+        try:
+            conn = self._connect()
+            try:
+                md5s = {}
+                for start in range(0, len(unique), LOOKUP_BATCH):
+                    batch = unique[start : start + LOOKUP_BATCH]
+                    rows = ", ".join(["(?, ?, ?, ?)"] * len(batch))
+                    for *key, md5 in conn.execute(
+                        "SELECT dev, inode, size, mtime_ns, md5 FROM checksum_cache "
+                        f"WHERE (dev, inode, size, mtime_ns) IN (VALUES {rows})",
+                        [value for key in batch for value in key],
+                    ):
+                        md5s[tuple(key)] = md5
+                found = {fpath: md5s[key] for fpath, key in keys.items() if key in md5s}
+                if md5s:
+                    now = time.time()
+                    conn.executemany(
+                        "UPDATE checksum_cache SET last_used = ? "
+                        "WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                        [(now, *key) for key in md5s],
+                    )
+                    conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return {}
+
+        return found
+
+    def store(self, entries: Dict[str, Tuple[FileKey, str]]) -> None:
+        """
+        Save {path: (key, MD5 hex)} and evict
+        old rows at most once an hour
+        """
+        if not entries:
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO checksum_cache
+                    (dev, inode, size, mtime_ns, md5, path, created, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (*key, md5, fpath, now, now)
+                        for fpath, (key, md5) in entries.items()
+                    ],
+                )
+                conn.commit()
+                if now - self._last_evict > CACHE_EVICT_SECONDS:
+                    self._last_evict = now
+                    self.evict(conn, now)
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+
+    def evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(
+            "DELETE FROM checksum_cache WHERE last_used < ?",
+            (now - self.max_days * 86400,),
+        )
+        excess = (
+            conn.execute("SELECT COUNT(*) FROM checksum_cache").fetchone()[0]
+            - self.max_entries
+        )
+        if excess > 0:
+            conn.execute(
+                """
+                DELETE FROM checksum_cache WHERE (dev, inode, size, mtime_ns) IN (
+                    SELECT dev, inode, size, mtime_ns FROM checksum_cache
+                    ORDER BY last_used LIMIT ?
+                )
+                """,
+                (excess,),
+            )
+        conn.commit()
+
+
+def get_cache() -> Optional[ChecksumCache]:
+    """
+    Checksum cache for this process, None
+    when no cache database is configured
+    """
+    if not CACHE_PATH:
+        return None
+    key = (os.getpid(), CACHE_PATH)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = ChecksumCache(CACHE_PATH, create=bool(OWN_CACHE))
+            _caches[key] = cache
+    return cache
+
+
+def _buffer(chunk_size: int) -> memoryview:
+    """
+    One read buffer per thread, reused for every file
+    """
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None or len(buffer) != chunk_size:
+        buffer = memoryview(bytearray(chunk_size))
+        _local.buffer = buffer
+    return buffer
+
+
+def hash_file(fpath: str, chunk_size: int = CHUNK_SIZE) -> str:
+    """
+    Return MD5 hex of file read sequentially
+    in chunk_size blocks into a reused buffer
+    """
+    buffer = _buffer(chunk_size)
+    hash_md5 = hashlib.md5()
+    with open(fpath, "rb", buffering=0) as file:
+        if hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except OSError:
+                pass
+        while True:
+            size = file.readinto(buffer)
+            if not size:
+                break
+            hash_md5.update(buffer[:size])
+
+    return hash_md5.hexdigest()
+
+
+def hash_files(
+    paths: Iterable[str],
+    workers: int = WORKERS,
+    max_inflight: int = MAX_INFLIGHT,
+    chunk_size: int = CHUNK_SIZE,
+    use_cache: bool = False,
+) -> Dict[str, str]:
+    """
+    Hash files concurrently and return {path: MD5 hex}.
+    With use_cache cached files are not read, so leave
+    it off for any check of stored bytes. Files are only
+    started while the sizes of files in progress fit
+    max_inflight, one larger file runs alone. A read
+    error is raised once running reads finish
+    """
+    paths = list(paths)
+    cache = get_cache() if use_cache else None
+    keys = {}
+    for fpath in paths:
+        try:
+            keys[fpath] = ChecksumCache.key(os.stat(fpath))
+        except OSError:
+            pass
+
+    results = cache.lookup(keys) if cache else {}
+    pending = {}
+    inflight = 0
+
+    def collect(return_when) -> None:
+        nonlocal inflight
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            fpath, size = pending.pop(future)
+            inflight -= size
+            results[fpath] = future.result()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for fpath in paths:
+            if fpath in results:
+                continue
+            size = min(keys[fpath][2], max_inflight) if fpath in keys else 0
+            while pending and inflight + size > max_inflight:
+                collect(FIRST_COMPLETED)
+            pending[pool.submit(hash_file, fpath, chunk_size)] = (fpath, size)
+            inflight += size
+        while pending:
+            collect(FIRST_COMPLETED)
+
+    if cache:
+        # Only files that did not change while they were read
+        fresh = {}
+        for fpath, md5 in results.items():
+            try:
+                key = ChecksumCache.key(os.stat(fpath))
+            except OSError:
+                continue
+            if key == keys.get(fpath):
+                fresh[fpath] = (key, md5)
+        cache.store(fresh)
+
+    return results
+
+
+def hash_tree(fpath: str, **kwargs) -> Dict[str, str]:
+    """
+    Hash fpath, or every file below it when a
+    folder, return {path: MD5 hex}
+    """
+    if not os.path.isdir(fpath):
+        return hash_files([fpath], **kwargs)
+    return hash_files(
+        (
+            os.path.join(root, fname)
+            for root, _, files in os.walk(fpath)
+            for fname in sorted(files)
+        ),
+        **kwargs,
+    )
@@ -0,0 +1,384 @@
+"""
+Read DPX and TIFF image headers directly so sequence
+assessment needs no ffprobe / exiftool process for the
+basic image properties. One read of the first few KB
+covers DPX (SMPTE 268M) and most TIFF writers, further
+TIFF tag data beyond that is fetched with os.pread.
+Standard library only.
+"""
+
+import math
+import os
+import struct
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+HEADER_SIZE = 4096
+SCAN_WORKERS = 16
+SCAN_BATCH = 256
+
+# Header values every frame in a sequence is expected to share
+SIGNATURE_FIELDS = (
+    "format",
+    "endian",
+    "width",
+    "height",
+    "bitdepth",
+    "descriptor",
+    "packing",
+    "compression",
+    "data_offset",
+)
+
+# Values that decide whether RAWcooked needs output version 2,
+# coarse to fine so a prefix of the key groups similar scans
+FEATURE_FIELDS = (
+    "format",
+    "endian",
+    "descriptor",
+    "bitdepth",
+    "packing",
+    "compression",
+    "line_padding",
+    "image_padding",
+    "width",
+    "height",
+)
+COARSE_FEATURES = 8
+
+# SMPTE 268M generic / film / television header offsets
+DPX_MAGIC = {b"SDPX": ">", b"XPDS": "<"}
+DPX_DATA_OFFSET = 4
+DPX_VERSION = 8
+DPX_FILE_SIZE = 16
+DPX_ELEMENTS = 770
+DPX_WIDTH = 772
+DPX_HEIGHT = 776
+DPX_DESCRIPTOR = 800
+DPX_TRANSFER = 801
+DPX_COLORIMETRIC = 802
+DPX_BIT_SIZE = 803
+DPX_PACKING = 804
+DPX_ENCODING = 806
+DPX_LINE_PADDING = 812
+DPX_IMAGE_PADDING = 816
+DPX_FILM_FPS = 1724
+DPX_TV_FPS = 1940
+DPX_UNDEFINED = 0xFFFFFFFF
+
+DPX_DESCRIPTORS: Dict[int, str] = {
+    1: "Red",
+    2: "Green",
+    3: "Blue",
+    4: "Alpha",
+    6: "Luma (Y)",
+    50: "RGB",
+    51: "RGBA",
+    52: "ABGR",
+    100: "CbYCrY (4:2:2)",
+    101: "CbYaCrYa (4:2:2:4)",
+    102: "CbYCr (4:4:4)",
+    103: "CbYCrA (4:4:4:4)",
+}
+
+# Pixel formats as reported by FFmpeg's DPX decoder, {} for file endianness
+DPX_PIX_FMT: Dict[tuple, str] = {
+    (50, 8): "rgb24",
+    (50, 10): "gbrp10le",
+    (50, 12): "gbrp12le",
+    (50, 16): "rgb48{}",
+    (51, 8): "rgba",
+    (51, 10): "gbrap10le",
+    (51, 12): "gbrap12le",
+    (51, 16): "rgba64{}",
+    (6, 8): "gray",
+    (6, 10): "gray10le",
+    (6, 12): "gray12le",
+    (6, 16): "gray16{}",
+    (100, 8): "uyvy422",
+    (100, 10): "yuv422p10le",
+    (102, 8): "yuv444p",
+    (102, 10): "yuv444p10le",
+}
+
+TIFF_MAGIC = {b"II*\x00": "<", b"MM\x00*": ">"}
+TIFF_TYPES = {1: "B", 3: "H", 4: "I", 16: "Q"}
+TIFF_WIDTH = 256
+TIFF_HEIGHT = 257
+TIFF_BITS = 258
+TIFF_COMPRESSION = 259
+TIFF_PHOTOMETRIC = 262
+TIFF_STRIP_OFFSETS = 273
+TIFF_SAMPLES = 277
+TIFF_PLANAR = 284
+
+TIFF_PHOTOMETRICS: Dict[int, str] = {
+    0: "WhiteIsZero",
+    1: "BlackIsZero",
+    2: "RGB",
+    3: "Palette",
+    6: "YCbCr",
+}
+
+# Pixel formats as reported by FFmpeg's TIFF decoder, {} for file endianness
+TIFF_PIX_FMT: Dict[tuple, str] = {
+    (2, 3, 8, 1): "rgb24",
+    (2, 3, 16, 1): "rgb48{}",
+    (2, 4, 8, 1): "rgba",
+    (2, 4, 16, 1): "rgba64{}",
+    (2, 3, 8, 2): "gbrp",
+    (2, 3, 16, 2): "gbrp16{}",
+    (1, 1, 8, 1): "gray",
+    (1, 1, 16, 1): "gray16{}",
+    (0, 1, 8, 1): "gray",
+    (0, 1, 16, 1): "gray16{}",
+}
+
+
+def read_header(fpath: str, size: int = HEADER_SIZE) -> Optional[Dict]:
+    """
+    Return DPX or TIFF header values for
+    image at fpath, None if not recognised
+    or the header cannot be read
+    """
+    try:
+        fd = os.open(fpath, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return parse_header(os.pread(fd, size, 0), fd)
+    except (OSError, struct.error, ValueError):
+        return None
+    finally:
+        os.close(fd)
+
+
+def parse_header(data: bytes, fd: Optional[int] = None) -> Optional[Dict]:
+    """
+    Parse header bytes read from start of image,
+    fd used to fetch TIFF data outside of data
+    """
+    if data[:4] in DPX_MAGIC:
+        return parse_dpx(data)
+    if data[:4] in TIFF_MAGIC:
+        return parse_tiff(data, fd)
+    return None
+
+
+def _dpx_rate(value: float) -> Optional[float]:
+    if math.isnan(value) or math.isinf(value) or value <= 0:
+        return None
+    return round(value, 3)
+
+
+def parse_dpx(data: bytes) -> Optional[Dict]:
+    """
+    Read generic image, first image element
+    and film / television frame rate fields
+    """
+    if len(data) < DPX_TV_FPS + 4:
+        return None
+    order = DPX_MAGIC[data[:4]]
+    endian = "le" if order == "<" else "be"
+
+    def u32(offset: int) -> int:
+        return struct.unpack_from(f"{order}I", data, offset)[0]
+
+    def u16(offset: int) -> int:
+        return struct.unpack_from(f"{order}H", data, offset)[0]
+
+    def r32(offset: int) -> float:
+        return struct.unpack_from(f"{order}f", data, offset)[0]
+
+    descriptor = data[DPX_DESCRIPTOR]
+    bitdepth = data[DPX_BIT_SIZE]
+    pix_fmt = DPX_PIX_FMT.get((descriptor, bitdepth))
+    file_size = u32(DPX_FILE_SIZE)
+    line_padding = u32(DPX_LINE_PADDING)
+    image_padding = u32(DPX_IMAGE_PADDING)
+
+    return {
+        "format": "DPX",
+        "version": data[DPX_VERSION : DPX_VERSION + 8]
+        .split(b"\x00")[0]
+        .decode("ascii", "replace"),
+        "endian": endian,
+        "width": u32(DPX_WIDTH),
+        "height": u32(DPX_HEIGHT),
+        "bitdepth": bitdepth,
+        "elements": u16(DPX_ELEMENTS),
+        "descriptor": descriptor,
+        "colourspace": DPX_DESCRIPTORS.get(descriptor, str(descriptor)),
+        "transfer": data[DPX_TRANSFER],
+        "colorimetric": data[DPX_COLORIMETRIC],
+        "packing": u16(DPX_PACKING),
+        "compression": u16(DPX_ENCODING),
+        "data_offset": u32(DPX_DATA_OFFSET),
+        "file_size": None if file_size == DPX_UNDEFINED else file_size,
+        "line_padding": None if line_padding == DPX_UNDEFINED else line_padding,
+        "image_padding": None if image_padding == DPX_UNDEFINED else image_padding,
+        "fps": _dpx_rate(r32(DPX_FILM_FPS)) or _dpx_rate(r32(DPX_TV_FPS)),
+        "pix_fmt": pix_fmt.format(endian) if pix_fmt else None,
+    }
+
+
+def parse_tiff(data: bytes, fd: Optional[int] = None) -> Optional[Dict]:
+    """
+    Read the tags of the first IFD that
+    describe image size and sample layout
+    """
+    order = TIFF_MAGIC[data[:4]]
+    endian = "le" if order == "<" else "be"
+
+    def fetch(offset: int, size: int) -> bytes:
+        if offset + size <= len(data):
+            return data[offset : offset + size]
+        if fd is None:
+            raise ValueError("TIFF data outside of header read")
+        chunk = os.pread(fd, size, offset)
+        if len(chunk) < size:
+            raise ValueError("TIFF data beyond end of file")
+        return chunk
+
+    ifd_offset = struct.unpack_from(f"{order}I", data, 4)[0]
+    entries = struct.unpack(f"{order}H", fetch(ifd_offset, 2))[0]
+    ifd = fetch(ifd_offset + 2, entries * 12)
+
+    tags = {}
+    for pos in range(0, entries * 12, 12):
+        tag, field_type, count = struct.unpack_from(f"{order}HHI", ifd, pos)
+        code = TIFF_TYPES.get(field_type)
+        # Unknown types and empty tags carry no value to read
+        if code is None or count == 0:
+            continue
+        size = struct.calcsize(code) * count
+        if size <= 4:
+            raw = ifd[pos + 8 : pos + 8 + size]
+        else:
+            value_offset = struct.unpack_from(f"{order}I", ifd, pos + 8)[0]
+            # Only the first value of long arrays (eg strip offsets) is needed
+            raw = fetch(value_offset, struct.calcsize(code) * min(count, 4))
+            count = min(count, 4)
+        tags[tag] = struct.unpack(f"{order}{count}{code}", raw)
+
+    if TIFF_WIDTH not in tags or TIFF_HEIGHT not in tags:
+        return None
+
+    samples = tags.get(TIFF_SAMPLES, (1,))[0]
+    bitdepth = tags.get(TIFF_BITS, (1,))[0]
+    photometric = tags.get(TIFF_PHOTOMETRIC, (None,))[0]
+    planar = tags.get(TIFF_PLANAR, (1,))[0]
+    pix_fmt = TIFF_PIX_FMT.get((photometric, samples, bitdepth, planar))
+
+    return {
+        "format": "TIFF",
+        "version": None,
+        "endian": endian,
+        "width": tags[TIFF_WIDTH][0],
+        "height": tags[TIFF_HEIGHT][0],
+        "bitdepth": bitdepth,
+        "elements": samples,
+        "descriptor": photometric,
+        "colourspace": TIFF_PHOTOMETRICS.get(photometric, str(photometric)),
+        "transfer": None,
+        "colorimetric": None,
+        "packing": planar,
+        "compression": tags.get(TIFF_COMPRESSION, (1,))[0],
+        "data_offset": tags.get(TIFF_STRIP_OFFSETS, (None,))[0],
+        "file_size": None,
+        "line_padding": None,
+        "image_padding": None,
+        "fps": None,
+        "pix_fmt": pix_fmt.format(endian) if pix_fmt else None,
+    }
+
+
+def signature(header: Optional[Dict]) -> Optional[tuple]:
+    """
+    Reduce header to the values compared
+    across frames of one sequence
+    """
+    if not header:
+        return None
+    return tuple(header[field] for field in SIGNATURE_FIELDS)
+
+
+def feature_key(header: Optional[Dict]) -> Optional[str]:
+    """
+    Header features as one string, stored per
+    sequence to look up past encode outcomes
+    """
+    if not header or not header.get("format"):
+        return None
+    return "|".join(str(header.get(field)) for field in FEATURE_FIELDS)
+
+
+def coarse_key(key: str) -> str:
+    """
+    Feature key without image dimensions
+    """
+    return "|".join(key.split("|")[:COARSE_FEATURES])
+
+
+def _read_signatures(paths: Sequence[str]) -> List[Optional[tuple]]:
+    return [signature(read_header(fpath)) for fpath in paths]
+
+
+def scan_sequence(
+    paths: Sequence[str],
+    sizes: Optional[Sequence[int]] = None,
+    workers: int = SCAN_WORKERS,
+    batch: int = SCAN_BATCH,
+) -> Dict:
+    """
+    Read every frame header on a thread pool, with at
+    most two batches per worker in flight, and report
+    frames that differ from the sequence majority.
+    File sizes are compared for DPX / uncompressed TIFF
+    """
+    signatures: List[Optional[tuple]] = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for start in range(0, len(paths), batch):
+            pending.append(pool.submit(_read_signatures, paths[start : start + batch]))
+            if len(pending) >= workers * 2:
+                signatures.extend(pending.popleft().result())
+        while pending:
+            signatures.extend(pending.popleft().result())
+
+    counts = Counter(sig for sig in signatures if sig is not None)
+    if not counts:
+        return {"frames": len(paths), "majority": None, "size": None, "outliers": []}
+    majority = counts.most_common(1)[0][0]
+    majority_dct = dict(zip(SIGNATURE_FIELDS, majority))
+
+    size = None
+    if sizes is not None and (
+        majority_dct["format"] == "DPX" or majority_dct["compression"] == 1
+    ):
+        size_counts = Counter(
+            sizes[num] for num, sig in enumerate(signatures) if sig == majority
+        )
+        size = size_counts.most_common(1)[0][0]
+
+    outliers = []
+    for num, sig in enumerate(signatures):
+        if sig is None:
+            outliers.append((paths[num], "header unreadable"))
+        elif sig != majority:
+            diffs = [
+                f"{field} {value} (expected {expected})"
+                for field, value, expected in zip(SIGNATURE_FIELDS, sig, majority)
+                if value != expected
+            ]
+            outliers.append((paths[num], ", ".join(diffs)))
+        elif size is not None and sizes[num] != size:
+            outliers.append((paths[num], f"size {sizes[num]} (expected {size})"))
+
+    return {
+        "frames": len(paths),
+        "majority": majority_dct,
+        "size": size,
+        "outliers": outliers,
+    }
@@ -0,0 +1,218 @@
+"""
+Run RAWcooked through a pipe instead of a shell redirect
+and parse its console output as it arrives. FFmpeg status
+lines give frames, bytes and rate, written to the
+encode_progress table in DATABASE, and the encode is
+killed as soon as a line shows it cannot succeed. Standard
+library only as it runs inside the process pool workers.
+"""
+
+import os
+import re
+import signal
+import sqlite3
+import subprocess
+import time
+from typing import List, Optional, Tuple
+
+DATABASE = os.environ.get("DATABASE")
+PROGRESS_SECONDS = float(os.environ.get("RAWCOOK_PROGRESS_SECONDS", "15"))
+READ_SIZE = 64 * 1024
+MAX_LINE = 64 * 1024
+
+# Encode can only succeed when rerun with --output-version 2
+VERSION_TWO_ERRORS = (
+    "Error: undecodable file is becoming too big",
+    "Error: the reversibility file is becoming big",
+)
+
+# Encode cannot succeed, no point letting it run on
+FATAL_ERRORS = (
+    "Conversion failed!",
+    "Please contact info@mediaarea.net",
+)
+
+# FFmpeg status line, eg frame= 1234 fps= 12 q=-0.0 size= 123456KiB ... speed=0.51x
+FRAME = re.compile(r"frame=\s*(\d+)")
+FPS = re.compile(r"fps=\s*([\d.]+)")
+SIZE = re.compile(r"size=\s*(\d+)\s*(KiB|kB|MiB|mB|B)")
+SPEED = re.compile(r"speed=\s*([\d.]+)x")
+SIZE_UNITS = {"B": 1, "kB": 1024, "KiB": 1024, "mB": 1024**2, "MiB": 1024**2}
+
+
+class LogParser:
+    """
+    Incremental parser fed raw console bytes, FFmpeg
+    ends status lines with carriage returns so both
+    line endings split
+    """
+
+    def __init__(self):
+        self.frames: Optional[int] = None
+        self.bytes: Optional[int] = None
+        self.fps: Optional[float] = None
+        self.speed: Optional[float] = None
+        self.abort: Optional[str] = None
+        self.version_two = False
+        self._tail = b""
+
+    def feed(self, data: bytes) -> None:
+        lines = re.split(rb"[\r\n]", self._tail + data)
+        self._tail = lines.pop()[-MAX_LINE:]
+        for line in lines:
+            if line:
+                self.parse_line(line.decode("utf-8", "replace"))
+
+    def close(self) -> None:
+        if self._tail:
+            self.parse_line(self._tail.decode("utf-8", "replace"))
+            self._tail = b""
+
+    def parse_line(self, line: str) -> None:
+        if "frame=" in line:
+            match = FRAME.search(line)
+            if match:
+                self.frames = int(match.group(1))
+            match = FPS.search(line)
+            if match:
+                self.fps = float(match.group(1))
+            match = SIZE.search(line)
+            if match:
+                self.bytes = int(match.group(1)) * SIZE_UNITS[match.group(2)]
+            match = SPEED.search(line)
+            if match:
+                self.speed = float(match.group(1))
+            return
+
+        if self.abort:
+            return
+        for pattern in VERSION_TWO_ERRORS:
+            if pattern in line:
+                self.abort = pattern
+                self.version_two = True
+                return
+        for pattern in FATAL_ERRORS:
+            if pattern in line:
+                self.abort = pattern
+                return
+
+
+class ProgressWriter:
+    """
+    Upsert the encode_progress row for one encode at most
+    once per interval. Best effort, a locked or missing
+    database never stops the encode
+    """
+
+    def __init__(
+        self,
+        seq_id: str,
+        total_frames: Optional[int],
+        output_version: int,
+        database: Optional[str] = DATABASE,
+        interval: float = PROGRESS_SECONDS,
+    ):
+        self.seq_id = seq_id
+        self.total_frames = total_frames
+        self.output_version = output_version
+        self.database = database
+        self.interval = interval
+        self.started = time.time()
+        self.last_write = 0.0
+
+    def update(self, parser: LogParser, state: str = "encoding", force=False) -> None:
+        now = time.time()
+        if not self.database or (not force and now - self.last_write < self.interval):
+            return
+        self.last_write = now
+        try:
+            conn = sqlite3.connect(self.database, timeout=5)
+            try:
+                conn.execute(
+                    """
+                    INSERT INTO encode_progress
+                    (seq_id, host, pid, output_version, state, started, updated,
+                     frames, total_frames, bytes, fps, speed, message)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(seq_id) DO UPDATE SET
+                        host = excluded.host,
+                        pid = excluded.pid,
+                        output_version = excluded.output_version,
+                        state = excluded.state,
+                        started = excluded.started,
+                        updated = excluded.updated,
+                        frames = excluded.frames,
+                        total_frames = excluded.total_frames,
+                        bytes = excluded.bytes,
+                        fps = excluded.fps,
+                        speed = excluded.speed,
+                        message = excluded.message
+                    """,
+                    (
+                        self.seq_id,
+                        os.uname().nodename,
+                        os.getpid(),
+                        self.output_version,
+                        state,
+                        self.started,
+                        now,
+                        parser.frames,
+                        self.total_frames,
+                        parser.bytes,
+                        parser.fps,
+                        parser.speed,
+                        parser.abort,
+                    ),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            # Table not there yet or database busy, skip this update
+            pass
+
+
+def _kill_group(proc: subprocess.Popen) -> None:
+    """
+    SIGKILL RAWcooked and every child in its session
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run(
+    cmd: List[str], log_path: str, progress: Optional[ProgressWriter] = None
+) -> Tuple[int, LogParser]:
+    """
+    Run cmd appending its output to log_path, kill
+    it on the first fatal line. cmd runs in its own
+    session so the FFmpeg it starts is killed with it.
+    Return exit code and the parser holding last
+    progress / abort
+    """
+    parser = LogParser()
+    with open(log_path, "ab") as log, subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True
+    ) as proc:
+        try:
+            while True:
+                data = proc.stdout.read1(READ_SIZE)
+                if not data:
+                    break
+                log.write(data)
+                parser.feed(data)
+                if parser.abort:
+                    _kill_group(proc)
+                    break
+                if progress:
+                    progress.update(parser)
+        except BaseException:
+            _kill_group(proc)
+            raise
+        returncode = proc.wait()
+    parser.close()
+
+    return returncode, parser
+
@@ -0,0 +1,461 @@
+"""
+Single pass TAR writing and streaming TAR reading
+for the preservation TAR wrap paths.
+
+TeeTarWriter hashes each source file as it is copied
+into the archive, and hashes every byte written to the
+archive itself, so the member manifest and the whole
+file MD5 are available when the TAR is closed without
+re-reading source or TAR. With a checksum cache, source
+files it already holds are copied without being hashed
+again and new source MD5s are stored for later runs.
+The end of archive offset is kept so a member can be
+appended later without reading the member headers, and
+an index of member offsets, written last, lets restores
+and spot checks pread single members. Standard library
+only so the module can also be imported by the cron_code
+scripts.
+"""
+
+import hashlib
+import io
+import json
+import os
+import random
+import stat
+import tarfile
+import time
+from typing import Callable, Dict, List, Optional
+
+CHUNK_SIZE = 4 * 1024 * 1024
+END_OF_ARCHIVE = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+INDEX_SUFFIX = "_index.json"
+
+
+class _HashingWriter:
+    """
+    File object wrapper that MD5 hashes all
+    bytes written and tracks the write offset
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+        self.offset = 0
+
+    def write(self, data) -> int:
+        self.md5.update(data)
+        self.fileobj.write(data)
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.offset
+
+
+class _HashingReader:
+    """
+    File object wrapper that MD5 hashes
+    all bytes read from the source file
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.md5.update(data)
+        return data
+
+
+class TeeTarWriter:
+    """
+    Write an uncompressed TAR in one pass, collecting
+    {member name: MD5} for every regular file added
+    and the whole file MD5 of the finished archive.
+    Files found in cache (a hashing.ChecksumCache) are
+    not hashed again, new source MD5s go to it on close.
+    index holds the offsets of each regular member.
+    Raises FileExistsError if the TAR exists.
+    """
+
+    def __init__(self, tar_path: str, chunk_size: int = CHUNK_SIZE, cache=None):
+        self.tar_path = tar_path
+        self.cache = cache
+        self.checksums: Dict[str, str] = {}
+        self.index: List[Dict] = []
+        self._cache_entries = {}
+        self._cached: Dict[str, tuple] = {}
+        self.md5: Optional[str] = None
+        self.size: Optional[int] = None
+        self.end_offset: Optional[int] = None
+        self._head_md5 = None
+        self._file = open(tar_path, "xb", buffering=chunk_size)
+        self._writer = _HashingWriter(self._file)
+        self._tar = tarfile.open(
+            fileobj=self._writer, mode="w:", copybufsize=chunk_size
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def add(self, path: str, arcname: str) -> None:
+        """
+        Add file or folder recursively, ordered
+        as tarfile.TarFile.add() would order it
+        """
+        tarinfo = self._tar.gettarinfo(path, arcname)
+        if tarinfo is None:
+            return
+
+        if tarinfo.isreg():
+            if self.cache is not None and path not in self._cached:
+                self._lookup([path])
+            header_offset = self._writer.offset
+            with open(path, "rb") as source:
+                before = os.fstat(source.fileno())
+                key = self.cache.key(before) if self.cache is not None else None
+                cached = self._cached.pop(path, None)
+                if cached is not None and cached[0] == key and cached[1]:
+                    reader = source
+                else:
+                    cached = None
+                    reader = _HashingReader(source)
+                self._tar.addfile(tarinfo, reader)
+                after = os.fstat(source.fileno())
+            if cached is not None:
+                # A cached MD5 only describes the file as it was before the copy
+                if self.cache.key(after) != key:
+                    raise OSError(f"{path} changed while being archived")
+                self.checksums[tarinfo.name] = cached[1]
+            else:
+                self.checksums[tarinfo.name] = reader.md5.hexdigest()
+                if key is not None and key == self.cache.key(after):
+                    self._cache_entries[path] = (key, self.checksums[tarinfo.name])
+            self._index_member(tarinfo, header_offset, self._writer.offset)
+        elif tarinfo.isdir():
+            self._tar.addfile(tarinfo)
+            names = sorted(os.listdir(path))
+            if self.cache is not None:
+                self._lookup([os.path.join(path, fname) for fname in names])
+            for fname in names:
+                self.add(os.path.join(path, fname), os.path.join(arcname, fname))
+        else:
+            self._tar.addfile(tarinfo)
+
+    def _lookup(self, paths: List[str]) -> None:
+        """
+        Fetch cached MD5s for one folder of files in
+        a single cache query, kept with their keys.
+        Misses are kept with None so they are not
+        looked up again file by file
+        """
+        keys = {}
+        for path in paths:
+            try:
+                info = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            if stat.S_ISREG(info.st_mode):
+                keys[path] = self.cache.key(info)
+        found = self.cache.lookup(keys)
+        for path, key in keys.items():
+            self._cached[path] = (key, found.get(path))
+
+    def add_bytes(self, arcname: str, data: bytes) -> None:
+        """
+        Add in-memory data as a regular file member,
+        eg a checksum manifest built from this session
+        """
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.size = len(data)
+        tarinfo.mtime = int(time.time())
+        tarinfo.mode = 0o644
+        header_offset = self._writer.offset
+        self._tar.addfile(tarinfo, io.BytesIO(data))
+        self.checksums[tarinfo.name] = hashlib.md5(data).hexdigest()
+        self._index_member(tarinfo, header_offset, self._writer.offset)
+
+    def _index_member(self, tarinfo, header_offset: int, end: int) -> None:
+        # Data is the last size bytes before the block padding
+        padded = -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        self.index.append(
+            {
+                "name": tarinfo.name,
+                "header_offset": header_offset,
+                "data_offset": end - padded,
+                "size": tarinfo.size,
+                "md5": self.checksums[tarinfo.name],
+            }
+        )
+
+    def index_bytes(self) -> bytes:
+        """
+        Member index as JSON, for the TAR
+        itself or a sidecar next to it
+        """
+        return json.dumps(self.index, indent=4).encode()
+
+    def close(self) -> str:
+        """
+        Write end of archive blocks and
+        return the whole file MD5
+        """
+        if self.md5 is not None:
+            return self.md5
+        self.end_offset = self._writer.offset
+        self._head_md5 = self._writer.md5.copy()
+        self._tar.close()
+        self._file.close()
+        self.md5 = self._writer.md5.hexdigest()
+        self.size = self._writer.offset
+        if self.cache is not None:
+            self.cache.store(self._cache_entries)
+        return self.md5
+
+    def append_bytes(self, arcname: str, data: bytes) -> str:
+        """
+        Add data as the new last member after close(),
+        seeking straight to the end of archive offset.
+        Returns the updated whole file MD5
+        """
+        if self.end_offset is None:
+            raise ValueError(f"TAR not closed yet: {self.tar_path}")
+        header_offset = self.end_offset
+        self.end_offset = append_member(
+            self.tar_path, arcname, data, self.end_offset, self._head_md5
+        )
+        end = _end_blocks(self.end_offset)
+        whole_md5 = self._head_md5.copy()
+        whole_md5.update(end)
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.size = len(data)
+        self.checksums[tarinfo.name] = hashlib.md5(data).hexdigest()
+        self._index_member(tarinfo, header_offset, self.end_offset)
+        self.md5 = whole_md5.hexdigest()
+        self.size = self.end_offset + len(end)
+        return self.md5
+
+
+def _end_blocks(offset: int) -> bytes:
+    """
+    End of archive blocks written at offset,
+    padded to a whole tarfile record
+    """
+    end = END_OF_ARCHIVE
+    remainder = (offset + len(end)) % tarfile.RECORDSIZE
+    if remainder:
+        end += tarfile.NUL * (tarfile.RECORDSIZE - remainder)
+    return end
+
+
+def append_member(
+    tar_path: str,
+    arcname: str,
+    data: bytes,
+    end_offset: int,
+    md5=None,
+) -> int:
+    """
+    Write data as a regular file member at end_offset,
+    where the end of archive blocks start, then new end
+    blocks. md5 holding the hash of the bytes before
+    end_offset is updated with the member. Returns
+    the new end of archive offset
+    """
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.size = len(data)
+    tarinfo.mtime = int(time.time())
+    tarinfo.mode = 0o644
+    member = tarinfo.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape") + data
+    remainder = len(data) % tarfile.BLOCKSIZE
+    if remainder:
+        member += tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+
+    with open(tar_path, "r+b") as file:
+        file.seek(end_offset)
+        if file.read(len(END_OF_ARCHIVE)) != END_OF_ARCHIVE:
+            raise tarfile.ReadError(
+                f"No end of archive at offset {end_offset} in {tar_path}"
+            )
+        file.seek(end_offset)
+        file.write(member)
+        file.write(_end_blocks(end_offset + len(member)))
+        file.truncate()
+
+    if md5 is not None:
+        md5.update(member)
+    return end_offset + len(member)
+
+
+def read_member_checksums(
+    tar_path: str,
+    key: Optional[Callable[[str], Optional[str]]] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Dict[str, str]:
+    """
+    Stream TAR sequentially and MD5 each regular
+    member, return {key(member name): hex}. Members
+    where key returns None are read past unhashed
+    """
+    data = {}
+    with tarfile.open(tar_path, "r|", bufsize=chunk_size) as tar:
+        for item in tar:
+            if not item.isreg():
+                continue
+            name = key(item.name) if key else item.name
+            if name is None:
+                continue
+            member = tar.extractfile(item)
+            hash_md5 = hashlib.md5()
+            for chunk in iter(lambda: member.read(chunk_size), b""):
+                hash_md5.update(chunk)
+            data[name] = hash_md5.hexdigest()
+
+    return data
+
+
+def write_index(index_path: str, index: List[Dict]) -> str:
+    """
+    Write member index sidecar JSON, return its path
+    """
+    with open(index_path, "w") as file:
+        json.dump(index, file, indent=4)
+    return index_path
+
+
+def load_index(tar_path: str, index_path: Optional[str] = None) -> List[Dict]:
+    """
+    Read the member index from its sidecar, by default
+    tar_path + INDEX_SUFFIX, falling back to the copy
+    inside the TAR, which is always the last member
+    """
+    index_path = index_path or f"{tar_path}{INDEX_SUFFIX}"
+    if os.path.isfile(index_path):
+        with open(index_path) as file:
+            return json.load(file)
+
+    name = f"{os.path.basename(tar_path)}{INDEX_SUFFIX}"
+    return json.loads(read_last_member(tar_path, name))
+
+
+def read_last_member(tar_path: str, name: str) -> bytes:
+    """
+    Return the data of the last member, read back from
+    the end of archive rather than scanning every member
+    header. Raises tarfile.ReadError unless the last
+    member is name and its data does not end in NUL
+    """
+    fd = os.open(tar_path, os.O_RDONLY)
+    try:
+        # Data ends at the last byte before the NUL padding / end blocks
+        data_end = os.fstat(fd).st_size
+        while data_end:
+            start = max(0, data_end - CHUNK_SIZE)
+            tail = os.pread(fd, data_end - start, start).rstrip(tarfile.NUL)
+            if tail:
+                data_end = start + len(tail)
+                break
+            data_end = start
+
+        # Walk back a block at a time to the header sized to end there
+        top = (data_end - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+        while top > 0:
+            start = max(0, top - CHUNK_SIZE)
+            window = os.pread(fd, top - start, start)
+            for offset in range(top - tarfile.BLOCKSIZE, start - 1, -tarfile.BLOCKSIZE):
+                block = window[offset - start : offset - start + tarfile.BLOCKSIZE]
+                try:
+                    info = tarfile.TarInfo.frombuf(block, "utf-8", "surrogateescape")
+                except tarfile.HeaderError:
+                    continue
+                if offset + tarfile.BLOCKSIZE + info.size != data_end:
+                    continue
+                # ustar name field holds at most 100 characters
+                if info.isreg() and name.startswith(info.name):
+                    return os.pread(fd, info.size, offset + tarfile.BLOCKSIZE)
+                break
+            else:
+                top = start
+                continue
+            break
+    finally:
+        os.close(fd)
+
+    raise tarfile.ReadError(f"Last member of {tar_path} is not {name}")
+
+
+def read_member(
+    fd: int, entry: Dict, sink: Optional[Callable[[bytes], None]] = None
+) -> str:
+    """
+    pread one member's data by its index entry, passing
+    each chunk to sink, and return the data MD5 hex
+    """
+    hash_md5 = hashlib.md5()
+    offset = entry["data_offset"]
+    remaining = entry["size"]
+    while remaining:
+        chunk = os.pread(fd, min(CHUNK_SIZE, remaining), offset)
+        if not chunk:
+            raise tarfile.ReadError(f"TAR ends inside member {entry['name']}")
+        hash_md5.update(chunk)
+        if sink:
+            sink(chunk)
+        offset += len(chunk)
+        remaining -= len(chunk)
+
+    return hash_md5.hexdigest()
+
+
+def restore_members(
+    tar_path: str, names: List[str], dest: str, index: Optional[List[Dict]] = None
+) -> Dict[str, bool]:
+    """
+    Restore named members below dest by offset, with no
+    scan of the archive. Returns {name: MD5 matches
+    index}, names missing from the index are False
+    """
+    entries = {entry["name"]: entry for entry in index or load_index(tar_path)}
+    results = {}
+    fd = os.open(tar_path, os.O_RDONLY)
+    try:
+        for name in names:
+            entry = entries.get(name)
+            # Never write outside dest
+            if entry is None or os.path.isabs(name) or ".." in name.split("/"):
+                results[name] = False
+                continue
+            out_path = os.path.join(dest, name)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, "wb") as out:
+                results[name] = read_member(fd, entry, out.write) == entry["md5"]
+    finally:
+        os.close(fd)
+
+    return results
+
+
+def verify_sample(
+    tar_path: str, count: int, index: Optional[List[Dict]] = None
+) -> Dict[str, bool]:
+    """
+    pread a random sample of count members and
+    return {name: MD5 matches index}
+    """
+    index = index or load_index(tar_path)
+    sample = random.sample(index, min(count, len(index)))
+    fd = os.open(tar_path, os.O_RDONLY)
+    try:
+        return {
+            entry["name"]: read_member(fd, entry) == entry["md5"] for entry in sample
+        }
+    finally:
+        os.close(fd)
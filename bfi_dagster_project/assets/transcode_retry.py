@@ -1,7 +1,7 @@
 import datetime
+import json
 import os
 import shutil
-import subprocess
 import time
 from pathlib import Path
 from typing import List, Optional
@@ -9,6 +9,7 @@ from typing import List, Optional
 import dagster as dg
 
 from . import utils
+from .transcoding import encode_rawcooked
 
 
 def build_transcode_retry_asset(key_prefix: Optional[str] = None):
@@ -32,7 +33,9 @@ def build_transcode_retry_asset(key_prefix: Optional[str] = None):
     }
 
     @dg.asset(
-        key=asset_key, required_resource_keys={"database"}, config_schema=config_schema
+        key=asset_key,
+        required_resource_keys={"database", "scheduler"},
+        config_schema=config_schema,
     )
     def reencode_failed_asset(
         context: dg.AssetExecutionContext,
@@ -50,18 +53,18 @@ def build_transcode_retry_asset(key_prefix: Optional[str] = None):
         root, seq = os.path.split(fullpath)
         context.log.info(f"{log_prefix}Received new encoding data: {fullpath}")
 
-        search = "SELECT * FROM encoding_status WHERE seq_id=?"
+        search = """
+            SELECT status, encoding_choice, IFNULL(encoding_retry, 0), Instruction,
+            seq_size FROM encoding_status WHERE seq_id=?
+        """
         data = context.resources.database.retrieve_seq_id_row(
             context, search, "fetchone", (seq,)
         )
         context.log.info(f"{log_prefix}Row retrieved: {data}")
-        retry_count = data[17]
-        if not retry_count.isnumeric():
-            retry_count = 0
-        else:
-            retry_count = int(retry_count)
-        status = data[2]
-        choice = data[15]
+        if data is None:
+            context.log.error(f"{log_prefix}No database row for {seq}. Exiting.")
+            return dg.Output(value={})
+        status, choice, retry_count, instruction, seq_size = data
         context.log.info(f"{log_prefix}==== Retry RAWcook encoding: {fullpath} ====")
         if status != "Pending retry":
             context.log.error(f"{log_prefix}Sequence not suitable for retry. Exiting.")
@@ -80,11 +83,11 @@ def build_transcode_retry_asset(key_prefix: Optional[str] = None):
 
         # Check for accepted gaps / forced framerates
         gaps = fps24 = fps16 = False
-        if "Accept gaps" in str(data):
+        if instruction == "Accept gaps":
             gaps = True
-        elif "Force 24 FPS" in str(data):
+        elif instruction == "Force 24 FPS":
             fps24 = True
-        elif "Force 16 FPS" in str(data):
+        elif instruction == "Force 16 FPS":
             fps16 = True
 
         transcodes_path = os.path.join(
@@ -100,42 +103,39 @@ def build_transcode_retry_asset(key_prefix: Optional[str] = None):
         context.log.info(f"Outputting log file to {log_path}")
         context.log.info("Calling Encoder function")
 
-        # Set up encoding command
+        # Set up encoding options
         output_v2 = utils.check_for_version_two(log_path)
-        cmd = ["rawcooked", "-y", "--all"]
+        options = []
 
         if gaps is False:
-            cmd.append("--no-accept-gaps")
+            options.append("--no-accept-gaps")
 
         if output_v2 is True:
-            cmd.extend(["--output-version", "2"])
+            options.extend(["--output-version", "2"])
 
         if fps16 is True:
-            cmd.extend(["--framerate", "16"])
+            options.extend(["--framerate", "16"])
         if fps24 is True:
-            cmd.extend(["--framerate", "24"])
-
-        cmd.extend(
-            [
-                "-s",
-                "5281680",
-                f"{fullpath}",
-                "-o",
-                f"{ffv1_path}",
-                ">>",
-                f"{log_path}",
-                "2>&1",
-            ]
-        )
+            options.extend(["--framerate", "24"])
 
-        context.log.info(
-            f"Calling RAWcooked with specific sequence command: {' '.join(cmd)}"
+        # Wait for a cross project encode slot before starting RAWcooked
+        slot_id = context.resources.scheduler.wait_for_slot(
+            context, "encode", fullpath, str(key_prefix)
         )
         tic = time.perf_counter()
+        encode_logs = []
         try:
-            subprocess.run(" ".join(cmd), shell=True, check=True)
-        except subprocess.CalledProcessError as err:
-            print(err)
+            with context.resources.scheduler.hold(context):
+                _, version = encode_rawcooked(
+                    options, fullpath, ffv1_path, log_path, seq, encode_logs
+                )
+        finally:
+            context.resources.scheduler.release(context, slot_id)
+        for log in encode_logs:
+            if "WARNING" in log:
+                context.log.warning(f"{log_prefix}{log}")
+            else:
+                context.log.info(f"{log_prefix}{log}")
 
         toc = time.perf_counter()
         mins = (toc - tic) // 60
@@ -155,6 +155,8 @@ def build_transcode_retry_asset(key_prefix: Optional[str] = None):
                 ["status", "RAWcook failed"],
                 ["encoding_complete", str(datetime.datetime.today())[:19]],
                 ["encoding_retry", retry_count + 1],
+                ["output_version", version if version == 2 else None],
+                ["version_predicted", 0],
             )
             context.log.warning(
                 f"{log_prefix}RAWcooked encoding failed. Updating database:\n{arguments}"
@@ -165,16 +167,15 @@ def build_transcode_retry_asset(key_prefix: Optional[str] = None):
             return dg.Output(value={})
 
         context.log.info("RAWcooked encoding completed. Ready for validation checks")
-        checksum_data = utils.md5_hash(ffv1_path)
-        context.log.info(f"Checksum: {checksum_data}")
         arguments = (
             ["status", "RAWcook retry completed"],
             ["encoding_complete", str(datetime.datetime.today())[:19]],
             ["encoding_log", log_path],
             ["derivative_path", ffv1_path],
             ["derivative_size", utils.get_folder_size(ffv1_path)],
-            ["derivative_md5", checksum_data],
             ["encoding_retry", retry_count + 1],
+            ["output_version", version],
+            ["version_predicted", 0],
         )
         context.log.info(
             f"RAWcook completed successfully. Updating database:\n{arguments}"
@@ -182,7 +183,7 @@ def build_transcode_retry_asset(key_prefix: Optional[str] = None):
         entry = context.resources.database.append_to_database(context, seq, arguments)
 
         # Validate in function
-        results = ffv1_validate(ffv1_path)
+        results = ffv1_validate(ffv1_path, seq_size)
         validated_files = {
             "valid": [r["sequence"] for r in results if r["success"] is not False],
             "invalid": [r["sequence"] for r in results if r["success"] is False],
@@ -218,9 +219,11 @@ def build_transcode_retry_asset(key_prefix: Optional[str] = None):
     return reencode_failed_asset
 
 
-def ffv1_validate(spath):
+def ffv1_validate(spath, folder_size=None):
     """
-    Run validation checks against FFV1 MKV
+    Run validation checks against FFV1 MKV,
+    comparing with the sequence size stored
+    at assessment when supplied
     """
     log_data = []
     error_message = []
@@ -246,7 +249,8 @@ def ffv1_validate(spath):
     seq = fname.split(".")[0]
     dpath = os.path.join(str(Path(spath).parents[1]), "processing/", seq)
     log_data.append(f"Paths to work with:\n{dpath}\n{spath}")
-    folder_size = utils.get_folder_size(dpath)
+    if folder_size is None:
+        folder_size = utils.get_folder_size(dpath)
     file_size = utils.get_folder_size(spath)
     log_data.append(
         f"Found sizes in bytes:\n{folder_size} {dpath}\n{file_size} {spath}"
@@ -265,7 +269,11 @@ def ffv1_validate(spath):
         validation = False
         error_message = "RAWcook file not found"
 
-    result = utils.mediaconch_mkv(spath)
+    # MD5, policy and --check read the MKV together from one cached pass
+    verified = utils.verify_mkv(spath)
+    log_data.append(f"Checksum: {verified['md5']}")
+    log_data.append(f"Verification timings in seconds: {verified['timings']}")
+    result = verified["mediaconch"]
     if result[0] != "Pass":
         log_data.append(result[1])
         log_data.append(f"WARNING: MKV file failed Mediaconch policy: {result[-1]}")
@@ -282,7 +290,7 @@ def ffv1_validate(spath):
     log_data.append("Log for MKV passed checks")
 
     # Run RAWcook check pass
-    success = utils.check_file(spath)
+    success = verified["check"]
     if success is False:
         validation = False
         log_data.append("WARNING: Matroska failed --check pass")
@@ -311,6 +319,8 @@ def ffv1_validate(spath):
             ["validation_success", "No"],
             ["validation_complete", str(datetime.datetime.today())[:19]],
             ["error_message", error_message],
+            ["derivative_md5", verified["md5"]],
+            ["verification_timings", json.dumps(verified["timings"])],
         )
         return {
             "sequence": seq,
@@ -352,6 +362,8 @@ def ffv1_validate(spath):
             ["error_message", "None"],
             ["sequence_deleted", seq_del],
             ["moved_to_autoingest", auto_move],
+            ["derivative_md5", verified["md5"]],
+            ["verification_timings", json.dumps(verified["timings"])],
         )
 
         return {
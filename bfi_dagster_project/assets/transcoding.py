@@ -1,17 +1,23 @@
 import datetime
+import json
 import os
 import shutil
-import subprocess
 import time
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import dagster as dg
 
-from . import utils
+from . import image_header, rawcooked_log, utils
 
+VERSION_TWO_MIN_RUNS = int(os.environ.get("VERSION_TWO_MIN_RUNS", "3"))
+VERSION_TWO_THRESHOLD = float(os.environ.get("VERSION_TWO_THRESHOLD", "0.75"))
 
-def build_transcode_ffv1_asset(key_prefix: Optional[str] = None):
+
+def build_transcode_ffv1_asset(
+    key_prefix: Optional[str] = None,
+    partitions_def: Optional[dg.PartitionsDefinition] = None,
+):
     """
     New factory function that returns the asset with optional key prefix.
     """
@@ -24,7 +30,10 @@ def build_transcode_ffv1_asset(key_prefix: Optional[str] = None):
         ins_dict = {"assessment": dg.AssetIn("assess_sequence")}
 
     @dg.asset(
-        key=asset_key, ins=ins_dict, required_resource_keys={"database", "process_pool"}
+        key=asset_key,
+        ins=ins_dict,
+        required_resource_keys={"database", "process_pool", "scheduler", "work_leases"},
+        partitions_def=partitions_def,
     )
     def transcode_ffv1(
         context: dg.AssetExecutionContext,
@@ -61,32 +70,66 @@ def build_transcode_ffv1_asset(key_prefix: Optional[str] = None):
             else:
                 for_rawcooking.append(fpath)
 
-        # Create/execute parallel transcodes
+        # Each MKV is validated as soon as its own encode finishes
         context.log.info(f"{log_prefix}Launcing RAWcooked multiprocessing encoding")
-        transcode_tasks = [(folder,) for folder in for_rawcooking]
-        results = context.resources.process_pool.map(transcode, transcode_tasks)
+        transcode_tasks = [
+            (folder, predict_version_two(context, os.path.basename(fpath), log_prefix))
+            for folder, fpath in zip(for_rawcooking, assessment["RAWcook"])
+        ]
+        completed_files = []
+        results = []
+        scheduler = context.resources.scheduler
+        seq_ids = [os.path.basename(fpath) for fpath in assessment["RAWcook"]]
+        # Sizes stored at assessment save validation rescanning each folder
+        sizes = context.resources.database.sequence_sizes(context, seq_ids)
+        leases = context.resources.work_leases
+        try:
+            with leases.hold(context, seq_ids, "transcode_ffv1"), scheduler.hold(
+                context
+            ):
+                for batch in context.resources.process_pool.pipeline(
+                    transcode,
+                    ffv1_validate,
+                    transcode_tasks,
+                    lambda data: (
+                        (data["path"], sizes.get(data["sequence"]))
+                        if data["success"] is True
+                        else None
+                    ),
+                    admit=lambda task: scheduler.acquire(
+                        context, "encode", task[0], str(key_prefix)
+                    ),
+                    release=lambda slot_id: scheduler.release(context, slot_id),
+                    poll=scheduler.poll_seconds,
+                ):
+                    # Write data to log / db for everything finished since last wake
+                    entries = context.resources.database.bulk_append_to_database(
+                        context,
+                        [(data["sequence"], data["db_arguments"]) for _, data in batch],
+                    )
+                    for stage, data in batch:
+                        seq = data["sequence"]
+                        if stage == 1 and data["success"] is True:
+                            completed_files.append(data["path"])
+                        elif stage == 2:
+                            results.append(data)
+                        context.log.info(
+                            f"{log_prefix}Written to Database: {entries.get(seq)}"
+                        )
+                        for log in data["logs"]:
+                            if "WARNING" in log:
+                                context.log.warning(f"{log_prefix}{log}")
+                            else:
+                                context.log.info(f"{log_prefix}{log}")
+        finally:
+            # Outcome of every encode is recorded, or the run failed,
+            # so other hosts may move on
+            leases.release(context, seq_ids)
 
-        # Filter out None vals
-        completed_files = [r["path"] for r in results if r["success"] is not None]
         context.log.info(f"Completed {len(completed_files)} RAWcooked transcodes.")
-
-        for data in results:
-            seq = data["sequence"]
-            arg = data["db_arguments"]
-            entry = context.resources.database.append_to_database(context, seq, arg)
-            context.log.info(f"{log_prefix}Written to Database: {entry}")
-            for log in data["logs"]:
-                if "WARNING" in log:
-                    context.log.warning(f"{log_prefix}{log}")
-                else:
-                    context.log.info(f"{log_prefix}{log}")
-
-        # Validate in function
         if not completed_files:
             return dg.Output(value={}, metadata={"successfully_complete": "0"})
 
-        validation_tasks = [(folder,) for folder in completed_files]
-        results = context.resources.process_pool.map(ffv1_validate, validation_tasks)
         validated_files = {
             "valid": [r["sequence"] for r in results if r["success"] is not False],
             "invalid": [r["sequence"] for r in results if r["success"] is False],
@@ -96,18 +139,6 @@ def build_transcode_ffv1_asset(key_prefix: Optional[str] = None):
             f"Invalid={len(validated_files['invalid'])}"
         )
 
-        # Write data to log / db
-        for data in results:
-            seq = data["sequence"]
-            args = data["db_arguments"]
-            entry = context.resources.database.append_to_database(context, seq, args)
-            context.log.info(f"{log_prefix}Written to Database: {entry}")
-            for log in data["logs"]:
-                if "WARNING" in log:
-                    context.log.warning(f"{log_prefix}{log}")
-                else:
-                    context.log.info(f"{log_prefix}{log}")
-
         return dg.Output(
             value={
                 "validated_files": validated_files["valid"],
@@ -122,9 +153,45 @@ def build_transcode_ffv1_asset(key_prefix: Optional[str] = None):
     return transcode_ffv1
 
 
-def transcode(fullpath: tuple[str]) -> Dict[str, Any]:
-    """Complete transcodes in parallel"""
+def predict_version_two(
+    context: dg.AssetExecutionContext, seq: str, log_prefix: str = ""
+) -> bool:
+    """
+    Predict from past encodes of sequences with the same
+    header features whether output version 1 will fail,
+    falling back to features without image dimensions
+    """
+    database = context.resources.database
+    row = database.retrieve_seq_id_row(
+        context,
+        "SELECT header_signature FROM encoding_status WHERE seq_id=?",
+        "fetchone",
+        (seq,),
+    )
+    if not row or not row[0]:
+        return False
+
+    for key, prefix in ((row[0], False), (image_header.coarse_key(row[0]), True)):
+        history = database.output_version_history(context, key, prefix)
+        runs = sum(history.values())
+        if runs < VERSION_TWO_MIN_RUNS:
+            continue
+        share = history.get(2, 0) / runs
+        context.log.info(
+            f"{log_prefix}{seq} header {key}: {history.get(2, 0)}/{runs} past encodes needed output version 2"
+        )
+        return share >= VERSION_TWO_THRESHOLD
+
+    return False
+
+
+def transcode(fullpath: tuple) -> Dict[str, Any]:
+    """
+    Complete transcodes in parallel, fullpath is
+    (folder, output version 2 predicted)
+    """
     log_data = []
+    predicted = len(fullpath) > 1 and fullpath[1] is True
 
     gaps = fps24 = fps16 = False
     root, seq = os.path.split(fullpath[0])
@@ -167,43 +234,26 @@ def transcode(fullpath: tuple[str]) -> Dict[str, Any]:
     log_data.append(f"Outputting log file to {log_path}")
     log_data.append("Calling Encoder function")
 
-    # Set up encoding command
+    # Set up encoding options
     output_v2 = utils.check_for_version_two(log_path)
-    cmd = ["rawcooked", "-y", "--all"]
+    predicted = predicted and not output_v2
+    options = []
 
     if gaps is False:
-        cmd.append("--no-accept-gaps")
+        options.append("--no-accept-gaps")
 
-    if output_v2 is True:
-        cmd.extend(["--output-version", "2"])
+    if output_v2 is True or predicted is True:
+        if predicted:
+            log_data.append("Output version 2 predicted from past encodes")
+        options.extend(["--output-version", "2"])
 
     if fps16 is True:
-        cmd.extend(["--framerate", "16"])
+        options.extend(["--framerate", "16"])
     if fps24 is True:
-        cmd.extend(["--framerate", "24"])
-
-    cmd.extend(
-        [
-            "-s",
-            "5281680",
-            f"{fullpath}",
-            "-o",
-            f"{ffv1_path}",
-            ">>",
-            f"{log_path}",
-            "2>&1",
-        ]
-    )
+        options.extend(["--framerate", "24"])
 
-    log_data.append(
-        f"Calling RAWcooked with specific sequence command: {' '.join(cmd)}"
-    )
     tic = time.perf_counter()
-    try:
-        subprocess.run(" ".join(cmd), shell=True, check=True)
-    except subprocess.CalledProcessError as err:
-        print(err)
-
+    _, version = encode_rawcooked(options, fullpath, ffv1_path, log_path, seq, log_data)
     toc = time.perf_counter()
     mins = (toc - tic) // 60
     log_data.append(f"RAWcooked encoding took {mins} minutes")
@@ -216,9 +266,12 @@ def transcode(fullpath: tuple[str]) -> Dict[str, Any]:
             utils.move_to_failures(ffv1_path)
         utils.move_to_failures(fullpath)
         utils.move_log_to_dest(log_path, "failures")
+        # A failed version 1 encode says nothing about version 2 need
         arguments = (
             ["status", "RAWcook failed"],
             ["encoding_complete", str(datetime.datetime.today())[:19]],
+            ["output_version", version if version == 2 else None],
+            ["version_predicted", int(predicted)],
         )
 
         return {
@@ -230,8 +283,6 @@ def transcode(fullpath: tuple[str]) -> Dict[str, Any]:
         }
 
     log_data.append("RAWcooked encoding completed. Ready for validation checks")
-    checksum_data = utils.md5_hash(ffv1_path)
-    log_data.append(f"Checksum: {checksum_data}")
     arguments = (
         ["status", "RAWcook completed"],
         ["encoding_complete", str(datetime.datetime.today())[:19]],
@@ -239,7 +290,8 @@ def transcode(fullpath: tuple[str]) -> Dict[str, Any]:
         ["encoding_log", log_path],
         ["derivative_path", ffv1_path],
         ["derivative_size", utils.get_folder_size(ffv1_path)],
-        ["derivative_md5", checksum_data],
+        ["output_version", version],
+        ["version_predicted", int(predicted)],
     )
     log_data.append(f"RAWcook completed successfully. Updating database:\n{arguments}")
 
@@ -252,9 +304,68 @@ def transcode(fullpath: tuple[str]) -> Dict[str, Any]:
     }
 
 
+def encode_rawcooked(
+    options: List[str],
+    fullpath: str,
+    ffv1_path: str,
+    log_path: str,
+    seq: str,
+    log_data: List[str],
+) -> tuple[int, int]:
+    """
+    Run RAWcooked streaming its log and progress, when
+    output version 1 cannot hold the reversibility data
+    it is stopped and rerun at once with version 2.
+    Return exit code and output version used
+    """
+    total_frames = utils.estimate_sequence(fullpath)[0]
+    while True:
+        version = 2 if "--output-version" in options else 1
+        cmd = [
+            "rawcooked",
+            "-y",
+            "--all",
+            *options,
+            "-s",
+            "5281680",
+            fullpath,
+            "-o",
+            ffv1_path,
+        ]
+        log_data.append(
+            f"Calling RAWcooked with specific sequence command: {' '.join(cmd)}"
+        )
+        progress = rawcooked_log.ProgressWriter(seq, total_frames, version)
+        returncode, parser = rawcooked_log.run(cmd, log_path, progress)
+        log_data.append(
+            f"RAWcooked exit code {returncode}, {parser.frames}/{total_frames} frames, "
+            f"{parser.bytes} bytes at {parser.fps} fps"
+        )
+        if not parser.abort:
+            progress.update(parser, "complete" if returncode == 0 else "failed", True)
+            return returncode, version
+
+        log_data.append(f"WARNING: RAWcooked stopped early: {parser.abort}")
+        if not parser.version_two or version == 2:
+            progress.update(parser, "aborted", True)
+            if os.path.isfile(ffv1_path):
+                os.remove(ffv1_path)
+            return returncode, version
+
+        # Keep the version 1 log with the failures, as a retry run would
+        progress.update(parser, "requeued output version 2", True)
+        if os.path.isfile(ffv1_path):
+            os.remove(ffv1_path)
+        utils.move_log_to_dest(log_path, "failures")
+        log_data.append("Rerunning RAWcooked with --output-version 2")
+        options = [*options, "--output-version", "2"]
+
+
 def ffv1_validate(fullpath):
     """
-    Run validation checks against TAR
+    Run validation checks against FFV1 MKV,
+    comparing with the sequence size stored
+    at assessment when passed with the path
     """
     log_data = []
     error_message = []
@@ -283,7 +394,9 @@ def ffv1_validate(fullpath):
     seq = fname.split(".")[0]
     dpath = os.path.join(str(Path(spath).parents[1]), "processing/", seq)
     log_data.append(f"Paths to work with:\n{dpath}\n{spath}")
-    folder_size = utils.get_folder_size(dpath)
+    folder_size = fullpath[1] if isinstance(fullpath, tuple) else None
+    if folder_size is None:
+        folder_size = utils.get_folder_size(dpath)
     file_size = utils.get_folder_size(spath)
     log_data.append(
         f"Found sizes in bytes:\n{folder_size} {dpath}\n{file_size} {spath}"
@@ -302,7 +415,11 @@ def ffv1_validate(fullpath):
         validation = False
         error_message = "RAWcook file not found"
 
-    result = utils.mediaconch_mkv(spath)
+    # MD5, policy and --check read the MKV together from one cached pass
+    verified = utils.verify_mkv(spath)
+    log_data.append(f"Checksum: {verified['md5']}")
+    log_data.append(f"Verification timings in seconds: {verified['timings']}")
+    result = verified["mediaconch"]
     if result[0] != "Pass":
         log_data.append(result[1])
         log_data.append(f"WARNING: MKV file failed Mediaconch policy: {result[-1]}")
@@ -319,7 +436,7 @@ def ffv1_validate(fullpath):
     log_data.append("Log for MKV passed checks")
 
     # Run RAWcook check pass
-    success = utils.check_file(spath)
+    success = verified["check"]
     if success is False:
         validation = False
         log_data.append("WARNING: Matroska failed --check pass")
@@ -348,6 +465,8 @@ def ffv1_validate(fullpath):
             ["validation_success", "No"],
             ["validation_complete", str(datetime.datetime.today())[:19]],
             ["error_message", error_message],
+            ["derivative_md5", verified["md5"]],
+            ["verification_timings", json.dumps(verified["timings"])],
         )
         return {
             "sequence": seq,
@@ -388,6 +507,8 @@ def ffv1_validate(fullpath):
             ["error_message", "None"],
             ["sequence_deleted", seq_del],
             ["moved_to_autoingest", auto_move],
+            ["derivative_md5", verified["md5"]],
+            ["verification_timings", json.dumps(verified["timings"])],
         )
 
         return {
@@ -8,12 +8,17 @@ import shutil
 import subprocess
 import sys
 import tarfile
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Final, List, Optional
 
 import ffmpeg
 import tenacity
 
+from . import hashing, image_header, rawcooked_log
+
 # Local BFI_scripts library for writing to BFI database
 # Code is an environment variable for the BFI_scripts repository
 sys.path.append(os.environ.get("CODE"))
@@ -22,9 +27,112 @@ import adlib_v3 as ad
 # Import paths
 METADATA_PATH = os.environ.get("CID_MEDIAINFO")
 CID_API = os.environ.get("CID_API4")
+HEADER_SCAN_WORKERS = int(os.environ.get("HEADER_SCAN_WORKERS", "16"))
 PREFIX: Final = ["N", "C", "PD", "SPD", "PBS", "PBM", "PBL", "SCR", "CA"]
 
 
+IMAGE_EXT: Final = (".dpx", ".DPX", ".tif", ".TIF", ".tiff", ".TIFF")
+
+
+class SequenceIndex:
+    """
+    Single os.scandir walk of a sequence folder, kept
+    in compact arrays so one NAS walk can be shared by
+    the folder functions below. Folders are ordered as
+    os.walk() yields them, files in scandir order.
+    Folders that cannot be listed are kept in errors
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.errors: List[str] = []
+        self.dirs = [root]
+        self.dir_depth = array("H", [0])
+        self.dir_entries = array("L", [0])
+        self.file_dir = array("L")
+        self.names = []
+        self.sizes = array("q")
+        self.mtimes = array("q")
+        self.inodes = array("Q")
+        self.frames = array("q")
+        self._scan(0)
+
+    def _scan(self, dir_id: int) -> None:
+        """
+        Record entries of one folder then recurse
+        into sub folders, matching os.walk topdown
+        """
+        subdirs = []
+        try:
+            entries = os.scandir(self.dirs[dir_id])
+        except OSError as err:
+            self.errors.append(f"Unable to list {self.dirs[dir_id]}: {err}")
+            return
+        with entries:
+            for entry in entries:
+                self.dir_entries[dir_id] += 1
+                if entry.is_dir():
+                    self.dirs.append(entry.path)
+                    self.dir_depth.append(self.dir_depth[dir_id] + 1)
+                    self.dir_entries.append(0)
+                    if not entry.is_symlink():
+                        subdirs.append(len(self.dirs) - 1)
+                    continue
+                stat = entry.stat()
+                self.file_dir.append(dir_id)
+                self.names.append(entry.name)
+                self.sizes.append(stat.st_size)
+                self.mtimes.append(stat.st_mtime_ns)
+                self.inodes.append(entry.inode())
+                if entry.name.endswith(IMAGE_EXT):
+                    self.frames.append(
+                        int(re.search(r"\d+(?!.*\d)", entry.name).group())
+                    )
+                else:
+                    self.frames.append(-1)
+
+        for sub_id in subdirs:
+            self._scan(sub_id)
+
+    def chmod(self, mode: int) -> List[str]:
+        """
+        Set mode on every folder and file found by
+        the walk, return errors for the caller's log
+        """
+        errors = []
+        for fpath in self.dirs + self.paths():
+            try:
+                os.chmod(fpath, mode)
+            except OSError as e:
+                errors.append(f"Error changing {fpath}: {e}")
+        return errors
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def path(self, num: int) -> str:
+        """
+        Return full path for file number
+        """
+        return os.path.join(self.dirs[self.file_dir[num]], self.names[num])
+
+    def paths(self) -> List[str]:
+        """
+        Return full paths for all files
+        """
+        return [self.path(num) for num in range(len(self.names))]
+
+    def image_numbers(self) -> List[int]:
+        """
+        Return file numbers of DPX/TIF images
+        """
+        return [num for num, frame in enumerate(self.frames) if frame >= 0]
+
+    @property
+    def total_size(self) -> int:
+        return sum(self.sizes)
+
+
 def get_object_number(fname: str) -> Optional[str]:
     """
     Extract object number from name formatted
@@ -82,14 +190,68 @@ def get_metadata(arg: str, dpath: str) -> str:
         return False
 
 
-def write_dir_tree(dpath: str) -> str:
+def get_image_metadata(ipath: str) -> Dict:
+    """
+    Read DPX/TIFF header natively, with one
+    ffprobe / exiftool call only as fallback
+    for values the header could not supply
+    """
+    header = image_header.read_header(ipath)
+    metadata = dict(header) if header else {}
+    fields = {
+        "pix_fmt": "pix_fmt",
+        "bitdepth": "bits_per_raw_sample",
+        "width": "width",
+        "height": "height",
+    }
+    if not all(metadata.get(key) for key in fields):
+        try:
+            probe = ffmpeg.probe(ipath)
+            stream = probe["streams"][0] if probe.get("streams") else {}
+        except Exception as err:
+            print(err)
+            stream = {}
+        for key, probe_key in fields.items():
+            if not metadata.get(key):
+                metadata[key] = stream.get(probe_key)
+
+    if header is None:
+        metadata["fps"] = get_fps(ipath)
+
+    return metadata
+
+
+def scan_sequence_headers(index: SequenceIndex) -> Dict:
+    """
+    Compare header of every DPX/TIFF in
+    SequenceIndex against the majority
+    """
+    image_nums = index.image_numbers()
+    return image_header.scan_sequence(
+        [index.path(num) for num in image_nums],
+        [index.sizes[num] for num in image_nums],
+        workers=HEADER_SCAN_WORKERS,
+    )
+
+
+def write_dir_tree(dpath: str, index: Optional[SequenceIndex] = None) -> str:
     """
     Call subprocess tree to map directory
     into file for inclusion in source folder
+    or draw tree from SequenceIndex if supplied
     """
 
     seq = os.path.basename(dpath)
     fpath = os.path.join(dpath, f"{seq}_directory_contents.txt")
+    if index is not None:
+        try:
+            with open(fpath, "w") as tree_file:
+                tree_file.write(format_dir_tree(index))
+            return fpath
+        except OSError as err:
+            print(err)
+            return False
+
     cmd = ["tree", dpath, "-o", fpath]
     try:
         subprocess.run(cmd, text=True, check=True, shell=False)
@@ -99,12 +261,43 @@ def write_dir_tree(dpath: str) -> str:
         return False
 
 
+def format_dir_tree(index: SequenceIndex) -> str:
+    """
+    Render SequenceIndex in the style of
+    Linux tree, sorted, with totals line
+    """
+    children = collections.defaultdict(list)
+    for dir_id in range(1, len(index.dirs)):
+        parent = os.path.dirname(index.dirs[dir_id])
+        children[parent].append((os.path.basename(index.dirs[dir_id]), dir_id))
+    for num, name in enumerate(index.names):
+        children[index.dirs[index.file_dir[num]]].append((name, None))
+
+    lines = [index.root]
+
+    def branch(dpath: str, prefix: str) -> None:
+        entries = sorted(children[dpath])
+        for pos, (name, dir_id) in enumerate(entries):
+            last = pos == len(entries) - 1
+            lines.append(f"{prefix}{'└── ' if last else '├── '}{name}")
+            if dir_id is not None:
+                branch(index.dirs[dir_id], f"{prefix}{'    ' if last else '│   '}")
+
+    branch(index.root, "")
+    lines.append("")
+    lines.append(f"{len(index.dirs) - 1} directories, {len(index)} files")
+    return "\n".join(lines) + "\n"
+
+
 @tenacity.retry(stop=tenacity.stop_after_attempt(5))
-def metadata_dump(dpath: str, file_path: str, ext: str) -> str:
+def metadata_dump(
+    dpath: str, file_path: str, ext: str, text_dump: Optional[str] = None
+) -> str:
     """
     Capture metadata for file into source folder
     if ext supplied copy to metadata folder for
-    inclusion in CID digital media record
+    inclusion in CID digital media record, reusing
+    text_dump from the source folder if supplied
     """
     command = command2 = []
     file = os.path.basename(file_path)
@@ -143,7 +336,11 @@ def metadata_dump(dpath: str, file_path: str, ext: str) -> str:
 
         try:
             subprocess.run(command, check=True, shell=False)
-            subprocess.run(command2, check=True, shell=False)
+            # Full text output matches the source folder dump, copy over re-running
+            if text_dump and os.path.isfile(text_dump):
+                shutil.copyfile(text_dump, outpath2)
+            else:
+                subprocess.run(command2, check=True, shell=False)
         except Exception as err:
             raise err
 
@@ -218,19 +415,23 @@ def get_partwhole(fname: str) -> tuple[int, int]:
     return (part, whole)
 
 
-def count_folder_depth(fpath: str) -> str | bool | None:
+def count_folder_depth(
+    fpath: str, index: Optional[SequenceIndex] = None
+) -> str | bool | None:
     """
     Check if folder is three depth of four depth
     across total scan folder contents and folders
     ordered correctly
     """
+    if index is None:
+        index = SequenceIndex(fpath)
+
     folder_contents = []
-    for root, dirs, _ in os.walk(fpath):
-        for directory in dirs:
-            if directory.startswith("."):
-                if os.listdir(os.path.join(root, directory)) == []:
-                    continue
-            folder_contents.append(os.path.join(root, directory))
+    for dir_id in range(1, len(index.dirs)):
+        directory = os.path.basename(index.dirs[dir_id])
+        if directory.startswith(".") and index.dir_entries[dir_id] == 0:
+            continue
+        folder_contents.append(index.dirs[dir_id])
 
     # Check for dupes in folder names and length of found folders
     repeats = [
@@ -323,32 +524,61 @@ def get_file_type(seq: str) -> tuple[str, str]:
     return priref, ftype, rec[0]
 
 
-def gaps(dpath: str) -> tuple[str, str, list]:
+def gaps(
+    dpath: str, index: Optional[SequenceIndex] = None
+) -> tuple[str, str, list, list]:
     """
     Return abs path to first and last DPX
-    in sequence then list of any numbers
-    missing in DPX sequence
+    in sequence, missing numbers as sorted
+    (start, end) runs and duplicated numbers
     """
+    if index is None:
+        index = SequenceIndex(dpath)
+    image_nums = index.image_numbers()
+    if not image_nums:
+        return None, None, None, None
 
-    missing_dpx = []
-    file_nums, filenames = iterate_folders(dpath)
-    if file_nums is None or filenames is None:
-        return None, None, None
-    print(file_nums, filenames)
-    # Calculate range from first/last
-    file_range = list(range(min(file_nums), max(file_nums) + 1))
-    print(file_range)
     # Retrieve equivalent DPX names for logs
-    first_dpx = filenames[file_nums.index(min(file_nums))]
-    last_dpx = filenames[file_nums.index(max(file_nums))]
+    first_num = last_num = image_nums[0]
+    for num in image_nums:
+        if index.frames[num] < index.frames[first_num]:
+            first_num = num
+        elif index.frames[num] > index.frames[last_num]:
+            last_num = num
+
+    # Walk sorted frame numbers once for absent / repeated numbers
+    frames = array("q", sorted(index.frames[num] for num in image_nums))
+    missing_runs = []
+    duplicates = []
+    for prev, frame in zip(frames, frames[1:]):
+        if frame == prev:
+            if not duplicates or duplicates[-1] != frame:
+                duplicates.append(frame)
+        elif frame > prev + 1:
+            missing_runs.append((prev + 1, frame - 1))
+
+    return (index.path(first_num), index.path(last_num), missing_runs, duplicates)
+
+
+def count_missing(missing_runs: list) -> int:
+    """
+    Total frame numbers in (start, end) runs
+    """
+    return sum(end - start + 1 for start, end in missing_runs)
 
-    # Check for absent numbers in sequence
-    missing = list(set(file_nums) ^ set(file_range))
-    if len(missing) > 0:
-        for missed in missing:
-            missing_dpx.append(missed)
 
-    return (first_dpx, last_dpx, missing_dpx)
+def format_runs(missing_runs: list, limit: int = 50) -> str:
+    """
+    Summarise (start, end) runs for logs and
+    database, eg '1201-1250, 3000'
+    """
+    runs = [
+        str(start) if start == end else f"{start}-{end}"
+        for start, end in missing_runs[:limit]
+    ]
+    if len(missing_runs) > limit:
+        runs.append(f"... (+{len(missing_runs) - limit} more runs)")
+    return ", ".join(runs)
 
 
 def check_fname(fname: str) -> bool:
@@ -370,39 +600,119 @@ def check_fname(fname: str) -> bool:
     return True
 
 
-def iterate_folders(fpath: str) -> tuple[list, list]:
+def iterate_folders(
+    fpath: str, index: Optional[SequenceIndex] = None
+) -> tuple[list, list]:
     """
     Iterate suppied path and return list
     of filenames re search for last numbers
     in filename
     """
-    file_nums = []
-    filenames = []
-    for root, _, files in os.walk(fpath):
-        for file in files:
-            if file.endswith((".dpx", ".DPX", ".tif", ".TIF", ".tiff", ".TIFF")):
-                file_nums.append(int(re.search(r"\d+(?!.*\d)", file).group()))
-                filenames.append(os.path.join(root, file))
-    if not file_nums or not filenames:
+    if index is None:
+        index = SequenceIndex(fpath)
+
+    image_nums = index.image_numbers()
+    if not image_nums:
         return None, None
+    file_nums = [index.frames[num] for num in image_nums]
+    filenames = [index.path(num) for num in image_nums]
     return (file_nums, filenames)
 
 
-def get_folder_size(fpath: str) -> int:
+def sequence_signature(dpath: str, sample: int = 2) -> tuple[int, int, float]:
+    """
+    Cheap copy check compared across polls, with no stat
+    per frame. Counts entries from scandir alone, stats each
+    folder, the last sample frames by name per folder and
+    any non-image file. Returns (file count, sampled bytes,
+    newest mtime in seconds of folders and sampled files)
+    """
+    count = sampled = 0
+    newest = 0
+    stack = [dpath]
+    while stack:
+        folder = stack.pop()
+        try:
+            newest = max(newest, os.stat(folder).st_mtime_ns)
+            entries = os.scandir(folder)
+        except OSError as err:
+            print(err)
+            continue
+        frames = []
+        others = []
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                count += 1
+                if entry.name.endswith(IMAGE_EXT):
+                    frames.append(entry)
+                else:
+                    others.append(entry)
+        # Frames copy in name order, so the newest are last
+        frames.sort(key=lambda entry: entry.name)
+        for entry in frames[-sample:] + others:
+            try:
+                info = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            sampled += info.st_size
+            newest = max(newest, info.st_mtime_ns)
+
+    return count, sampled, newest / 1e9
+
+
+def estimate_sequence(dpath: str) -> tuple[int, int]:
+    """
+    Cheap pre-scan for job ordering, counts DPX/TIFF
+    names per folder from scandir alone and stats one
+    frame per folder to estimate bytes. Returns
+    (frame count, estimated bytes)
+    """
+    frames = est_bytes = 0
+    stack = [dpath]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError as err:
+            print(err)
+            continue
+        count = 0
+        sample = None
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(IMAGE_EXT):
+                    count += 1
+                    sample = sample or entry
+                else:
+                    try:
+                        est_bytes += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+        if sample is not None:
+            try:
+                est_bytes += count * sample.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+        frames += count
+
+    return frames, est_bytes
+
+
+def get_folder_size(fpath: str, index: Optional[SequenceIndex] = None) -> int:
     """
     Check the size of given folder path
     return size in kb
     """
     if os.path.isfile(fpath):
         return os.path.getsize(fpath)
+    if index is None:
+        index = SequenceIndex(fpath)
 
-    byte_size = 0
-    for root, _, files in os.walk(fpath):
-        for file in files:
-            fpath = os.path.join(root, file)
-            byte_size += os.path.getsize(fpath)
-
-    return byte_size
+    return index.total_size
 
 
 def move_to_failures(fpath: str) -> None:
@@ -545,6 +855,23 @@ def get_checksums(tar_path: str, folder: str) -> Dict[str, str]:
     return data
 
 
+def tar_manifest_key(item_name: str) -> Optional[str]:
+    """
+    Build MD5 manifest key for a TAR member name
+    matching get_checksums() naming, or None where
+    the member is excluded from the manifest
+    """
+    pth, fname = os.path.split(item_name)
+    # Same files the pre-wrap local manifest always skipped
+    if fname.endswith((".ini", ".md5", ".DS_Store", ".")):
+        return None
+    if "tar_wrap.log" in fname:
+        return None
+
+    folder_prefix = os.path.basename(pth)
+    return f"{folder_prefix}_{fname}"
+
+
 def get_checksum(fpath: str) -> Dict[str, str]:
     """
     Using file path, generate file checksum
@@ -554,12 +881,7 @@ def get_checksum(fpath: str) -> Dict[str, str]:
     pth, file = os.path.split(fpath)
     folder_prefix = os.path.basename(pth)
     file = f"{folder_prefix}_{file}"
-    hash_md5 = hashlib.md5()
-    with open(fpath, "rb") as f:
-        for chunk in iter(lambda: f.read(65536), b""):
-            hash_md5.update(chunk)
-        data[file] = str(hash_md5.hexdigest())
-        f.close()
+    data[file] = hashing.hash_file(fpath)
     return data
 
 
@@ -585,11 +907,7 @@ def md5_hash(tar_file: str) -> Optional[int]:
     Make whole file TAR MD5 checksum
     """
     try:
-        hash_md5 = hashlib.md5()
-        with open(tar_file, "rb") as fname:
-            for chunk in iter(lambda: fname.read(65536), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        return hashing.hash_file(tar_file)
 
     except Exception as err:
         print(err)
@@ -639,11 +957,6 @@ def write_to_cid(priref: str, fname: str) -> bool:
 def check_for_version_two(log: str) -> bool:
     """Check if output version2 needed"""
 
-    warnings = [
-        "Error: undecodable file is becoming too big",
-        "Error: the reversibility file is becoming big",
-    ]
-
     if not os.path.isfile(log):
         log_name_clean = os.path.basename(log)
         log_name_fail = f"fail_{log_name_clean}"
@@ -660,7 +973,7 @@ def check_for_version_two(log: str) -> bool:
 
     with open(log, "r") as log_file:
         for line in log_file:
-            if warnings[0] in str(line) or warnings[1] in str(line):
+            if any(elem in str(line) for elem in rawcooked_log.VERSION_TWO_ERRORS):
                 return True
 
     return False
@@ -741,12 +1054,43 @@ def check_file(mpath: str) -> bool:
     return False
 
 
-def recursive_chmod(dpath: str, mode: int) -> None:
+def verify_mkv(mpath: str) -> Dict:
+    """
+    Run MD5, MediaConch policy and rawcooked --check
+    on the MKV at the same time so the three reads
+    share one pass through the page cache. Returns
+    each result and seconds taken per step
+    """
+    steps = {"md5": md5_hash, "mediaconch": mediaconch_mkv, "check": check_file}
+
+    def timed(func):
+        tic = time.perf_counter()
+        result = func(mpath)
+        return result, round(time.perf_counter() - tic, 1)
+
+    tic = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(steps)) as pool:
+        futures = {name: pool.submit(timed, func) for name, func in steps.items()}
+    verified = {"timings": {}}
+    for name, future in futures.items():
+        verified[name], verified["timings"][name] = future.result()
+    verified["timings"]["total"] = round(time.perf_counter() - tic, 1)
+
+    return verified
+
+
+def recursive_chmod(
+    dpath: str, mode: int, index: Optional[SequenceIndex] = None
+) -> None:
     """
     Recursively change permissions of directory and all contents
     """
     os.chmod(dpath, mode)
     if os.path.isdir(dpath):
+        if index is not None:
+            for err in index.chmod(mode):
+                print(err)
+            return
         for root, dirs, files in os.walk(dpath):
             for dir in dirs:
                 try:
@@ -1,31 +1,172 @@
+import atexit
+import collections
 import datetime
 import functools
+import importlib
+import multiprocessing
 import os
+import queue
 import sqlite3
+import threading
 import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
 from contextlib import contextmanager
-from multiprocessing import Pool
 
 import dagster as dg
 
+from . import schema
+
+# Modules each worker imports once at start, not per task
+WARM_MODULES = (
+    "bfi_dagster_project.assets.utils",
+    "bfi_dagster_project.assets.archiving",
+    "bfi_dagster_project.assets.assessment",
+    "bfi_dagster_project.assets.transcoding",
+)
+
+_EXECUTORS = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+
+def _warm_up(modules):
+    """
+    Pool worker initializer, failed imports are left
+    for the task itself to raise
+    """
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as err:
+            print(f"Worker warm up failed to import {module}: {err}")
+
+
+def get_executor(num_proc, modules=WARM_MODULES):
+    """
+    Return this process's long lived executor for num_proc
+    workers, replacing it if a worker died and broke it.
+    Workers come from a forkserver, never forked from this
+    process with its heartbeat threads / SQLite handles
+    """
+    key = (os.getpid(), num_proc)
+    with _EXECUTORS_LOCK:
+        executor = _EXECUTORS.get(key)
+        if executor is None or getattr(executor, "_broken", False):
+            executor = ProcessPoolExecutor(
+                max_workers=num_proc,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_warm_up,
+                initargs=(modules,),
+            )
+            _EXECUTORS[key] = executor
+    return executor
+
+
+@atexit.register
+def shutdown_executors():
+    with _EXECUTORS_LOCK:
+        for key in [key for key in _EXECUTORS if key[0] == os.getpid()]:
+            _EXECUTORS.pop(key).shutdown(wait=True, cancel_futures=True)
+
 
 class ProcessPoolResource:
     def __init__(self, num_proc=3):
         self.num_proc = num_proc
-        # self,_pool = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        return get_executor(self.num_proc)
 
     @contextmanager
     def get_pool(self):
-        pool = Pool(processes=self.num_proc)
+        """
+        Pool is shared and outlives the block,
+        kept for callers of the old interface
+        """
+        yield self.executor
+
+    def map(self, func, iterable):
+        return list(self.executor.map(func, iterable))
+
+    def submit(self, func, *args) -> Future:
+        return self.executor.submit(func, *args)
+
+    def imap_unordered(self, func, iterable):
+        """
+        Yield results as each task finishes
+        rather than in submission order
+        """
+        futures = [self.executor.submit(func, item) for item in iterable]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def pipeline(
+        self, first, second, iterable, follow, admit=None, release=None, poll=30.0
+    ):
+        """
+        Run first on every item and second on follow(result)
+        as soon as that result is ready (None skips stage two).
+        Yields [(stage, result)] of all tasks done since last wake.
+        With admit, an item only starts once admit(item) returns a
+        token, handed to release(token) when the item leaves the
+        pipeline. Refused items are retried each wake / poll secs.
+        If a task raises, nothing new starts, tasks in flight are
+        drained and yielded, then the first error is raised
+        """
+        waiting = collections.deque(iterable)
+        pending = {}
+        error = None
         try:
-            yield pool
+            while waiting or pending:
+                # Start waiting items in order for as long as admission allows
+                while waiting:
+                    token = admit(waiting[0]) if admit else None
+                    if admit and token is None:
+                        break
+                    future = self.executor.submit(first, waiting.popleft())
+                    pending[future] = (1, token)
+                if not pending:
+                    time.sleep(poll)
+                    continue
+
+                done, _ = wait(
+                    pending,
+                    timeout=poll if waiting else None,
+                    return_when=FIRST_COMPLETED,
+                )
+                batch = []
+                for future in done:
+                    stage, token = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as err:
+                        error = error or err
+                        waiting.clear()
+                        if token is not None and release:
+                            release(token)
+                        continue
+                    task = follow(result) if stage == 1 else None
+                    if task is not None:
+                        pending[self.executor.submit(second, task)] = (2, token)
+                    elif token is not None and release:
+                        release(token)
+                    batch.append((stage, result))
+                if batch:
+                    yield batch
         finally:
-            pool.close()
-            pool.join()
+            # Closed early, no admitted item may keep its slot
+            for future, (_, token) in pending.items():
+                future.cancel()
+                if token is not None and release:
+                    release(token)
 
-    def map(self, func, iterable):
-        with self.get_pool() as pool:
-            return pool.map(func, iterable)
+        if error is not None:
+            raise error
 
 
 @dg.resource
@@ -93,47 +234,130 @@ def with_retries(
     return decorator
 
 
+# UPDATE / INSERT ... RETURNING needs SQLite 3.35+
+RETURNING_SUPPORTED = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+class ConnectionPool:
+    """
+    Persistent SQLite connections for one process and
+    database file. Connections are handed to one thread
+    at a time, WAL is checkpointed PASSIVE periodically
+    rather than FULL on every close.
+    """
+
+    def __init__(self, filepath, timeout, size, checkpoint_interval):
+        self.filepath = filepath
+        self.timeout = timeout
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.monotonic()
+        self.migrated = False
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.filepath, timeout=self.timeout, check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    def acquire(self):
+        """
+        Return idle connection and True,
+        or a new connection and False
+        """
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self.connect(), False
+
+    def release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def checkpoint(self, conn, force=False):
+        """
+        Passive checkpoint never waits on readers,
+        run when checkpoint_interval has passed
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self.last_checkpoint < self.checkpoint_interval:
+                return None
+            self.last_checkpoint = now
+        return conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(filepath, timeout, size, checkpoint_interval):
+    """
+    Pools are keyed by pid so forked pool
+    workers never share parent connections
+    """
+    key = (os.getpid(), filepath)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = ConnectionPool(filepath, timeout, size, checkpoint_interval)
+            _POOLS[key] = pool
+    return pool
+
+
+@atexit.register
+def close_pools():
+    """
+    Close this process's idle connections, the last
+    close of a WAL database checkpoints it
+    """
+    with _POOLS_LOCK:
+        for key in [key for key in _POOLS if key[0] == os.getpid()]:
+            _POOLS.pop(key).close()
+
+
 class SQLiteResource(dg.ConfigurableResource):
     filepath: str = dg.EnvVar("DATABASE")
     max_retries: int = 5
     retry_delay: float = 1.0
     timeout: float = 300.0
+    pool_size: int = 4
+    checkpoint_interval: float = 300.0
+
+    def _pool(self) -> ConnectionPool:
+        return get_pool(
+            self.filepath, self.timeout, self.pool_size, self.checkpoint_interval
+        )
 
     @contextmanager
     def get_connection(self, context: dg.AssetExecutionContext):
         """
-        Context manager for database connections to ensure proper closure
+        Context manager lending a pooled connection, committed
+        on success / rolled back on error and returned to pool
         """
+        pool = self._pool()
         attempt = 0
         current_delay = self.retry_delay
         while True:
             try:
-                conn = sqlite3.connect(self.filepath, timeout=self.timeout)
-                context.log.info("Connected to database: %s", self.filepath)
-
-                # Set pragmas for better concurrency
-                conn.execute("PRAGMA journal_mode=WAL")
-                conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
-
-                try:
-                    yield conn
-                finally:
-                    # Ensure we always commit and close properly
-                    try:
-                        conn.commit()
-                        # Force WAL checkpoint before closing
-                        conn.execute("PRAGMA wal_checkpoint(FULL)")
-                    except sqlite3.Error as e:
-                        context.log.error("Error during connection cleanup: %s", e)
-                    finally:
-                        conn.close()
-                        context.log.info(
-                            "Disconnected from database: %s", self.filepath
-                        )
-
-                # If we get here, everything worked so we break the retry loop
+                conn, reused = pool.acquire()
                 break
-
             except sqlite3.OperationalError as e:
                 attempt += 1
                 if attempt > self.max_retries:
@@ -149,6 +373,62 @@ class SQLiteResource(dg.ConfigurableResource):
                 time.sleep(current_delay)
                 current_delay *= 2  # Exponential backoff
 
+        if not reused:
+            context.log.info("Connected to database: %s", self.filepath)
+
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error as e:
+                context.log.error("Error during connection rollback: %s", e)
+                conn.close()
+                raise
+            pool.release(conn)
+            raise
+
+        try:
+            pool.checkpoint(conn)
+        except sqlite3.Error as e:
+            context.log.warning("WAL checkpoint skipped: %s", e)
+        pool.release(conn)
+
+    def setup_for_execution(self, context: dg.InitResourceContext) -> None:
+        """
+        Bring the schema up to date once per process and
+        database file, rather than on every lease / slot call
+        """
+        pool = self._pool()
+        with pool._lock:
+            if pool.migrated:
+                return
+            conn, _ = pool.acquire()
+            try:
+                applied = schema.migrate(conn)
+            finally:
+                pool.release(conn)
+            pool.migrated = True
+        if applied:
+            context.log.info("Applied database migrations: %s", applied)
+
+    def teardown_after_execution(self, context: dg.InitResourceContext) -> None:
+        """
+        Leave connections open for the next step in this
+        process, but checkpoint the WAL if one is due
+        """
+        pool = self._pool()
+        try:
+            conn, _ = pool.acquire()
+        except sqlite3.Error:
+            return
+        try:
+            pool.checkpoint(conn)
+        except sqlite3.Error:
+            pass
+        pool.release(conn)
+
     @with_retries()
     def initialise_db(self, context: dg.AssetExecutionContext):
         """
@@ -156,45 +436,10 @@ class SQLiteResource(dg.ConfigurableResource):
         """
         context.log.info("Initialising database")
         with self.get_connection(context) as conn:
-            cursor = conn.cursor()
-
-            # Enable WAL mode for better concurrent access / busy time out / create table
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS encoding_status (
-                    process_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    seq_id TEXT NOT NULL,
-                    status TEXT DEFAULT 'Started',
-                    folder_path TEXT,
-                    first_image TEXT,
-                    last_image TEXT,
-                    gaps_in_sequence TEXT,
-                    assessment_pass TEXT,
-                    assessment_complete TIMESTAMP,
-                    colourspace TEXT,
-                    seq_size INTEGER,
-                    bitdepth INTEGER,
-                    image_width TEXT,
-                    image_height TEXT,
-                    process_start TIMESTAMP,
-                    encoding_choice TEXT,
-                    encoding_log TEXT,
-                    encoding_retry TEXT,
-                    encoding_complete TIMESTAMP,
-                    derivative_path TEXT,
-                    derivative_size INTEGER,
-                    derivative_md5 TEXT,
-                    validation_complete TIMESTAMP,
-                    validation_success TEXT,
-                    error_message TEXT,
-                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    sequence_deleted TEXT,
-                    moved_to_autoingest TEXT,
-                    project TEXT,
-                    Instruction TEXT
-                )
-            """
-            )
+            # Create or upgrade encoding_status to current schema version
+            applied = schema.migrate(conn)
+            if applied:
+                context.log.info("Applied database migrations: %s", applied)
             context.log.info("Database initialized at: %s", self.filepath)
 
     @with_retries()
@@ -207,7 +452,8 @@ class SQLiteResource(dg.ConfigurableResource):
         key: str,
     ) -> list[tuple]:
         """
-        Initializes a new process record with proper connection handling
+        Initializes a new process record with proper connection handling,
+        or restarts the existing record for seq_id
         """
         with self.get_connection(context) as conn:
             cur = conn.cursor()
@@ -219,16 +465,20 @@ class SQLiteResource(dg.ConfigurableResource):
             INSERT INTO encoding_status
             (seq_id, status, folder_path, process_start, last_updated, project)
             VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(seq_id) DO UPDATE SET
+                status = excluded.status,
+                folder_path = excluded.folder_path,
+                process_start = excluded.process_start,
+                last_updated = excluded.last_updated,
+                project = COALESCE(excluded.project, project)
             """
-            cur.execute(query, (seq_id, status, folder_path, timestamp, timestamp, key))
-
-        # Return after retrieval to ensure we see the inserted data
-        return self.retrieve_seq_id_row(
-            context,
-            "SELECT * FROM encoding_status WHERE seq_id=?",
-            "fetchone",
-            (seq_id,),
-        )
+            params = (seq_id, status, folder_path, timestamp, timestamp, key)
+            if RETURNING_SUPPORTED:
+                cur.execute(f"{query} RETURNING *", params)
+                return cur.fetchone()
+            cur.execute(query, params)
+            cur.execute("SELECT * FROM encoding_status WHERE seq_id = ?", (seq_id,))
+            return cur.fetchone()
 
     @with_retries()
     def append_to_database(
@@ -252,18 +502,159 @@ class SQLiteResource(dg.ConfigurableResource):
         with self.get_connection(context) as conn:
             cursor = conn.cursor()
 
-            # Use parameterized query
+            # Use parameterized query, reading row back in the same round trip
             query = f"UPDATE encoding_status SET {set_clause} WHERE seq_id = ?"
             context.log.info(f"Executing update query: {query}")
+            if RETURNING_SUPPORTED:
+                cursor.execute(f"{query} RETURNING *", all_params)
+                # Lowest process_id first, as the SELECT read back returned
+                rows = cursor.fetchall()
+                return min(rows) if rows else None
             cursor.execute(query, all_params)
+            cursor.execute("SELECT * FROM encoding_status WHERE seq_id = ?", (seq_id,))
+            return cursor.fetchone()
 
-        # Return after retrieval to ensure we see the updated data
-        return self.retrieve_seq_id_row(
-            context,
-            "SELECT * FROM encoding_status WHERE seq_id = ?",
-            "fetchone",
-            (seq_id,),
-        )
+    @with_retries()
+    def bulk_append_to_database(
+        self, context: dg.AssetExecutionContext, updates: list[tuple]
+    ) -> dict:
+        """
+        Apply (seq_id, arguments) pairs from one batch of pool results
+        in a single transaction and return {seq_id: updated row}
+        """
+        if not updates:
+            return {}
+        timestamp = str(datetime.datetime.today())[:19]
+
+        # Group updates setting the same columns into one executemany each
+        grouped = {}
+        for seq_id, arguments in updates:
+            column_names = tuple(arg_pair[0] for arg_pair in arguments)
+            values = [arg_pair[1] for arg_pair in arguments]
+            grouped.setdefault(column_names, []).append(values + [timestamp, seq_id])
+
+        seq_ids = list(dict.fromkeys(seq_id for seq_id, _ in updates))
+        rows = {}
+        with self.get_connection(context) as conn:
+            cursor = conn.cursor()
+            for column_names, params in grouped.items():
+                set_clause = ", ".join(
+                    [f"{col} = ?" for col in column_names + ("last_updated",)]
+                )
+                query = f"UPDATE encoding_status SET {set_clause} WHERE seq_id = ?"
+                context.log.info(
+                    f"Executing bulk update query for {len(params)} rows: {query}"
+                )
+                cursor.executemany(query, params)
+
+            # Keep under SQLITE_MAX_VARIABLE_NUMBER of older builds
+            for start in range(0, len(seq_ids), 500):
+                chunk = seq_ids[start : start + 500]
+                placeholders = ", ".join(["?" for _ in chunk])
+                cursor.execute(
+                    f"SELECT * FROM encoding_status WHERE seq_id IN ({placeholders}) ORDER BY process_id",
+                    chunk,
+                )
+                for row in cursor.fetchall():
+                    rows.setdefault(row[1], row)
+
+        return rows
+
+    @with_retries()
+    def record_stability(
+        self,
+        context: dg.AssetExecutionContext,
+        seq_id: str,
+        folder_path: str,
+        project: str,
+        signature: tuple,
+    ) -> float:
+        """
+        Store (file count, bytes, max mtime) for seq_id,
+        return time it was first seen with this signature
+        """
+        file_count, total_bytes, max_mtime = signature
+        now = time.time()
+        with self.get_connection(context) as conn:
+            conn.execute(
+                """
+                INSERT INTO sequence_stability
+                (seq_id, folder_path, project, file_count, total_bytes,
+                 max_mtime, first_seen, last_changed, last_checked)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(seq_id) DO UPDATE SET
+                    folder_path = excluded.folder_path,
+                    project = excluded.project,
+                    last_changed = CASE
+                        WHEN file_count IS excluded.file_count
+                        AND total_bytes IS excluded.total_bytes
+                        AND max_mtime IS excluded.max_mtime
+                        THEN last_changed ELSE excluded.last_changed END,
+                    file_count = excluded.file_count,
+                    total_bytes = excluded.total_bytes,
+                    max_mtime = excluded.max_mtime,
+                    last_checked = excluded.last_checked
+                """,
+                (
+                    seq_id,
+                    folder_path,
+                    project,
+                    file_count,
+                    total_bytes,
+                    max_mtime,
+                    now,
+                    now,
+                    now,
+                ),
+            )
+            return conn.execute(
+                "SELECT last_changed FROM sequence_stability WHERE seq_id = ?",
+                (seq_id,),
+            ).fetchone()[0]
+
+    @with_retries()
+    def output_version_history(
+        self, context: dg.AssetExecutionContext, key: str, prefix: bool = False
+    ) -> dict[int, int]:
+        """
+        Return {output_version: encodes} for sequences
+        with header_signature key (or key prefix) where
+        the version was not itself a prediction
+        """
+        match = "LIKE ?" if prefix else "= ?"
+        with self.get_connection(context) as conn:
+            rows = conn.execute(
+                f"""
+                SELECT output_version, COUNT(*) FROM encoding_status
+                WHERE header_signature {match}
+                AND output_version IS NOT NULL
+                AND COALESCE(version_predicted, 0) = 0
+                GROUP BY output_version
+                """,
+                (f"{key}|%" if prefix else key,),
+            ).fetchall()
+        return dict(rows)
+
+    @with_retries()
+    def sequence_sizes(
+        self, context: dg.AssetExecutionContext, seq_ids: list[str]
+    ) -> dict[str, int]:
+        """
+        Return {seq_id: seq_size} as stored by assessment
+        so validation need not rescan the sequence folder
+        """
+        if not seq_ids:
+            return {}
+        marks = ",".join("?" * len(seq_ids))
+        with self.get_connection(context) as conn:
+            rows = conn.execute(
+                f"""
+                SELECT seq_id, seq_size FROM encoding_status
+                WHERE seq_id IN ({marks}) AND seq_size IS NOT NULL
+                """,
+                list(seq_ids),
+            ).fetchall()
+        return {seq: int(size) for seq, size in rows}
 
     @with_retries()
     def retrieve_seq_id_row(
@@ -333,3 +724,344 @@ class SQLiteResource(dg.ConfigurableResource):
                     context.log.info("Sample row: %s", cursor.fetchone())
             else:
                 context.log.warning("encoding_status table not found in database!")
+
+
+def mount_point(path: str) -> str:
+    """
+    Walk up from path to the mount it lives on,
+    so projects sharing a NAS share its budget
+    """
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def host_load() -> tuple[float, int]:
+    """
+    Return 1 minute load per CPU and
+    MemAvailable in MB for this host
+    """
+    load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    free_mb = 0
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    free_mb = int(line.split()[1]) // 1024
+                    break
+    except OSError:
+        pass
+    return load, free_mb
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class EncodeSchedulerResource(SQLiteResource):
+    """
+    Admits RAWcooked encodes and TAR wraps across every code
+    location through a lease table in the shared DATABASE,
+    while this host's slots, CPU load and memory and the
+    per-NAS slots across all hosts allow. Leases are renewed
+    by hold() while their process works and expire if it dies
+    """
+
+    max_slots: int = int(os.environ.get("SCHEDULER_MAX_SLOTS", "9"))
+    nas_slots: int = int(os.environ.get("SCHEDULER_NAS_SLOTS", "3"))
+    max_load: float = float(os.environ.get("SCHEDULER_MAX_LOAD", "0.9"))
+    min_free_mb: int = int(os.environ.get("SCHEDULER_MIN_FREE_MB", "4096"))
+    lease_seconds: int = int(os.environ.get("SCHEDULER_LEASE_SECONDS", "900"))
+    heartbeat_seconds: float = float(
+        os.environ.get("SCHEDULER_HEARTBEAT_SECONDS", "60")
+    )
+    poll_seconds: float = float(os.environ.get("SCHEDULER_POLL_SECONDS", "30"))
+
+    @with_retries()
+    def acquire(
+        self,
+        context: dg.AssetExecutionContext,
+        kind: str,
+        fpath: str,
+        project: str,
+    ):
+        """
+        Take a lease for fpath if admitted now,
+        return slot_id or None if refused
+        """
+        nas = mount_point(fpath)
+        seq_id = os.path.basename(fpath)
+        load, free_mb = host_load()
+        host = os.uname().nodename
+        now = time.time()
+
+        with self.get_connection(context) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM encode_slots WHERE expires < ?", (now,))
+            leases = conn.execute(
+                "SELECT slot_id, nas, host, pid FROM encode_slots"
+            ).fetchall()
+
+            # Free leases of crashed processes on this host
+            dead = [
+                (row[0],) for row in leases if row[2] == host and not pid_alive(row[3])
+            ]
+            if dead:
+                conn.executemany("DELETE FROM encode_slots WHERE slot_id = ?", dead)
+                dead_ids = {row[0] for row in dead}
+                leases = [row for row in leases if row[0] not in dead_ids]
+
+            # Load / memory are this host's, so slots are per host
+            active = sum(1 for row in leases if row[2] == host)
+            nas_active = sum(1 for row in leases if row[1] == nas)
+            reason = None
+            if active >= self.max_slots:
+                reason = f"{active}/{self.max_slots} slots in use on {host}"
+            elif nas_active >= self.nas_slots:
+                reason = f"{nas_active}/{self.nas_slots} slots in use on {nas}"
+            elif active and load > self.max_load:
+                reason = f"load per CPU {load:.2f} over {self.max_load}"
+            elif active and free_mb < self.min_free_mb:
+                reason = f"{free_mb}MB memory available, under {self.min_free_mb}MB"
+            if reason:
+                context.log.info(f"Scheduler deferred {kind} {seq_id}: {reason}")
+                return None
+
+            cur = conn.execute(
+                """
+                INSERT INTO encode_slots
+                (kind, seq_id, project, nas, host, pid, acquired, expires)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    kind,
+                    seq_id,
+                    project,
+                    nas,
+                    host,
+                    os.getpid(),
+                    str(datetime.datetime.today())[:19],
+                    now + self.lease_seconds,
+                ),
+            )
+            context.log.info(
+                f"Scheduler admitted {kind} {seq_id} on {nas} "
+                f"({active + 1}/{self.max_slots} slots, load {load:.2f}, {free_mb}MB free)"
+            )
+            return cur.lastrowid
+
+    @with_retries()
+    def release(self, context: dg.AssetExecutionContext, slot_id: int) -> None:
+        """
+        Return lease to the shared pool
+        """
+        with self.get_connection(context) as conn:
+            conn.execute("DELETE FROM encode_slots WHERE slot_id = ?", (slot_id,))
+
+    @with_retries()
+    def heartbeat(self, context: dg.AssetExecutionContext) -> int:
+        """
+        Extend every lease held by this process,
+        return how many were renewed
+        """
+        with self.get_connection(context) as conn:
+            cur = conn.execute(
+                "UPDATE encode_slots SET expires = ? WHERE host = ? AND pid = ?",
+                (time.time() + self.lease_seconds, os.uname().nodename, os.getpid()),
+            )
+            return cur.rowcount
+
+    @contextmanager
+    def hold(self, context: dg.AssetExecutionContext):
+        """
+        Heartbeat this process's slot leases from a
+        background thread for as long as the block runs
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.heartbeat_seconds):
+                try:
+                    self.heartbeat(context)
+                except sqlite3.Error as err:
+                    context.log.warning(f"Slot lease heartbeat failed: {err}")
+
+        thread = threading.Thread(
+            target=beat, name="encode-slot-heartbeat", daemon=True
+        )
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def wait_for_slot(
+        self, context: dg.AssetExecutionContext, kind: str, fpath: str, project: str
+    ) -> int:
+        """
+        Block until a lease is admitted, for
+        single sequence assets
+        """
+        while True:
+            slot_id = self.acquire(context, kind, fpath, project)
+            if slot_id is not None:
+                return slot_id
+            time.sleep(self.poll_seconds)
+
+
+class WorkLeaseResource(SQLiteResource):
+    """
+    Per sequence work leases in the shared DATABASE so several
+    encoding hosts can drain one processing/ folder. A lease is
+    owned by a run, renewed by heartbeat while the run works on
+    it and left to expire if the host or run dies
+    """
+
+    lease_seconds: int = int(os.environ.get("WORK_LEASE_SECONDS", "900"))
+    heartbeat_seconds: float = float(os.environ.get("WORK_HEARTBEAT_SECONDS", "60"))
+
+    @with_retries()
+    def claim(
+        self,
+        context: dg.AssetExecutionContext,
+        seq_id: str,
+        project: str,
+        stage: str,
+    ) -> bool:
+        """
+        Take lease on seq_id for this run if free, expired
+        or already ours, return False if held elsewhere
+        """
+        now = time.time()
+        with self.get_connection(context) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT owner, host, stage, expires FROM work_leases WHERE seq_id = ?",
+                (seq_id,),
+            ).fetchone()
+            if row and row[0] != context.run_id and row[3] >= now:
+                context.log.info(
+                    f"Lease on {seq_id} held by {row[1]} ({row[2]}) for {row[3] - now:.0f}s"
+                )
+                return False
+            if row and row[0] != context.run_id:
+                context.log.warning(
+                    f"Reclaiming expired lease on {seq_id} from {row[1]} ({row[2]})"
+                )
+            conn.execute(
+                """
+                INSERT INTO work_leases
+                (seq_id, project, owner, host, pid, stage, claimed, heartbeat, expires)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(seq_id) DO UPDATE SET
+                    project = excluded.project,
+                    owner = excluded.owner,
+                    host = excluded.host,
+                    pid = excluded.pid,
+                    stage = excluded.stage,
+                    claimed = excluded.claimed,
+                    heartbeat = excluded.heartbeat,
+                    expires = excluded.expires
+                """,
+                (
+                    seq_id,
+                    project,
+                    context.run_id,
+                    os.uname().nodename,
+                    os.getpid(),
+                    stage,
+                    now,
+                    now,
+                    now + self.lease_seconds,
+                ),
+            )
+            return True
+
+    @with_retries()
+    def heartbeat(
+        self, context: dg.AssetExecutionContext, seq_ids: list[str], stage: str
+    ) -> int:
+        """
+        Extend this run's leases on seq_ids,
+        return how many are still held
+        """
+        now = time.time()
+        with self.get_connection(context) as conn:
+            cur = conn.executemany(
+                """
+                UPDATE work_leases SET stage = ?, pid = ?, heartbeat = ?, expires = ?
+                WHERE seq_id = ? AND owner = ?
+                """,
+                [
+                    (
+                        stage,
+                        os.getpid(),
+                        now,
+                        now + self.lease_seconds,
+                        seq_id,
+                        context.run_id,
+                    )
+                    for seq_id in seq_ids
+                ],
+            )
+            return cur.rowcount
+
+    @with_retries()
+    def release(self, context: dg.AssetExecutionContext, seq_ids: list[str]) -> None:
+        """
+        Drop this run's leases once sequences
+        have reached a recorded end state
+        """
+        with self.get_connection(context) as conn:
+            conn.executemany(
+                "DELETE FROM work_leases WHERE seq_id = ? AND owner = ?",
+                [(seq_id, context.run_id) for seq_id in seq_ids],
+            )
+
+    @with_retries()
+    def expired(self, context, project: str) -> dict[str, float]:
+        """
+        Return {seq_id: expires} of project leases
+        whose run stopped renewing them
+        """
+        with self.get_connection(context) as conn:
+            rows = conn.execute(
+                "SELECT seq_id, expires FROM work_leases WHERE project = ? AND expires < ?",
+                (project, time.time()),
+            ).fetchall()
+        return dict(rows)
+
+    @contextmanager
+    def hold(self, context: dg.AssetExecutionContext, seq_ids: list[str], stage: str):
+        """
+        Heartbeat leases on seq_ids from a background
+        thread for as long as the block runs
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.heartbeat_seconds):
+                try:
+                    self.heartbeat(context, seq_ids, stage)
+                except sqlite3.Error as err:
+                    context.log.warning(f"Lease heartbeat failed: {err}")
+
+        self.heartbeat(context, seq_ids, stage)
+        thread = threading.Thread(target=beat, name="work-lease-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
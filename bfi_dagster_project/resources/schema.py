@@ -0,0 +1,297 @@
+"""
+encoding_status schema and migrations, applied in order
+and tracked with PRAGMA user_version. Column order of
+encoding_status is fixed: the encoding UI and sensors
+read rows by position, so new columns are only added
+at the end.
+"""
+
+import sqlite3
+from typing import Callable, List
+
+# Typed table, seq_id unique so lookups are index seeks
+ENCODING_STATUS = """
+CREATE TABLE IF NOT EXISTS {table} (
+    process_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    seq_id TEXT NOT NULL{unique},
+    status TEXT DEFAULT 'Started',
+    folder_path TEXT,
+    first_image TEXT,
+    last_image TEXT,
+    gaps_in_sequence TEXT,
+    assessment_pass TEXT,
+    assessment_complete TIMESTAMP,
+    colourspace TEXT,
+    seq_size INTEGER,
+    bitdepth INTEGER,
+    image_width INTEGER,
+    image_height INTEGER,
+    process_start TIMESTAMP,
+    encoding_choice TEXT,
+    encoding_log TEXT,
+    encoding_retry INTEGER,
+    encoding_complete TIMESTAMP,
+    derivative_path TEXT,
+    derivative_size INTEGER,
+    derivative_md5 TEXT,
+    validation_complete TIMESTAMP,
+    validation_success TEXT,
+    error_message TEXT,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sequence_deleted TEXT,
+    moved_to_autoingest TEXT,
+    project TEXT,
+    Instruction TEXT
+)
+"""
+
+# Columns converted from TEXT with numeric values only
+INTEGER_COLUMNS = (
+    "seq_size",
+    "bitdepth",
+    "image_width",
+    "image_height",
+    "encoding_retry",
+    "derivative_size",
+)
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _copy_expression(column: str, existing: List[str]) -> str:
+    if column not in existing:
+        return "NULL"
+    if column in INTEGER_COLUMNS:
+        return (
+            f"CASE WHEN trim({column}) GLOB '[0-9]*' "
+            f"AND NOT trim({column}) GLOB '*[^0-9]*' "
+            f"THEN CAST(trim({column}) AS INTEGER) ELSE NULL END"
+        )
+    return column
+
+
+def typed_encoding_status(conn: sqlite3.Connection) -> None:
+    """
+    Rebuild encoding_status with INTEGER sizes / retry
+    counts and UNIQUE seq_id. Older duplicate rows for
+    a seq_id are kept in encoding_status_archive
+    """
+    conn.execute(ENCODING_STATUS.format(table="encoding_status_new", unique=" UNIQUE"))
+    existing = table_columns(conn, "encoding_status")
+    if existing:
+        conn.execute(ENCODING_STATUS.format(table="encoding_status_archive", unique=""))
+        columns = table_columns(conn, "encoding_status_new")
+        select = ", ".join(_copy_expression(col, existing) for col in columns)
+        latest = "SELECT MAX(process_id) FROM encoding_status GROUP BY seq_id"
+        conn.execute(
+            f"INSERT INTO encoding_status_new ({', '.join(columns)}) "
+            f"SELECT {select} FROM encoding_status WHERE process_id IN ({latest})"
+        )
+        conn.execute(
+            f"INSERT INTO encoding_status_archive ({', '.join(columns)}) "
+            f"SELECT {select} FROM encoding_status WHERE process_id NOT IN ({latest})"
+        )
+        conn.execute("DROP TABLE encoding_status")
+    conn.execute("ALTER TABLE encoding_status_new RENAME TO encoding_status")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_encoding_status_status_project "
+        "ON encoding_status (status, project)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_encoding_status_project "
+        "ON encoding_status (project)"
+    )
+
+
+def encode_slots(conn: sqlite3.Connection) -> None:
+    """
+    Lease table for the cross project encode / TAR
+    scheduler, one row per running heavy task
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS encode_slots (
+            slot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            seq_id TEXT,
+            project TEXT,
+            nas TEXT,
+            host TEXT,
+            pid INTEGER,
+            acquired TIMESTAMP,
+            expires REAL NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_encode_slots_nas ON encode_slots (nas)"
+    )
+
+
+def sequence_stability(conn: sqlite3.Connection) -> None:
+    """
+    Last seen (file count, bytes, max mtime) per
+    sequence in processing/ for copy completion
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sequence_stability (
+            seq_id TEXT PRIMARY KEY,
+            folder_path TEXT,
+            project TEXT,
+            file_count INTEGER,
+            total_bytes INTEGER,
+            max_mtime REAL,
+            first_seen REAL,
+            last_changed REAL,
+            last_checked REAL
+        )
+        """
+    )
+
+
+def work_leases(conn: sqlite3.Connection) -> None:
+    """
+    Claim on a sequence by one run on one host, kept
+    alive by heartbeat and reclaimable once expired
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS work_leases (
+            seq_id TEXT PRIMARY KEY,
+            project TEXT,
+            owner TEXT NOT NULL,
+            host TEXT,
+            pid INTEGER,
+            stage TEXT,
+            claimed REAL,
+            heartbeat REAL,
+            expires REAL NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_work_leases_project "
+        "ON work_leases (project, expires)"
+    )
+
+
+def encode_progress(conn: sqlite3.Connection) -> None:
+    """
+    Live RAWcooked progress per sequence, written
+    by the pool workers as the log streams in
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS encode_progress (
+            seq_id TEXT PRIMARY KEY,
+            host TEXT,
+            pid INTEGER,
+            output_version INTEGER,
+            state TEXT,
+            started REAL,
+            updated REAL,
+            frames INTEGER,
+            total_frames INTEGER,
+            bytes INTEGER,
+            fps REAL,
+            speed REAL,
+            message TEXT
+        )
+        """
+    )
+
+
+def output_version_history(conn: sqlite3.Connection) -> None:
+    """
+    Header feature key per sequence and the RAWcooked
+    output version its encode needed, appended so
+    positional readers of encoding_status still work
+    """
+    existing = table_columns(conn, "encoding_status")
+    for column, kind in (
+        ("header_signature", "TEXT"),
+        ("output_version", "INTEGER"),
+        ("version_predicted", "INTEGER"),
+    ):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE encoding_status ADD COLUMN {column} {kind}")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_encoding_status_header_signature "
+        "ON encoding_status (header_signature)"
+    )
+
+
+def verification_timings(conn: sqlite3.Connection) -> None:
+    """
+    Seconds per MKV verification step as JSON,
+    appended to the end of encoding_status
+    """
+    if "verification_timings" not in table_columns(conn, "encoding_status"):
+        conn.execute("ALTER TABLE encoding_status ADD COLUMN verification_timings TEXT")
+
+
+def checksum_cache(conn: sqlite3.Connection) -> None:
+    """
+    MD5 per file identity for assets/hashing.py,
+    least recently used rows are evicted first
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS checksum_cache (
+            dev INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            md5 TEXT NOT NULL,
+            path TEXT,
+            created REAL,
+            last_used REAL,
+            PRIMARY KEY (dev, inode, size, mtime_ns)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_checksum_cache_last_used "
+        "ON checksum_cache (last_used)"
+    )
+
+
+# Append new steps only, position + 1 is the user_version it produces
+MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    typed_encoding_status,
+    encode_slots,
+    sequence_stability,
+    work_leases,
+    encode_progress,
+    output_version_history,
+    verification_timings,
+    checksum_cache,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn: sqlite3.Connection) -> List[int]:
+    """
+    Apply outstanding migrations, each in its own write
+    transaction with user_version re-read after the lock
+    is held so concurrent code locations migrate once
+    """
+    applied = []
+    while conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                MIGRATIONS[version](conn)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+                applied.append(version + 1)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    return applied
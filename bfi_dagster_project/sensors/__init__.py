@@ -1,10 +1,22 @@
 import datetime
+import hashlib
+import json
+import os
+import time
 from typing import Callable, List, Optional
 
 import dagster as dg
 
-from ..assets.transcode_retry import (build_transcode_retry_asset,
-                                      reencode_failed_asset)
+from ..assets import utils
+from ..assets.get_sequences import (
+    ORDER_POLICIES,
+    SEQUENCE_BATCH_SIZE,
+    SEQUENCE_ORDER,
+    SEQUENCE_QUIET_SECONDS,
+)
+from ..assets.transcode_retry import build_transcode_retry_asset, reencode_failed_asset
+
+DISCOVERY_INTERVAL = int(os.environ.get("DISCOVERY_INTERVAL_SECONDS", "60"))
 
 
 def build_failed_encoding_retry_sensor(key_prefix: Optional[str] = None):
@@ -45,9 +57,39 @@ def build_failed_encoding_retry_sensor(key_prefix: Optional[str] = None):
         last_check = datetime.datetime.fromisoformat(last_check_time)
         context.log.info(f"{log_prefix}Last check time for retries: {last_check}")
 
-        search = "SELECT * FROM encoding_status WHERE status = 'RAWcook failed'"
+        # Sequences out of retries need manual attention
+        exhausted = context.resources.database.retrieve_seq_id_row(
+            context,
+            """
+            SELECT seq_id, encoding_retry FROM encoding_status
+            WHERE status = 'RAWcook failed' AND project = ? AND encoding_retry > 3
+            """,
+            "fetchall",
+            (str(key_prefix),),
+        )
+        for seq_id, retry_count in exhausted:
+            context.log.warning(
+                f"{log_prefix}Attempted encodings exceeded 3 attempts for {seq_id}. Manual attention needed."
+            )
+            arguments = (
+                ["status", "Sequence failed repeatedly"],
+                ["error_message", "Manual review needed, maximum retries met."],
+                ["encoding_retry", retry_count],
+            )
+            entry = context.resources.database.append_to_database(
+                context, seq_id, arguments
+            )
+            context.log.info(
+                f"{log_prefix}Skipping this sequence. Row updated: {entry}"
+            )
+
+        search = """
+            SELECT seq_id, folder_path, IFNULL(encoding_retry, 0) FROM encoding_status
+            WHERE status = 'RAWcook failed' AND project = ?
+            AND IFNULL(encoding_retry, 0) <= 3
+        """
         failed_encodings = context.resources.database.retrieve_seq_id_row(
-            context, search, "fetchall"
+            context, search, "fetchall", (str(key_prefix),)
         )
         context.log.info(f"{log_prefix}Found failed encodings: {failed_encodings}")
 
@@ -61,39 +103,8 @@ def build_failed_encoding_retry_sensor(key_prefix: Optional[str] = None):
         )
 
         # Group by batch size if needed
-        for seq in failed_encodings:
-            context.log.info(f"{log_prefix}Processing sequence {seq}")
-            seq_id = seq[1]
-            spath = seq[3]
-            key = seq[28]
-            print(f"{key_prefix} : {key}")
-            if key_prefix != key:
-                context.log.info(
-                    f"Key prefix {key_prefix} does not match sequence {key}"
-                )
-                continue
-            retry_count = seq[17]
-            if not retry_count.isnumeric():
-                retry_count = 0
-            else:
-                retry_count = int(retry_count)
-
-            if retry_count > 3:
-                context.log.warning(
-                    f"{log_prefix}Attempted encodings exceeded 3 attempts. Manual attention needed."
-                )
-                arguments = (
-                    ["status", "Sequence failed repeatedly"],
-                    ["error_message", "Manual review needed, maximum retries met."],
-                    ["encoding_retry", retry_count],
-                )
-                entry = context.resources.database.append_to_database(
-                    context, seq_id, arguments
-                )
-                context.log.info(
-                    f"{log_prefix}Skipping this sequence. Row updated: {entry}"
-                )
-                continue
+        for seq_id, spath, retry_count in failed_encodings:
+            context.log.info(f"{log_prefix}Processing sequence {seq_id}")
 
             # Update retry count in database
             arguments = ["status", "Pending retry"]
@@ -120,5 +131,209 @@ def build_failed_encoding_retry_sensor(key_prefix: Optional[str] = None):
     return failed_encoding_retry_sensor
 
 
+def build_sequence_discovery_sensor(
+    key_prefix: Optional[str],
+    job,
+    partitions_def: Optional[dg.DynamicPartitionsDefinition] = None,
+    order: Optional[str] = None,
+    batch_size: Optional[int] = None,
+):
+    """
+    Factory function for sensor that watches processing/ and requests
+    a run of job for each sequence once it has finished copying.
+    With partitions_def each sequence is added as a seq_id partition.
+    Settled sequences are ordered by the ORDER_POLICIES policy and at
+    most batch_size runs are requested per tick, the rest wait.
+    """
+    order = order or SEQUENCE_ORDER
+    if order not in ORDER_POLICIES:
+        raise ValueError(
+            f"Unknown sequence order {order}, choose from {list(ORDER_POLICIES)}"
+        )
+    batch_size = batch_size or SEQUENCE_BATCH_SIZE
+
+    sensor_name = f"{key_prefix}_sequence_discovery_sensor"
+    op_name = f"{key_prefix}__target_sequences"
+
+    @dg.sensor(
+        name=sensor_name,
+        job=job,
+        minimum_interval_seconds=DISCOVERY_INTERVAL,
+        required_resource_keys={"database", "source_path", "work_leases"},
+    )
+    def sequence_discovery_sensor(
+        context: dg.SensorEvaluationContext,
+    ):
+        """
+        Stats processing/ each tick, lists it only when its mtime moves and
+        walks a new sequence only when its quiet period could have elapsed.
+        Cursor holds folder mtime, listing digest / names and pending checks,
+        plus expired work leases and UI resets already handed back for a rerun
+        """
+        log_prefix = f"[{key_prefix}] "
+        seq_supply = os.path.join(
+            context.resources.source_path, "image_sequence_processing/processing"
+        )
+        cursor = (
+            json.loads(context.cursor)
+            if context.cursor
+            else {"mtime": None, "digest": None, "seen": [], "pending": {}}
+        )
+        try:
+            mtime = os.stat(seq_supply).st_mtime_ns
+        except OSError as err:
+            return dg.SkipReason(f"{log_prefix}Unable to access {seq_supply}: {err}")
+
+        now = time.time()
+        pending = cursor["pending"]
+        if mtime != cursor["mtime"]:
+            names = sorted(
+                entry.name
+                for entry in os.scandir(seq_supply)
+                if entry.is_dir() and "for_deletion" not in entry.name
+            )
+            digest = hashlib.md5("\n".join(names).encode()).hexdigest()
+            if digest != cursor["digest"]:
+                for seq in set(names) - set(cursor["seen"]):
+                    context.log.info(f"{log_prefix}New sequence in processing: {seq}")
+                    pending[seq] = now
+                pending = {seq: due for seq, due in pending.items() if seq in names}
+                cursor["seen"] = names
+                cursor["digest"] = digest
+            cursor["mtime"] = mtime
+
+        # Sensor can tick before any run has created the tracking tables
+        context.resources.database.initialise_db(context)
+
+        # Leases left by a crashed run / host are requeued once per expiry
+        reclaimed = cursor.get("reclaimed", {})
+        stale = context.resources.work_leases.expired(context, str(key_prefix))
+        stale = {
+            seq: expires
+            for seq, expires in stale.items()
+            if seq in cursor["seen"] and reclaimed.get(seq) != expires
+        }
+        cursor["reclaimed"] = {
+            seq: expires for seq, expires in reclaimed.items() if seq in cursor["seen"]
+        }
+        cursor["reclaimed"].update(stale)
+        for seq in stale:
+            context.log.warning(f"{log_prefix}Work lease on {seq} expired, requeuing")
+            pending[seq] = now
+
+        # Sequences reset from the UI are requeued once per reset, by
+        # process_start, unless a run holding a lease is working on them
+        triggered = context.resources.database.retrieve_seq_id_row(
+            context,
+            """
+            SELECT e.seq_id, e.process_start FROM encoding_status e
+            LEFT JOIN work_leases w ON w.seq_id = e.seq_id AND w.expires >= ?
+            WHERE e.status = 'Triggered assessment' AND e.project = ?
+            AND w.seq_id IS NULL
+            """,
+            "fetchall",
+            (now, str(key_prefix)),
+        )
+        requested = {
+            seq: start
+            for seq, start in cursor.get("requested", {}).items()
+            if seq in cursor["seen"]
+        }
+        for seq, start in triggered or []:
+            if (
+                seq in cursor["seen"]
+                and seq not in pending
+                and requested.get(seq) != start
+            ):
+                context.log.info(f"{log_prefix}{seq} reset to Triggered assessment")
+                pending[seq] = now
+        cursor["requested"] = requested
+
+        due = sorted(seq for seq, check in pending.items() if check <= now)
+        if not due:
+            cursor["pending"] = pending
+            return dg.SensorResult(
+                skip_reason=f"{log_prefix}No sequences ready", cursor=json.dumps(cursor)
+            )
+
+        settled = []
+        for seq in due:
+            row = context.resources.database.retrieve_seq_id_row(
+                context,
+                "SELECT status, process_start FROM encoding_status WHERE seq_id=?",
+                "fetchone",
+                (seq,),
+            )
+            if row and row[0] != "Triggered assessment" and seq not in stale:
+                context.log.info(f"{log_prefix}Skipping {seq}, status: {row[0]}")
+                pending.pop(seq)
+                continue
+
+            dpath = os.path.join(seq_supply, seq)
+            signature = utils.sequence_signature(dpath)
+            last_changed = context.resources.database.record_stability(
+                context, seq, dpath, str(key_prefix), signature
+            )
+            quiet = min(now - last_changed, now - signature[2])
+            if quiet < SEQUENCE_QUIET_SECONDS:
+                # Look again when the quiet period could first be met
+                pending[seq] = now + max(
+                    SEQUENCE_QUIET_SECONDS - quiet, DISCOVERY_INTERVAL
+                )
+                context.log.info(
+                    f"{log_prefix}{seq} still copying, unchanged for {quiet:.0f}s"
+                )
+                continue
+
+            item = {"seq_id": seq, "start": row[1] if row else None}
+            if order != "name":
+                # Cheap pre-scan supplies sizes / frame counts for ordering
+                item["frames"], item["bytes"] = utils.estimate_sequence(dpath)
+                try:
+                    item["age"] = os.stat(dpath).st_ctime
+                except OSError:
+                    item["age"] = now
+            settled.append(item)
+
+        # Request the batch the order policy puts first, the rest stay due
+        run_requests = []
+        new_partitions = []
+        for item in ORDER_POLICIES[order](settled)[:batch_size]:
+            seq = item["seq_id"]
+            pending.pop(seq)
+            requested[seq] = item["start"]
+            run_key = f"{key_prefix}_discovered_{seq}_{int(now)}"
+            tags = {"project": str(key_prefix), "seq_id": seq}
+            if partitions_def is None:
+                run_requests.append(
+                    dg.RunRequest(
+                        run_key=run_key,
+                        run_config={"ops": {op_name: {"config": {"sequences": [seq]}}}},
+                        tags=tags,
+                    )
+                )
+            else:
+                if not context.instance.has_dynamic_partition(partitions_def.name, seq):
+                    new_partitions.append(seq)
+                run_requests.append(
+                    dg.RunRequest(run_key=run_key, partition_key=seq, tags=tags)
+                )
+            context.log.info(f"{log_prefix}Requesting run for {seq}")
+
+        dynamic_partitions_requests = []
+        if new_partitions:
+            dynamic_partitions_requests.append(
+                partitions_def.build_add_request(new_partitions)
+            )
+        cursor["pending"] = pending
+        return dg.SensorResult(
+            run_requests=run_requests,
+            dynamic_partitions_requests=dynamic_partitions_requests,
+            cursor=json.dumps(cursor),
+        )
+
+    return sequence_discovery_sensor
+
+
 # Create the default sensor (no prefix) for backward compatibility
 failed_encoding_retry_sensor = build_failed_encoding_retry_sensor()
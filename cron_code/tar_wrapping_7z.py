@@ -34,11 +34,19 @@ import logging
 import os
 import shutil
 import sys
-import tempfile
 import time
 
 # import tarfile
 import py7zr
+from py7zr.io import Py7zIO, WriterFactory
+
+# Shared MD5 engine lives with the Dagster assets
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "../bfi_dagster_project/assets"
+    )
+)
+import hashing
 
 if not len(sys.argv) >= 2:
     sys.exit("Exiting. Supplied path argument is missing.")
@@ -58,6 +66,7 @@ LOCAL_LOG = os.environ["LOG_PATH"]
 parent_path = LOCAL_PATH.split("/automation")[0]
 LOG = os.path.join(LOCAL_LOG, "tar_wrapping_7zip_checksum.log")
 CID_API = os.environ["CID_API4"]
+EMPTY_MD5 = hashlib.md5(b"").hexdigest()
 
 # Logging config
 LOGGER = logging.getLogger(f"tar_wrapping_checksum_{LOCAL_PATH.replace('/', '_')}")
@@ -112,117 +121,112 @@ def get_checksum(fpath):
     if file in ["ASSETMAP", "VOLINDEX", "ASSETMAP.xml", "VOLINDEX.xml"]:
         folder_prefix = os.path.basename(pth)
         file = f"{folder_prefix}_{file}"
-    hash_md5 = hashlib.md5()
-    with open(fpath, "rb") as f:
-        for chunk in iter(lambda: f.read(65536), b""):
-            hash_md5.update(chunk)
-            data[fpath] = hash_md5.hexdigest()
-        f.close()
+    data[fpath] = hashing.hash_file(fpath)
     return data
 
 
-def full_integrity_check_with_extraction(archive_path):
+def get_manifest(fpath):
     """
-    Full integrity check by extracting entire archive
+    MD5 every file before wrapping, keyed on
+    the member name it is given in the archive
+    """
+    arcname = os.path.basename(fpath)
+    return {
+        (
+            f"{arcname}/{os.path.relpath(path, fpath)}"
+            if os.path.isdir(fpath)
+            else arcname
+        ): hexdigest
+        for path, hexdigest in hashing.hash_tree(fpath, use_cache=True).items()
+    }
+
+
+class HashingIO(Py7zIO):
+    """
+    py7zr output that MD5 hashes each decompressed
+    block as it arrives and keeps nothing
     """
-    errors = []
-    extracted_files = []
 
-    try:
-        if not os.path.exists(archive_path):
-            errors.append(f"Archive file not found: {archive_path}")
-            return False, errors, []
-
-        with tempfile.TemporaryDirectory() as tmpdir:
-            print(f"Extracting archive to temporary directory...")
-
-            # Extract everything
-            with py7zr.SevenZipFile(archive_path, mode="r") as archive:
-                # Get expected file list first
-                file_list = archive.list()
-                expected_files = [f for f in file_list if f.uncompressed > 0]
-                expected_dirs = len(file_list) - len(expected_files)
-
-                expected_files_dict = {
-                    entry.filename: entry for entry in expected_files
-                }
-
-                print(
-                    f"Expected: {len(expected_files)} files, {expected_dirs} directories"
-                )
+    def __init__(self, filename):
+        self.filename = filename
+        self.md5 = hashlib.md5()
+        self.length = 0
 
-                # Extract all
-                archive.extractall(path=tmpdir)
-
-            # Verify extracted files
-            print("Verifying extracted files...")
-            for root, _, files in os.walk(tmpdir):
-                for f in files:
-                    full_path = os.path.join(root, f)
-                    rel_path = os.path.relpath(full_path, tmpdir)
-                    normalized_path = rel_path.replace(os.sep, "/")
-
-                    # Check if file exists and is readable
-                    if os.path.exists(full_path):
-                        try:
-                            file_size = os.path.getsize(full_path)
-                            matching_entry = expected_files_dict.get(normalized_path)
-
-                            if matching_entry:
-                                if file_size == matching_entry.uncompressed:
-                                    extracted_files.append(
-                                        {
-                                            "path": rel_path,
-                                            "size": file_size,
-                                            "verified": True,
-                                        }
-                                    )
-                                else:
-                                    errors.append(
-                                        f"Size mismatch in {rel_path}: {file_size:,} vs {matching_entry.uncompressed:,}"
-                                    )
-                            else:
-                                # File extracted but not in archive listing (shouldn't happen)
-                                extracted_files.append(
-                                    {
-                                        "path": rel_path,
-                                        "size": file_size,
-                                        "verified": False,
-                                    }
-                                )
-
-                        except Exception as e:
-                            errors.append(
-                                f"Error reading extracted file {rel_path}: {e}"
-                            )
-                    else:
-                        errors.append(f"Expected file not found: {rel_path}")
-
-            # Summary
-            verified_count = sum(1 for f in extracted_files if f["verified"])
-            total_size = sum(f["size"] for f in extracted_files)
-
-            print(f"✓ Extraction completed: {len(extracted_files)} files extracted")
-            print(
-                f"✓ Verification: {verified_count}/{len(extracted_files)} files verified"
-            )
-            print(f"✓ Total size: {total_size:,} bytes")
+    def write(self, s):
+        self.md5.update(s)
+        self.length += len(s)
+        return len(s)
 
-            # Check if we got all expected files
-            if len(extracted_files) != len(expected_files):
-                errors.append(
-                    f"File count mismatch: extracted {len(extracted_files)}, expected {len(expected_files)}"
-                )
+    def read(self, size=None):
+        return b""
+
+    def seek(self, offset, whence=0):
+        return offset
+
+    def flush(self):
+        pass
+
+    def size(self):
+        return self.length
+
+
+class HashingFactory(WriterFactory):
+    """
+    Hand py7zr a HashingIO per archive member
+    """
 
-            success = len(errors) == 0 and verified_count == len(extracted_files)
-            return success, errors
+    def __init__(self):
+        self.products = {}
 
+    def create(self, filename):
+        product = HashingIO(filename)
+        self.products[filename] = product
+        return product
+
+
+def stream_integrity_check(archive_path, local_md5):
+    """
+    Decompress every member through HashingIO, py7zr
+    checks CRCs as it goes, and compare each MD5 with
+    the pre-wrap manifest. Nothing is written to disk.
+    Returns success, errors and verified member names
+    """
+    errors = []
+    verified = []
+
+    if not archive_path or not os.path.exists(archive_path):
+        errors.append(f"Archive file not found: {archive_path}")
+        return False, errors, verified
+
+    factory = HashingFactory()
+    try:
+        with py7zr.SevenZipFile(archive_path, mode="r") as archive:
+            archive.extractall(factory=factory)
+    except py7zr.exceptions.CrcError as err:
+        errors.append(f"CRC mismatch reading archive: {err}")
+        return False, errors, verified
     except py7zr.exceptions.Bad7zFile:
         errors.append("Invalid or corrupted 7z archive format")
-        return False, errors, []
-    except Exception as e:
-        errors.append(f"Archive extraction failed: {e}")
-        return False, errors, []
+        return False, errors, verified
+    except Exception as err:
+        errors.append(f"Archive read failed: {err}")
+        return False, errors, verified
+
+    for name, md5 in local_md5.items():
+        product = factory.products.get(name)
+        # Empty files are stored without a stream
+        archive_md5 = product.md5.hexdigest() if product else EMPTY_MD5
+        if archive_md5 != md5:
+            errors.append(f"MD5 mismatch in {name}: {archive_md5} vs {md5}")
+        else:
+            verified.append(name)
+
+    for name, product in factory.products.items():
+        if name not in local_md5 and product.length:
+            errors.append(f"Unexpected file in archive: {name}")
+
+    print(f"✓ Verification: {len(verified)}/{len(local_md5)} files match MD5")
+    return len(errors) == 0, errors, verified
 
 
 def make_manifest(tar_path, md5_dct):
@@ -320,26 +324,12 @@ def main():
             log.append("Supplied path for TAR wrap is a file.")
             LOGGER.info("Supplied path for TAR wrap is a file.")
 
+        # Pre-wrap manifest, compared with the archive contents after wrapping
+        local_md5 = get_manifest(tar_file)
+        log.append(f"Pre-wrap manifest built for {len(local_md5)} files")
+
         log.append("Beginning TAR wrap now...")
         tar_path = tar_item(tar_file)
-        ## do validationnnnn hereeeeee!!!!!
-        success, errors, extracted_files = full_integrity_check_with_extraction(
-            tar_path
-        )
-        if not success:
-            log.append(f"Integrity test failed for TAR file: {tar_path}")
-            LOGGER.warning("Integrity test failed for TAR file: %s", tar_path)
-            for err in errors:
-                log.append(f"Error: {err}")
-                LOGGER.error("Error during integrity test: %s", err)
-
-            # Move the faulty TAR to failures folder
-            shutil.move(tar_path, os.path.join(TAR_FAIL, f"{tar_source}.tar"))
-            for item in log:
-                local_logs(LOCAL_PATH, item)
-            LOGGER.warning("Tar wrapping has failed as the integrity test has failed.")
-            sys.exit(f"EXIT: Integrity test failed for {tar_file}")
-
         ### if tar_path is None, then we have a problem
         if not tar_path:
             log.append("TAR WRAP FAILED. SCRIPT EXITING!")
@@ -359,6 +349,24 @@ def main():
             LOGGER.warning("Tar wrapping has failed, Script Exiting!!!!")
             sys.exit(f"EXIT: TAR wrap failed for {tar_file}")
 
+        success, errors, verified = stream_integrity_check(tar_path, local_md5)
+        if not success:
+            log.append(f"Integrity test failed for TAR file: {tar_path}")
+            LOGGER.warning("Integrity test failed for TAR file: %s", tar_path)
+            for err in errors:
+                log.append(f"Error: {err}")
+                LOGGER.error("Error during integrity test: %s", err)
+
+            # Move the faulty TAR to failures folder
+            shutil.move(tar_path, os.path.join(TAR_FAIL, f"{tar_source}.tar"))
+            for item in log:
+                local_logs(LOCAL_PATH, item)
+            LOGGER.warning("Tar wrapping has failed as the integrity test has failed.")
+            sys.exit(f"EXIT: Integrity test failed for {tar_file}")
+
+        log.append(f"Archive contents match pre-wrap MD5 for {len(verified)} files")
+        LOGGER.info("Archive contents match pre-wrap MD5 for %s files", len(verified))
+
         if os.path.isfile(tar_path):
             whole_md5 = md5_hash(tar_path)
             if whole_md5:
@@ -399,11 +407,7 @@ def md5_hash(tar_file):
     Make whole file TAR MD5 checksum
     """
     try:
-        hash_md5 = hashlib.md5()
-        with open(tar_file, "rb") as fname:
-            for chunk in iter(lambda: fname.read(65536), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        return hashing.hash_file(tar_file)
 
     except Exception as err:
         print(err)
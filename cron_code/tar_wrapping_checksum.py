@@ -40,6 +40,15 @@ import tarfile
 sys.path.append(os.environ["CODE"])
 import adlib_v3 as adlib
 
+# Shared MD5 engine and TAR writer live with the Dagster assets
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "../bfi_dagster_project/assets"
+    )
+)
+import hashing
+import tar_stream
+
 if not len(sys.argv) >= 2:
     sys.exit("Exiting. Supplied path argument is missing.")
 if not os.path.exists(sys.argv[1]):
@@ -104,7 +113,8 @@ def get_cid_data(fname):
 def tar_item(fpath):
     """
     Make tar path from supplied filepath
-    Use tarfile to create TAR
+    Write TAR in one pass with TeeTarWriter, returned
+    closed so the manifest can be appended later
     """
     split_path = os.path.split(fpath)
     tfile = f"{split_path[1]}.tar"
@@ -114,14 +124,17 @@ def tar_item(fpath):
         return None
 
     try:
-        tarring = tarfile.open(tar_path, "w:")
-        tarring.add(fpath, arcname=f"{split_path[1]}")
-        tarring.close()
-        return tar_path
+        with tar_stream.TeeTarWriter(tar_path, cache=hashing.get_cache()) as tar:
+            tar.add(fpath, f"{split_path[1]}")
+        return tar
 
+    except FileExistsError:
+        LOGGER.warning("tar_item(): FILE ALREADY EXISTS %s", tar_path)
+        return None
     except Exception as exc:
         LOGGER.warning("tar_item(): ERROR WITH TAR WRAP %s", exc)
-        tarring.close()
+        if os.path.isfile(tar_path):
+            os.remove(tar_path)
         return None
 
 
@@ -165,23 +178,28 @@ def get_tar_checksums(tar_path, folder):
     return data
 
 
-def get_checksum(fpath):
+def checksum_name(fpath):
     """
-    Using file path, generate file checksum
-    return as list with filename
+    Manifest key for file, DCP index files
+    are prefixed with their folder name
     """
-    data = {}
     pth, file = os.path.split(fpath)
     if file in ["ASSETMAP", "VOLINDEX", "ASSETMAP.xml", "VOLINDEX.xml"]:
         folder_prefix = os.path.basename(pth)
         file = f"{folder_prefix}_{file}"
-    hash_md5 = hashlib.md5()
-    with open(fpath, "rb") as f:
-        for chunk in iter(lambda: f.read(65536), b""):
-            hash_md5.update(chunk)
-        data[file] = hash_md5.hexdigest()
-        f.close()
-    return data
+    return file
+
+
+def get_checksum(fpath):
+    """
+    Using file path, generate file checksum, or
+    checksums of every file when fpath is a folder
+    (hashed concurrently), return {filename: hex}
+    """
+    return {
+        checksum_name(path): hexdigest
+        for path, hexdigest in hashing.hash_tree(fpath, use_cache=True).items()
+    }
 
 
 def make_manifest(tar_path, md5_dct):
@@ -281,14 +299,8 @@ def main():
         LOGGER.info("Supplied path for TAR wrap is directory")
         directory = True
 
-    if directory:
-        for root, _, files in os.walk(fullpath):
-            for file in files:
-                dct = get_checksum(os.path.join(root, file))
-                local_md5.update(dct)
-
-    else:
-        local_md5 = get_checksum(fullpath)
+    local_md5 = get_checksum(fullpath)
+    if not directory:
         log.append("Path is not a directory and will be wrapped alone")
 
     LOGGER.info("Checksums for local files (excluding DPX, TIF):")
@@ -319,8 +331,8 @@ def main():
 
     # Tar folder
     log.append("Beginning TAR wrap now...")
-    tar_path = tar_item(fullpath)
-    tar_file = os.path.split(tar_path)[1]
+    tar = tar_item(fullpath)
+    tar_path = tar.tar_path if tar else None
     if not tar_path:
         log.append("TAR WRAP FAILED. SCRIPT EXITING!")
         LOGGER.warning("TAR wrap failed for file: %s", fullpath)
@@ -334,6 +346,7 @@ def main():
             os.path.join(TAR_FAIL, f"{tar_source}_errors.log"), error_mssg1, error_mssg2
         )
         sys.exit(f"EXIT: TAR wrap failed for {fullpath}")
+    tar_file = os.path.split(tar_path)[1]
 
     # Calculate checksum manifest for TAR folder
     if directory:
@@ -390,10 +403,15 @@ def main():
 
         LOGGER.info("TAR checksum manifest created. Adding to TAR file %s", tar_path)
         try:
+            # Written at the saved end of archive offset, no member scan
             arc_path = os.path.split(md5_manifest)
-            tar = tarfile.open(tar_path, "a:")
-            tar.add(md5_manifest, arcname=f"{arc_path[1]}")
-            tar.close()
+            with open(md5_manifest, "rb") as manifest:
+                tar.append_bytes(f"{arc_path[1]}", manifest.read())
+            # Member offsets for partial restores, inside the TAR and beside the manifest
+            tar.append_bytes(f"{tar_file}{tar_stream.INDEX_SUFFIX}", tar.index_bytes())
+            member_index = tar_stream.write_index(
+                f"{tar_path}{tar_stream.INDEX_SUFFIX}", tar.index
+            )
         except Exception as exc:
             LOGGER.warning(
                 "Unable to add MD5 manifest to TAR file. Moving TAR file to failures folder.\n%s",
@@ -415,7 +433,8 @@ def main():
         LOGGER.info(
             "TAR MD5 manifest added to TAR file. Getting wholefile TAR checksum for logs"
         )
-        whole_md5 = md5_hash(tar_path)
+        # Kept up to date by append_bytes, no re-read of the TAR
+        whole_md5 = tar.md5
         if whole_md5:
             log.append(f"Whole TAR MD5 checksum for TAR file: {whole_md5}")
             LOGGER.info("Whole TAR MD5 checksum for TAR file: %s", whole_md5)
@@ -441,6 +460,7 @@ def main():
         try:
             LOGGER.info("Moving MD5 manifest to checksum_manifest folder %s", CHECKSUM)
             shutil.move(md5_manifest, CHECKSUM)
+            shutil.move(member_index, CHECKSUM)
         except Exception as err:
             LOGGER.warning("MD5 manifest move failed:\n%s", err)
 
@@ -493,22 +513,6 @@ def main():
     LOGGER.info("==== TAR Wrapping Check script END =================================")
 
 
-def md5_hash(tar_file):
-    """
-    Make whole file TAR MD5 checksum
-    """
-    try:
-        hash_md5 = hashlib.md5()
-        with open(tar_file, "rb") as fname:
-            for chunk in iter(lambda: fname.read(65536), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-
-    except Exception as err:
-        print(err)
-        return None
-
-
 def local_logs(fullpath, data):
     """
     Output local log data for team
@@ -28,14 +28,13 @@ Steps:
 """
 
 import datetime
-import hashlib
 import json
 import logging
 import os
 import shutil
 import subprocess
 import sys
-import tempfile
+import tarfile
 import time
 
 from deepdiff import DeepDiff
@@ -43,6 +42,15 @@ from deepdiff import DeepDiff
 sys.path.append(os.environ["CODE"])
 import adlib_v3 as adlib
 
+# Shared MD5 engine and TAR streaming live with the Dagster assets
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "../bfi_dagster_project/assets"
+    )
+)
+import hashing
+import tar_stream
+
 if not len(sys.argv) >= 2:
     sys.exit("Exiting. Supplied path argument is missing.")
 if not os.path.exists(sys.argv[1]):
@@ -121,70 +129,38 @@ def tar_item(fpath, retries=3, delay=2):
 
 def get_tar_checksums(tar_path, folder):
     """
-    Extract tar file into a temp dir and compute MD5 for each file.
-    Returns {filename: checksum}.
+    Stream the TAR member by member and MD5 each
+    file straight from the archive, nothing is
+    extracted. Returns {filename: checksum}.
     """
-    data = {}
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        cmd = ["/bin/tar", "-C", tmpdir, "-xvf", tar_path]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-
-        extracted_files = result.stdout.strip().split("\n")
-        print(extracted_files)
-
-        print("tar stdout:\n", result.stdout)
-        print("tar stderr:\n", result.stderr)
-        print("exit code:", result.returncode)
-
-        if result.returncode != 0:
-            raise RuntimeError(
-                f"[ERROR] tar extraction failed for {tar_path} (exit {result.returncode})"
-            )
-
-        for file in extracted_files:
-            item = os.path.join(tmpdir, file)
-            if os.path.isdir(item):
-                print(f"{item} is a dir")
-                continue
-
-            pth, fname = os.path.split(item)
-            if fname in ["ASSETMAP", "VOLINDEX", "ASSETMAP.xml", "VOLINDEX.xml"]:
-                folder_prefix = os.path.basename(pth)
-                fname = f"{folder_prefix}_{fname}"
-
-            hash_md5 = hashlib.md5()
-            with open(item, "rb") as f:
-                for chunk in iter(lambda: f.read(65536), b""):
-                    hash_md5.update(chunk)
-
-            if not folder:
-                data[os.path.basename(fname)] = hash_md5.hexdigest()
-            else:
-                data[fname] = hash_md5.hexdigest()
-
-    return data
+    try:
+        return tar_stream.read_member_checksums(tar_path, key=checksum_name)
+    except (tarfile.TarError, OSError) as err:
+        raise RuntimeError(f"[ERROR] TAR read failed for {tar_path}: {err}") from err
 
 
-def get_checksum(fpath):
+def checksum_name(fpath):
     """
-    Compute MD5 checksum of a single file.
-    Returns {filename: checksum}.
+    Manifest key for file, DCP index files
+    are prefixed with their folder name
     """
-    data = {}
     pth, file = os.path.split(fpath)
-
     if file in ["ASSETMAP", "VOLINDEX", "ASSETMAP.xml", "VOLINDEX.xml"]:
         folder_prefix = os.path.basename(pth)
         file = f"{folder_prefix}_{file}"
+    return file
 
-    hash_md5 = hashlib.md5()
-    with open(fpath, "rb") as f:
-        for chunk in iter(lambda: f.read(65536), b""):
-            hash_md5.update(chunk)
 
-    data[file] = hash_md5.hexdigest()
-    return data
+def get_checksum(fpath):
+    """
+    Using file path, generate file checksum, or
+    checksums of every file when fpath is a folder
+    (hashed concurrently), return {filename: hex}
+    """
+    return {
+        checksum_name(path): hexdigest
+        for path, hexdigest in hashing.hash_tree(fpath, use_cache=True).items()
+    }
 
 
 def make_manifest(tar_path, md5_dct):
@@ -280,15 +256,8 @@ def main():
             LOGGER.info("Supplied path for TAR wrap is directory")
             directory = True
 
-        if directory:
-            for root, _, files in os.walk(tar_file):
-                for file in files:
-                    print(file)
-                    dct = get_checksum(os.path.join(root, file))
-                    local_md5.update(dct)
-
-        else:
-            local_md5 = get_checksum(fullpath)
+        local_md5 = get_checksum(tar_file)
+        if not directory:
             log.append("Path is not a directory and will be wrapped alone")
         print(f"local_md5: {local_md5}")
 
@@ -485,11 +454,7 @@ def md5_hash(tar_file):
     Make whole file TAR MD5 checksum
     """
     try:
-        hash_md5 = hashlib.md5()
-        with open(tar_file, "rb") as fname:
-            for chunk in iter(lambda: fname.read(65536), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        return hashing.hash_file(tar_file)
 
     except Exception as err:
         print(err)
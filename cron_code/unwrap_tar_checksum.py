@@ -18,13 +18,15 @@ Script functions:
    to log alongside untarred file.
 10.Move TAR files to completed/ failed/ folders depending
    on successful/unsuccessful results
+11.A TAR with a '<name>.tar.members' list beside it has only
+   those members restored, read by offset using the TAR
+   member index and checked against its MD5s
 
 Joanna White
 2023
 """
 
 import datetime
-import hashlib
 import json
 import logging
 # Global import
@@ -35,6 +37,15 @@ import sys
 import tarfile
 import time
 
+# Shared MD5 engine and TAR index live with the Dagster assets
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "../bfi_dagster_project/assets"
+    )
+)
+import hashing
+import tar_stream
+
 if not len(sys.argv) >= 2:
     sys.exit("Missing argument for python launch")
 
@@ -46,6 +57,7 @@ COMPLETED = os.path.join(UNTAR_PATH, "completed/")
 FAILED = os.path.join(UNTAR_PATH, "failed/")
 LOCAL_LOG = os.path.join(UNTAR_PATH, "unwrapped_tar_checksum.log")
 TODAY = str(datetime.datetime.now())[:10]
+MEMBERS_SUFFIX = ".members"
 
 # Setup logging
 LOGGER = logging.getLogger("unwrap_tar_checksum_qnap_11_digiops")
@@ -120,6 +132,8 @@ def main():
             continue
         if fname.endswith(".md5"):
             continue
+        if fname.endswith(MEMBERS_SUFFIX):
+            continue
         if not fname.endswith((".tar", ".TAR")):
             log_list.append(
                 f"{str(datetime.datetime.now())[:10]}\tSKIPPING - File is not a TAR file: {fname}."
@@ -141,6 +155,10 @@ def main():
         fpath = os.path.join(UNTAR_PATH, fname)
         log_list.append(f"{str(datetime.datetime.now())[:10]}\tNew file found: {fpath}")
         LOGGER.info("File found to process: %s", fname)
+        if os.path.isfile(f"{fpath}{MEMBERS_SUFFIX}"):
+            partial_unwrap(fpath, f"{fpath}{MEMBERS_SUFFIX}", log_list)
+            build_log(log_list)
+            continue
         log_list.append(
             f"{str(datetime.datetime.now())[:10]}\tAttempting extraction using Linux TAR programme..."
         )
@@ -298,6 +316,65 @@ def main():
     LOGGER.info("========= UNWRAP TAR CHECKSUM SCRIPT END =======================")
 
 
+def partial_unwrap(fpath, members_path, log_list):
+    """
+    Restore only the members named in members_path, one
+    per line, by pread from their index offsets. Moves
+    TAR and list to completed/ or failed/ by MD5 result
+    """
+    fname = os.path.basename(fpath)
+    fname_log = fname.split(".")[0]
+    untar_fpath = os.path.join(UNTAR_PATH, fname.split(".tar")[0])
+    with open(members_path, "r") as file:
+        names = [line.strip() for line in file if line.strip()]
+    log_list.append(
+        f"{str(datetime.datetime.now())[:10]}\tRestoring {len(names)} members by offset from TAR index"
+    )
+    LOGGER.info("Partial restore of %s members from %s", len(names), fname)
+
+    tic = time.perf_counter()
+    try:
+        results = tar_stream.restore_members(fpath, names, untar_fpath)
+    except (OSError, KeyError, ValueError, tarfile.TarError) as err:
+        LOGGER.warning("TAR member index could not be read for %s: %s", fname, err)
+        results = {}
+        error_mssg1 = f"TAR member index not available for partial restore, remove {members_path} for a full unwrap: {err}"
+        error_log(os.path.join(FAILED, f"{fname_log}_errors.log"), error_mssg1, None)
+    toc = time.perf_counter()
+    log_list.append(
+        f"{str(datetime.datetime.now())[:10]}\tPartial restore took {toc - tic:.1f} seconds"
+    )
+
+    failed = [name for name in names if not results.get(name)]
+    for name in names:
+        if results.get(name):
+            log_list.append(
+                f"{str(datetime.datetime.now())[:10]}\tRestored, MD5 matches TAR index: {name}"
+            )
+        else:
+            log_list.append(
+                f"{str(datetime.datetime.now())[:10]}\tNot restored or MD5 does not match TAR index: {name}"
+            )
+
+    if failed or not results:
+        LOGGER.warning("Partial restore failed for %s: %s", fname, failed)
+        if results:
+            error_mssg1 = f"Members missing from TAR index or MD5 mismatch after partial restore: {failed}"
+            error_log(
+                os.path.join(FAILED, f"{fname_log}_errors.log"), error_mssg1, None
+            )
+        shutil.move(fpath, FAILED)
+        shutil.move(members_path, FAILED)
+        return
+
+    LOGGER.info("Partial restore complete, %s members to %s", len(names), untar_fpath)
+    shutil.move(fpath, COMPLETED)
+    shutil.move(members_path, COMPLETED)
+    log_list.append(
+        f"{str(datetime.datetime.now())[:10]}\tMoved TAR to completed/ folder for manual deletion."
+    )
+
+
 def fetch_checksum_dict(md5_manifest):
     """
     Collect contents of Manifest using JSON load
@@ -316,16 +393,14 @@ def get_checksum(fpath):
     """
 
     md5s = {}
-    for root, _, files in os.walk(fpath):
-        for file in files:
-            hsh = hashlib.md5()
-            with open(os.path.join(root, file), "rb") as md5_file:
-                for chunk in iter(lambda: md5_file.read(65536), b""):
-                    hsh.update(chunk)
-                if file in ["ASSETMAP", "VOLINDEX", "ASSETMAP.xml", "VOLINDEX.xml"]:
-                    folder_prefix = os.path.basename(root)
-                    file = f"{folder_prefix}_{file}"
-                md5s[file] = hsh.hexdigest()
+    if not os.path.isdir(fpath):
+        return md5s
+    for path, hexdigest in hashing.hash_tree(fpath, use_cache=False).items():
+        root, file = os.path.split(path)
+        if file in ["ASSETMAP", "VOLINDEX", "ASSETMAP.xml", "VOLINDEX.xml"]:
+            folder_prefix = os.path.basename(root)
+            file = f"{folder_prefix}_{file}"
+        md5s[file] = hexdigest
     return md5s
 
 
@@ -9,9 +9,17 @@ new requests, using POST. Viewed by teams, 100 day since last update.
 import datetime
 import os
 import sqlite3
+import sys
 
 from flask import Flask, render_template, request
 
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "../bfi_dagster_project/resources"
+    )
+)
+import schema
+
 app = Flask(__name__)
 
 
@@ -23,42 +31,8 @@ def index():
 
 DBASE = os.environ.get("DATABASE")
 CONNECT = sqlite3.connect(DBASE)
-CONNECT.execute(
-    """
-                CREATE TABLE IF NOT EXISTS encoding_status (
-                    process_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    seq_id TEXT NOT NULL,
-                    status TEXT DEFAULT 'Started',
-                    folder_path TEXT NOT NULL,
-                    first_image TEXT,
-                    last_image TEXT,
-                    gaps_in_sequence TEXT,
-                    assessment_pass TEXT,
-                    assessment_complete TIMESTAMP,
-                    colourspace TEXT,
-                    seq_size INTEGER,
-                    bitdepth INTEGER,
-                    image_width TEXT,
-                    image_height TEXT,
-                    process_start TIMESTAMP,
-                    encoding_choice TEXT,
-                    encoding_log TEXT,
-                    encoding_retry TEXT,
-                    encoding_complete TIMESTAMP,
-                    derivative_path TEXT,
-                    derivative_size INTEGER,
-                    derivative_md5 TEXT,
-                    validation_complete TIMESTAMP,
-                    validation_success TEXT,
-                    error_message TEXT,
-                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    sequence_deleted TEXT,
-                    moved_to_autoingest TEXT,
-                    project TEXT
-                    Instruction TEXT
-                )
-            """
-)
+# Same typed encoding_status as the Dagster pipeline, never the old TEXT table
+schema.migrate(CONNECT)
 
 
 @app.route("/reset_request", methods=["GET", "POST"])
@@ -0,0 +1,12 @@
+"""
+Import the standard library modules under test the same
+way the cron_code scripts do, so the tests run without
+Dagster, FFmpeg or the MediaArea tools installed.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "bfi_dagster_project/assets"))
+sys.path.append(os.path.join(ROOT, "bfi_dagster_project/resources"))
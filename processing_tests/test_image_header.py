@@ -0,0 +1,129 @@
+import struct
+
+import image_header
+
+
+def write_dpx(path, order=">", width=4096, height=3112, descriptor=50, bitdepth=10):
+    """
+    Minimal SMPTE 268M header, film frame rate set
+    and line padding left undefined
+    """
+    magic = b"SDPX" if order == ">" else b"XPDS"
+    data = bytearray(2048)
+    data[0:4] = magic
+    struct.pack_into(f"{order}I", data, image_header.DPX_DATA_OFFSET, 8192)
+    data[image_header.DPX_VERSION : image_header.DPX_VERSION + 4] = b"V2.0"
+    struct.pack_into(f"{order}I", data, image_header.DPX_FILE_SIZE, 52436992)
+    struct.pack_into(f"{order}H", data, image_header.DPX_ELEMENTS, 1)
+    struct.pack_into(f"{order}I", data, image_header.DPX_WIDTH, width)
+    struct.pack_into(f"{order}I", data, image_header.DPX_HEIGHT, height)
+    data[image_header.DPX_DESCRIPTOR] = descriptor
+    data[image_header.DPX_BIT_SIZE] = bitdepth
+    struct.pack_into(f"{order}H", data, image_header.DPX_PACKING, 1)
+    struct.pack_into(
+        f"{order}I", data, image_header.DPX_LINE_PADDING, image_header.DPX_UNDEFINED
+    )
+    struct.pack_into(f"{order}f", data, image_header.DPX_FILM_FPS, 24.0)
+    path.write_bytes(bytes(data))
+    return str(path)
+
+
+def write_tiff(path, order="<", bitdepth=16):
+    """
+    Single strip RGB TIFF, BitsPerSample stored past
+    the IFD and PlanarConfiguration left empty
+    """
+    magic = b"II*\x00" if order == "<" else b"MM\x00*"
+
+    def short(tag, value):
+        return struct.pack(f"{order}HHIH2x", tag, 3, 1, value)
+
+    def long(tag, value):
+        return struct.pack(f"{order}HHII", tag, 4, 1, value)
+
+    entries = 8
+    bits_offset = 8 + 2 + entries * 12 + 4
+    ifd = [
+        long(image_header.TIFF_WIDTH, 1920),
+        long(image_header.TIFF_HEIGHT, 1080),
+        struct.pack(f"{order}HHII", image_header.TIFF_BITS, 3, 3, bits_offset),
+        short(image_header.TIFF_COMPRESSION, 1),
+        short(image_header.TIFF_PHOTOMETRIC, 2),
+        long(image_header.TIFF_STRIP_OFFSETS, 4096),
+        short(image_header.TIFF_SAMPLES, 3),
+        # Empty tag, read as if absent so planar falls back to 1
+        struct.pack(f"{order}HHII", image_header.TIFF_PLANAR, 3, 0, 0),
+    ]
+    data = magic + struct.pack(f"{order}I", 8)
+    data += struct.pack(f"{order}H", entries) + b"".join(ifd) + b"\x00" * 4
+    data += struct.pack(f"{order}3H", bitdepth, bitdepth, bitdepth)
+    path.write_bytes(data.ljust(4096, b"\x00"))
+    return str(path)
+
+
+def test_dpx_big_endian(tmp_path):
+    header = image_header.read_header(write_dpx(tmp_path / "0001.dpx"))
+    assert header["format"] == "DPX"
+    assert header["endian"] == "be"
+    assert header["version"] == "V2.0"
+    assert (header["width"], header["height"]) == (4096, 3112)
+    assert header["bitdepth"] == 10
+    assert header["colourspace"] == "RGB"
+    assert header["data_offset"] == 8192
+    assert header["file_size"] == 52436992
+    assert header["line_padding"] is None
+    assert header["fps"] == 24.0
+    assert header["pix_fmt"] == "gbrp10le"
+
+
+def test_dpx_little_endian(tmp_path):
+    header = image_header.read_header(
+        write_dpx(tmp_path / "0001.dpx", order="<", bitdepth=16)
+    )
+    assert header["endian"] == "le"
+    assert (header["width"], header["height"]) == (4096, 3112)
+    assert header["bitdepth"] == 16
+    assert header["pix_fmt"] == "rgb48le"
+
+
+def test_dpx_endian_changes_signature(tmp_path):
+    big = image_header.read_header(write_dpx(tmp_path / "big.dpx"))
+    little = image_header.read_header(write_dpx(tmp_path / "little.dpx", order="<"))
+    assert image_header.signature(big) != image_header.signature(little)
+
+
+def test_tiff_little_endian(tmp_path):
+    header = image_header.read_header(write_tiff(tmp_path / "0001.tif"))
+    assert header["format"] == "TIFF"
+    assert header["endian"] == "le"
+    assert (header["width"], header["height"]) == (1920, 1080)
+    assert header["bitdepth"] == 16
+    assert header["elements"] == 3
+    assert header["colourspace"] == "RGB"
+    assert header["compression"] == 1
+    assert header["packing"] == 1
+    assert header["data_offset"] == 4096
+    assert header["pix_fmt"] == "rgb48le"
+
+
+def test_tiff_big_endian(tmp_path):
+    header = image_header.read_header(
+        write_tiff(tmp_path / "0001.tif", order=">", bitdepth=8)
+    )
+    assert header["endian"] == "be"
+    assert header["bitdepth"] == 8
+    assert header["pix_fmt"] == "rgb24"
+
+
+def test_tiff_tags_past_header_read(tmp_path):
+    # IFD lies beyond a 16 byte read, so it is fetched with pread
+    fpath = write_tiff(tmp_path / "0001.tif")
+    header = image_header.read_header(fpath, size=16)
+    assert header == image_header.read_header(fpath)
+
+
+def test_unrecognised_and_missing(tmp_path):
+    other = tmp_path / "0001.jp2"
+    other.write_bytes(b"\x00\x00\x00\x0cjP  " + b"\x00" * 4096)
+    assert image_header.read_header(str(other)) is None
+    assert image_header.read_header(str(tmp_path / "missing.dpx")) is None
@@ -0,0 +1,71 @@
+import os
+import time
+
+import rawcooked_log
+
+
+def test_status_lines_split_across_reads():
+    parser = rawcooked_log.LogParser()
+    parser.feed(b"frame=  10 fps= 5.0 q=-0.0 size=    1024KiB speed=0.25x\rfra")
+    assert parser.frames == 10
+    parser.feed(b"me=  20 fps= 6.5 q=-0.0 size=       2MiB speed=0.51x\r")
+    assert parser.frames == 20
+    assert parser.fps == 6.5
+    assert parser.bytes == 2 * 1024**2
+    assert parser.speed == 0.51
+    assert parser.abort is None
+
+
+def test_version_two_abort():
+    parser = rawcooked_log.LogParser()
+    parser.feed(b"Analyzing files (1%)\n")
+    assert parser.abort is None
+    parser.feed(b"Error: the reversibility file is becoming big.\n")
+    assert parser.abort == "Error: the reversibility file is becoming big"
+    assert parser.version_two is True
+
+
+def test_fatal_abort():
+    parser = rawcooked_log.LogParser()
+    parser.feed(b"frame=   1 fps=0.0 q=-0.0 size=       0KiB speed=0x\r")
+    parser.feed(b"Conversion failed!\n")
+    assert parser.abort == "Conversion failed!"
+    assert parser.version_two is False
+
+
+def test_first_abort_is_kept():
+    parser = rawcooked_log.LogParser()
+    parser.feed(b"Error: undecodable file is becoming too big.\nConversion failed!\n")
+    assert parser.abort == "Error: undecodable file is becoming too big"
+    assert parser.version_two is True
+
+
+def test_close_parses_unterminated_line():
+    parser = rawcooked_log.LogParser()
+    parser.feed(b"Please contact info@mediaarea.net")
+    assert parser.abort is None
+    parser.close()
+    assert parser.abort == "Please contact info@mediaarea.net"
+
+
+def test_run_kills_process_group_on_abort(tmp_path):
+    log_path = tmp_path / "encode.mkv.txt"
+    pid_path = tmp_path / "child.pid"
+    # Child stands in for the FFmpeg RAWcooked starts
+    script = f"sleep 30 & echo $! > {pid_path}; echo 'Conversion failed!'; wait"
+    tic = time.monotonic()
+    returncode, parser = rawcooked_log.run(["sh", "-c", script], str(log_path))
+    assert time.monotonic() - tic < 10
+    assert returncode != 0
+    assert parser.abort == "Conversion failed!"
+    assert b"Conversion failed!" in log_path.read_bytes()
+
+    child = int(pid_path.read_text())
+    for _ in range(50):
+        try:
+            os.kill(child, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.1)
+    else:
+        raise AssertionError(f"child {child} still running")
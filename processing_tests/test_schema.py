@@ -0,0 +1,126 @@
+import sqlite3
+
+import pytest
+
+import schema
+
+# encoding_status as created before the migrations, TEXT
+# sizes / retries and no UNIQUE seq_id. The encoding UI
+# version lacked the comma before Instruction
+BASELINE = """
+CREATE TABLE IF NOT EXISTS encoding_status (
+    process_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    seq_id TEXT NOT NULL,
+    status TEXT DEFAULT 'Started',
+    folder_path TEXT,
+    first_image TEXT,
+    last_image TEXT,
+    gaps_in_sequence TEXT,
+    assessment_pass TEXT,
+    assessment_complete TIMESTAMP,
+    colourspace TEXT,
+    seq_size INTEGER,
+    bitdepth INTEGER,
+    image_width TEXT,
+    image_height TEXT,
+    process_start TIMESTAMP,
+    encoding_choice TEXT,
+    encoding_log TEXT,
+    encoding_retry TEXT,
+    encoding_complete TIMESTAMP,
+    derivative_path TEXT,
+    derivative_size INTEGER,
+    derivative_md5 TEXT,
+    validation_complete TIMESTAMP,
+    validation_success TEXT,
+    error_message TEXT,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sequence_deleted TEXT,
+    moved_to_autoingest TEXT,
+    project TEXT{comma}
+    Instruction TEXT
+)
+"""
+
+ROWS = (
+    ("N_1_01of01", "Assessment failed", " 2048 ", "", None, "ff00"),
+    ("N_1_01of01", "Pending retry", "4096", "3112", "2", "ff01"),
+    ("N_2_01of01", "RAWcook completed", "1920", "n/a", "0", None),
+)
+
+
+def baseline(comma=","):
+    conn = sqlite3.connect(":memory:")
+    conn.execute(BASELINE.format(comma=comma))
+    conn.executemany(
+        """
+        INSERT INTO encoding_status
+        (seq_id, status, image_width, image_height, encoding_retry, derivative_md5)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        ROWS,
+    )
+    conn.commit()
+    return conn
+
+
+def test_migrate_from_baseline():
+    conn = baseline()
+    assert schema.migrate(conn) == list(range(1, schema.SCHEMA_VERSION + 1))
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == schema.SCHEMA_VERSION
+
+    # Latest row per seq_id kept, numeric TEXT converted, the rest NULL
+    rows = conn.execute(
+        """
+        SELECT seq_id, status, image_width, image_height, encoding_retry
+        FROM encoding_status ORDER BY seq_id
+        """
+    ).fetchall()
+    assert rows == [
+        ("N_1_01of01", "Pending retry", 4096, 3112, 2),
+        ("N_2_01of01", "RAWcook completed", 1920, None, 0),
+    ]
+    archived = conn.execute(
+        "SELECT seq_id, status, image_width, image_height FROM encoding_status_archive"
+    ).fetchall()
+    assert archived == [("N_1_01of01", "Assessment failed", 2048, None)]
+
+    # Positional readers depend on the original columns staying first
+    columns = schema.table_columns(conn, "encoding_status")
+    assert columns[:30] == schema.table_columns(baseline(), "encoding_status")
+    assert columns[30:] == [
+        "header_signature",
+        "output_version",
+        "version_predicted",
+        "verification_timings",
+    ]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO encoding_status (seq_id) VALUES ('N_2_01of01')")
+
+    tables = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    }
+    assert {
+        "encode_slots",
+        "sequence_stability",
+        "work_leases",
+        "encode_progress",
+        "checksum_cache",
+    } <= tables
+
+
+def test_migrate_from_encoding_ui_baseline():
+    # Missing comma folded Instruction into the project column type
+    conn = baseline(comma="")
+    assert "Instruction" not in schema.table_columns(conn, "encoding_status")
+    schema.migrate(conn)
+    assert "Instruction" in schema.table_columns(conn, "encoding_status")
+    assert conn.execute("SELECT COUNT(*) FROM encoding_status").fetchone()[0] == 2
+
+
+def test_migrate_new_database_and_rerun():
+    conn = sqlite3.connect(":memory:")
+    assert schema.migrate(conn) == list(range(1, schema.SCHEMA_VERSION + 1))
+    assert schema.migrate(conn) == []
+    assert conn.execute("SELECT COUNT(*) FROM encoding_status").fetchone()[0] == 0
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import tarfile
+
+import pytest
+
+import hashing
+import tar_stream
+
+SEQ = "N_123456_01of01"
+
+
+@pytest.fixture
+def sequence(tmp_path):
+    """
+    Small sequence folder with frames in a
+    sub folder and a text file beside them
+    """
+    seq = tmp_path / "processing" / SEQ
+    (seq / "scan01").mkdir(parents=True)
+    for num in range(5):
+        (seq / "scan01" / f"{num:07d}.dpx").write_bytes(os.urandom(3000 + num * 777))
+    (seq / f"{SEQ}_directory_contents.txt").write_text("scan01\n")
+    return seq
+
+
+def wrap(seq, tar_path, cache=None):
+    """
+    Wrap as tar_wrapping_checksum does, manifest
+    and index appended after close
+    """
+    with tar_stream.TeeTarWriter(str(tar_path), cache=cache) as tar:
+        tar.add(str(seq), SEQ)
+    manifest = json.dumps(tar.checksums, indent=4).encode()
+    tar.append_bytes(f"{SEQ}.tar_manifest.md5", manifest)
+    tar.append_bytes(f"{SEQ}.tar{tar_stream.INDEX_SUFFIX}", tar.index_bytes())
+    return tar
+
+
+def test_round_trip(sequence, tmp_path):
+    tar_path = tmp_path / f"{SEQ}.tar"
+    tar = wrap(sequence, tar_path)
+
+    # In-stream MD5s describe the bytes now on disk
+    assert tar.md5 == hashlib.md5(tar_path.read_bytes()).hexdigest()
+    assert tar.size == tar_path.stat().st_size
+    source = {
+        f"{SEQ}/{path.relative_to(sequence)}": hashlib.md5(
+            path.read_bytes()
+        ).hexdigest()
+        for path in sequence.rglob("*")
+        if path.is_file()
+    }
+    assert {name: tar.checksums[name] for name in source} == source
+
+    # Appended members are readable by tarfile, index last
+    with tarfile.open(tar_path) as archive:
+        names = archive.getnames()
+    assert names[-2:] == [f"{SEQ}.tar_manifest.md5", f"{SEQ}.tar_index.json"]
+    readback = tar_stream.read_member_checksums(str(tar_path))
+    assert readback == tar.checksums
+
+    index = tar_stream.read_last_member(str(tar_path), f"{SEQ}.tar_index.json")
+    assert json.loads(index) == tar.index[:-1]
+    assert tar_stream.load_index(str(tar_path)) == tar.index[:-1]
+
+    sample = tar_stream.verify_sample(str(tar_path), 100)
+    assert sample and all(sample.values())
+
+
+def test_sample_finds_damaged_member(sequence, tmp_path):
+    tar_path = tmp_path / f"{SEQ}.tar"
+    tar = wrap(sequence, tar_path)
+    entry = next(item for item in tar.index if item["name"].endswith(".dpx"))
+    with open(tar_path, "r+b") as file:
+        file.seek(entry["data_offset"])
+        file.write(b"\xff\x00")
+
+    sample = tar_stream.verify_sample(str(tar_path), 100, tar.index)
+    assert sample[entry["name"]] is False
+    assert sum(not match for match in sample.values()) == 1
+
+
+def test_read_last_member_checks_name(sequence, tmp_path):
+    tar_path = tmp_path / f"{SEQ}.tar"
+    wrap(sequence, tar_path)
+    with pytest.raises(tarfile.ReadError):
+        tar_stream.read_last_member(str(tar_path), f"{SEQ}.tar_manifest.md5")
+
+
+def test_cached_sources_not_rehashed(sequence, tmp_path, monkeypatch):
+    cache = hashing.ChecksumCache(str(tmp_path / "cache.db"))
+    first = wrap(sequence, tmp_path / "first.tar", cache)
+
+    reads = []
+    original = tar_stream._HashingReader
+
+    def counting_reader(fileobj):
+        reads.append(fileobj.name)
+        return original(fileobj)
+
+    monkeypatch.setattr(tar_stream, "_HashingReader", counting_reader)
+    second = wrap(sequence, tmp_path / "second.tar", cache)
+    assert reads == []
+    assert second.checksums == first.checksums
+
+    # A changed file is hashed again
+    changed = sequence / "scan01" / "0000000.dpx"
+    changed.write_bytes(os.urandom(4000))
+    third = wrap(sequence, tmp_path / "third.tar", cache)
+    assert reads == [str(changed)]
+    name = f"{SEQ}/scan01/0000000.dpx"
+    assert third.checksums[name] == hashlib.md5(changed.read_bytes()).hexdigest()